@@ -0,0 +1,71 @@
+import asyncio
+
+
+class AdmissionController:
+    # Sits between handle_message and the query pipeline. A user's messages
+    # that arrive within `window` seconds of each other are coalesced into one
+    # query, and a new message cancels the user's pipeline that is still
+    # running (its text is folded into the next query). At most
+    # `max_in_flight` pipelines run at once; when `max_queue` more are
+    # already waiting for a slot, new queries are turned away via on_busy.
+
+    def __init__(self, window=0.8, max_in_flight=16, max_queue=64, max_texts=5):
+        self.window = window
+        self.max_queue = max_queue
+        self.max_texts = max_texts
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.waiting = 0
+        self.users = {}  # user_id -> {"texts": [...], "task": asyncio.Task}
+        self.counters = {"messages": 0, "coalesced": 0, "superseded": 0,
+                         "rejected": 0, "completed": 0, "failed": 0}
+
+    def submit(self, user_id, text, run, on_busy):
+        # run(query) runs the pipeline, on_busy() answers an overflow; both
+        # are coroutine functions
+        self.counters["messages"] += 1
+        state = self.users.setdefault(user_id, {"texts": [], "task": None})
+        if state["task"] is not None:
+            self.counters["coalesced"] += 1
+            if state["task"].started:
+                self.counters["superseded"] += 1
+            state["task"].cancel()
+        state["texts"] = (state["texts"] + [text])[-self.max_texts:]
+        task = asyncio.create_task(self._admit(user_id, state, run, on_busy))
+        task.started = False
+        state["task"] = task
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["users"] = len(self.users)
+        stats["waiting"] = self.waiting
+        return stats
+
+    async def _admit(self, user_id, state, run, on_busy):
+        task = asyncio.current_task()
+        try:
+            await asyncio.sleep(self.window)
+            if self.waiting >= self.max_queue:
+                self.counters["rejected"] += 1
+                await on_busy()
+                return
+
+            self.waiting += 1
+            try:
+                await self.slots.acquire()
+            finally:
+                self.waiting -= 1
+            try:
+                task.started = True
+                await run("\n".join(state["texts"]))
+                self.counters["completed"] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.counters["failed"] += 1
+                print(f"So'rovni bajarishda xatolik: {e}")
+            finally:
+                self.slots.release()
+        finally:
+            # A superseded task leaves its texts for the task that replaced it
+            if state["task"] is task:
+                del self.users[user_id]
@@ -0,0 +1,73 @@
+# Simulates users who send short bursts of messages and counts how many
+# pipeline runs (LLM + search + descriptions, faked with a sleep) each
+# admission setting starts, how many finish, how many are cancelled as
+# superseded and how many users get the "busy" reply.
+#
+#   python benchmarks/admission_benchmark.py --users 200 --burst 3 --gap 0.3
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from admission import AdmissionController  # noqa: E402
+
+
+async def simulate(args, window):
+    admission = AdmissionController(window=window, max_in_flight=args.max_in_flight,
+                                    max_queue=args.max_queue)
+    counts = {"started": 0, "finished": 0, "busy": 0}
+    answered = set()
+
+    async def pipeline(user_id, query):
+        counts["started"] += 1
+        await asyncio.sleep(args.pipeline_latency)
+        counts["finished"] += 1
+        answered.add(user_id)
+
+    async def busy():
+        counts["busy"] += 1
+
+    async def user(user_id):
+        rng = random.Random(user_id)
+        await asyncio.sleep(rng.uniform(0, args.spread))
+        for i in range(args.burst):
+            admission.submit(user_id, f"xabar {i}",
+                             lambda query, u=user_id: pipeline(u, query), busy)
+            await asyncio.sleep(rng.uniform(0, 2 * args.gap))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(u) for u in range(args.users)))
+    while admission.users:
+        await asyncio.sleep(0.01)
+    wall = time.perf_counter() - started
+    stats = admission.stats()
+    print(f"window={window:<4} messages={stats['messages']:<5} pipelines started={counts['started']:<5} "
+          f"finished={counts['finished']:<5} superseded={stats['superseded']:<4} "
+          f"busy={counts['busy']:<4} users answered={len(answered)}/{args.users} wall={wall:5.2f}s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Debounce and backpressure simulation for AdmissionController")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=3, help="messages per user")
+    parser.add_argument("--gap", type=float, default=0.3,
+                        help="mean seconds between a user's messages")
+    parser.add_argument("--spread", type=float, default=5.0,
+                        help="seconds over which users start")
+    parser.add_argument("--pipeline-latency", type=float, default=2.0)
+    parser.add_argument("--max-in-flight", type=int, default=16)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--windows", type=float, nargs="+", default=[0.0, 0.8])
+    args = parser.parse_args()
+
+    for window in args.windows:
+        await simulate(args, window)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
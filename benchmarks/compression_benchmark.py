@@ -0,0 +1,130 @@
+# Vector compression on the real listings: float16, int8 scalar quantization
+# and PCA reduction, each searched with and without float32 rescoring.
+# Reports the size of the searched copy, recall@k against the exact float32
+# scan, and latency. Queries are the labelled place-name queries plus noisy
+# copies of listing vectors. --scale multiplies the listings with a little
+# vector noise to see how latency grows; --url also runs Qdrant server
+# int8 quantization with and without rescoring.
+#
+#   python benchmarks/compression_benchmark.py
+#   python benchmarks/compression_benchmark.py --scale 100 --url http://localhost:6333
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from encoders import load_encoder  # noqa: E402
+from filter_benchmark import COLLECTION, build_collection, load_points  # noqa: E402
+from hybrid_retrieval_benchmark import LABELLED_QUERIES  # noqa: E402
+from vector_store import QdrantStore, SnapshotStore, export_snapshot  # noqa: E402
+
+VARIANTS = [
+    # (name, compression, pca dimension)
+    ("float32", "none", None),
+    ("float16", "float16", None),
+    ("int8", "int8", None),
+    ("pca128 float32", "none", 128),
+    ("pca128 float16", "float16", 128),
+    ("pca128 int8", "int8", 128),
+]
+
+
+def run_queries(store, queries, k):
+    latencies, results = [], []
+    for vector in queries:
+        started = time.perf_counter()
+        hits = store.search(vector, k)
+        latencies.append(time.perf_counter() - started)
+        results.append([hit.id for hit in hits])
+    return latencies, results
+
+
+def recall(results, truth):
+    return statistics.mean(len(set(r) & set(t)) / len(t) for r, t in zip(results, truth))
+
+
+def report(name, store, queries, truth, k, bytes_per_vector):
+    run_queries(store, queries[:10], k)  # warm up
+    latencies, results = run_queries(store, queries, k)
+    latencies.sort()
+    print(f"{name:<26} {bytes_per_vector:>7} {recall(results, truth):>9.3f} "
+          f"{statistics.median(latencies) * 1000:>8.2f} "
+          f"{latencies[int(len(latencies) * 0.95)] * 1000:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vector compression: recall and latency")
+    parser.add_argument("--storage", default=os.path.join(ROOT, "qdrant_storage"))
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--oversampling", type=float, default=4.0)
+    parser.add_argument("--url", help="Qdrant server for the quantized collection rows")
+    args = parser.parse_args()
+
+    points = load_points(args.storage)
+    client = QdrantClient(":memory:")
+    total = build_collection(client, points, args.scale)
+    dimension = len(points[0].vector)
+
+    encoder = load_encoder()
+    rng = np.random.default_rng(1)
+    queries = [vector.tolist() for vector in encoder.encode([q for q, _ in LABELLED_QUERIES])]
+    while len(queries) < args.queries:
+        vector = np.asarray(points[rng.integers(len(points))].vector)
+        queries.append((vector + rng.normal(0, 0.05, dimension)).tolist())
+    print(f"{total:,} points ({len(points)} listings x {args.scale}), {len(queries)} queries")
+
+    directory = tempfile.mkdtemp()
+    stores = {}
+    for name, compression, pca in VARIANTS:
+        path = os.path.join(directory, name.replace(" ", "-"))
+        export_snapshot(client, COLLECTION, path, compression=compression, pca_dimension=pca)
+        stores[name] = path
+
+    _, truth = run_queries(SnapshotStore(stores["float32"]), queries, args.k)
+    print(f"{'variant':<26} {'B/vec':>7} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, compression, pca in VARIANTS:
+        width = pca or dimension
+        size = width * {"none": 4, "float16": 2, "int8": 1}[compression]
+        for oversampling in ((0,) if name == "float32" else (0, args.oversampling)):
+            label = name if not oversampling else f"{name} +rescore x{oversampling:g}"
+            report(label, SnapshotStore(stores[name], oversampling=oversampling),
+                   queries, truth, args.k, size)
+
+    if args.url:
+        server = QdrantClient(url=args.url)
+        name = "compression_benchmark"
+        if server.collection_exists(name):
+            server.delete_collection(name)
+        server.create_collection(
+            name, vectors_config=models.VectorParams(
+                size=dimension, distance=models.Distance.COSINE, on_disk=True),
+            quantization_config=models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8, quantile=0.99, always_ram=True)))
+        offset = None
+        while True:
+            records, offset = client.scroll(COLLECTION, limit=1000, offset=offset, with_vectors=True)
+            server.upload_points(name, [models.PointStruct(id=r.id, vector=r.vector, payload=r.payload)
+                                        for r in records])
+            if offset is None:
+                break
+        while server.get_collection(name).status != models.CollectionStatus.GREEN:
+            time.sleep(0.5)
+        report("qdrant int8", QdrantStore(server, name), queries, truth, args.k, dimension)
+        report(f"qdrant int8 +rescore x{args.oversampling:g}",
+               QdrantStore(server, name, oversampling=args.oversampling),
+               queries, truth, args.k, dimension)
+        server.delete_collection(name)
+
+
+if __name__ == "__main__":
+    main()
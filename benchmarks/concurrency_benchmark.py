@@ -0,0 +1,173 @@
+# Throughput benchmark for the query pipeline (bot.process_query, what
+# handle_message runs after admission) under concurrent users.
+#
+# Gemini is replaced by a fake model that sleeps for LLM_LATENCY seconds so the
+# numbers do not depend on quota or network; encoding and Qdrant search are real.
+#
+#   python benchmarks/concurrency_benchmark.py --users 1 8 32 --llm-latency 0.8
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+from credit_store import CreditStore  # noqa: E402
+from description_cache import DescriptionCache  # noqa: E402
+from photo_cache import PhotoCache  # noqa: E402
+from session_store import SessionStore  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    latency = 0.8
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def generate_content(self, prompt):
+        time.sleep(self.latency)
+        return FakeResponse(self._answer(prompt))
+
+    async def generate_content_async(self, prompt):
+        await asyncio.sleep(self.latency)
+        return FakeResponse(self._answer(prompt))
+
+    def _answer(self, prompt):
+        if '"is_real_estate"' in prompt:
+            return json.dumps({
+                "is_real_estate": True,
+                "search_query": "Chilonzorda 2 xonali kvartira",
+                "filters": {},
+            })
+        return "Chilonzorda 2 xonali kvartira"
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text):
+        self.replies.append((time.perf_counter(), text))
+
+
+class FakeBot:
+    username = "beda_top_bot"
+
+    async def send_chat_action(self, chat_id, action):
+        pass
+
+    async def send_media_group(self, chat_id, media):
+        return [SimpleNamespace(photo=[SimpleNamespace(file_id=f"file-{hash(item.media)}")])
+                for item in media]
+
+    async def send_photo(self, chat_id, photo):
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=f"file-{hash(photo)}")])
+
+
+def make_update(user_id, text):
+    return SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id),
+        message=FakeMessage(text),
+    )
+
+
+async def run_user(user_id, context):
+    update = make_update(user_id, "Chilonzorda 2 xonali kvartira")
+    started = time.perf_counter()
+    await bot.process_query(update, context, user_id, update.message.text)
+    first = update.message.replies[0][0] if update.message.replies else time.perf_counter()
+    return first - started, time.perf_counter() - started
+
+
+def reset_caches():
+    bot.description_cache = DescriptionCache(
+        os.path.join(tempfile.mkdtemp(), "bench_description_cache.db"))
+    bot.query_cache.invalidate()
+
+
+async def run_round(users, concurrent, warm_cache):
+    # All users send the same text. Without --warm-cache every user pays the
+    # LLM latency: concurrent users all look the caches up before any of
+    # them has stored anything, and sequential ones start from empty caches.
+    context = SimpleNamespace(bot=FakeBot(), args=[])
+    if not warm_cache:
+        reset_caches()
+    started = time.perf_counter()
+    if concurrent:
+        results = await asyncio.gather(*(run_user(uid, context) for uid in range(1, users + 1)))
+    else:
+        results = []
+        for uid in range(1, users + 1):
+            if not warm_cache:
+                # Not timed as part of the user's request
+                paused = time.perf_counter()
+                reset_caches()
+                started += time.perf_counter() - paused
+            results.append(await run_user(uid, context))
+    wall = time.perf_counter() - started
+    return wall, [r[0] for r in results], [r[1] for r in results]
+
+
+def report(label, users, wall, first, total):
+    total_sorted = sorted(total)
+    p95 = total_sorted[max(0, int(len(total_sorted) * 0.95) - 1)]
+    print(f"{label:<11} users={users:<3} wall={wall:7.2f}s  "
+          f"throughput={users / wall:6.2f} req/s  "
+          f"first reply p50={statistics.median(first):5.2f}s  "
+          f"total p50={statistics.median(total):5.2f}s p95={p95:5.2f}s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Throughput of the query pipeline under concurrent users")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--skip-sequential", action="store_true")
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="keep the description and query caches between rounds")
+    parser.add_argument("--card-order", choices=["rank", "completed"], default=bot.CARD_ORDER)
+    args = parser.parse_args()
+
+    bot.CARD_ORDER = args.card_order
+
+    # Load the encoder and the Qdrant store before swapping Gemini out
+    await bot.run_blocking(bot.warm_up)
+    bot.services_ready.set()
+
+    FakeModel.latency = args.llm_latency
+    bot.llm = FakeModel()
+    bot.query_llm = FakeModel()
+
+    # Never touch the real credit, session and photo databases
+    bot.credit_store = CreditStore(
+        os.path.join(tempfile.mkdtemp(), "bench_user_data.db"),
+        starting_credits=10 ** 6)
+    bot.session_store = SessionStore()
+    bot.photo_cache = PhotoCache(os.path.join(tempfile.mkdtemp(), "bench_photo_cache.db"))
+    reset_caches()
+
+    await bot.retrieve_relevant_properties(await bot.embed_query("warm up"))
+
+    for users in args.users:
+        if not args.skip_sequential:
+            report("sequential", users,
+                   *await run_round(users, False, args.warm_cache))
+        report("concurrent", users,
+               *await run_round(users, True, args.warm_cache))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+# Hammers CreditStore from many concurrent asyncio tasks and checks that no
+# charge is lost or double-spent, balances never go negative and a user's
+# referral bonus is paid only once. Exits non-zero if an invariant breaks.
+# With --ledger it runs against the write-behind CreditLedger instead, then
+# simulates a crash (journal not flushed) and checks the replay on restart.
+#
+#   python benchmarks/credit_store_stress.py --users 50 --tasks 400 --charges 25
+#   python benchmarks/credit_store_stress.py --ledger --flush-interval 0.05
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from credit_store import CreditLedger, CreditStore  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Concurrency stress test for CreditStore")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=400)
+    parser.add_argument("--charges", type=int, default=25,
+                        help="charge attempts per task")
+    parser.add_argument("--starting-credits", type=int, default=100)
+    parser.add_argument("--ledger", action="store_true",
+                        help="use the write-behind CreditLedger")
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    db_path = os.path.join(tmpdir, "stress_user_data.db")
+    journal_dir = os.path.join(tmpdir, "credit_journal")
+    store = CreditStore(db_path, starting_credits=args.starting_credits)
+    if args.ledger:
+        store = CreditLedger(store, journal_dir, flush_interval=args.flush_interval)
+        store.start()
+    users = list(range(1, args.users + 1))
+    successes = {user: 0 for user in users}
+    refunds = {user: 0 for user in users}
+
+    async def worker(seed):
+        rng = random.Random(seed)
+        for _ in range(args.charges):
+            user = rng.choice(users)
+            balance = await store.charge(user)
+            if balance is None:
+                continue
+            assert balance >= 0, f"negative balance {balance} for user {user}"
+            successes[user] += 1
+            # Some requests fail and give their credit back
+            if rng.random() < 0.1:
+                await store.refund(user)
+                refunds[user] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(seed) for seed in range(args.tasks)))
+    elapsed = time.perf_counter() - started
+    operations = args.tasks * args.charges + sum(refunds.values())
+
+    for user in users:
+        expected = args.starting_credits - successes[user] + refunds[user]
+        actual = await store.get_credits(user)
+        assert actual == expected, f"user {user}: expected {expected}, got {actual}"
+        assert successes[user] - refunds[user] <= args.starting_credits
+
+    # Many tasks race to register the same referral; only one may pay out
+    referrer, referred = users[0], args.users + 1000
+    before = await store.get_credits(referrer)
+    recorded = await asyncio.gather(
+        *(store.add_referral(referred, referrer) for _ in range(100)))
+    assert sum(recorded) == 1, f"referral recorded {sum(recorded)} times"
+    assert await store.get_credits(referrer) == before + store.referral_bonus
+
+    if args.ledger:
+        # Crash: more charges land in the journal, the process dies before the
+        # next flush, and a fresh ledger has to replay them from the journal
+        store.flusher.cancel()
+        await store.flush()
+        for user in users:
+            if await store.charge(user) is not None:
+                successes[user] += 1
+        store.journal.flush()
+        expected = {user: await store.get_credits(user) for user in users}
+        expected[referrer] = await store.get_credits(referrer)
+        store.store.close()
+
+        store = CreditLedger(CreditStore(db_path, starting_credits=args.starting_credits),
+                             journal_dir)
+        for user, credits in expected.items():
+            actual = await store.get_credits(user)
+            assert actual == credits, f"after replay user {user}: expected {credits}, got {actual}"
+        assert await store.add_referral(referred, referrer) is False
+        await store.close()
+    else:
+        store.close()
+    print(f"OK: {operations} operations from {args.tasks} tasks in {elapsed:.2f}s "
+          f"({operations / elapsed:,.0f} ops/s), "
+          f"{sum(successes.values())} charges, {sum(refunds.values())} refunds")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+# Query-encoding throughput with and without the micro-batching
+# EmbeddingBatcher, at several levels of concurrency.
+#
+#   python benchmarks/embedding_batch_benchmark.py --users 1 8 32 --duration 5
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+from embedding_service import EmbeddingBatcher  # noqa: E402
+from encoders import load_encoder  # noqa: E402
+
+QUERIES = [
+    "Chilonzorda 2 xonali kvartira",
+    "Yunusobod 19-kvartal 3 xonali uy",
+    "Квартира в новостройке до 60 тысяч долларов",
+    "Sergelida arzon hovli",
+    "2 bedroom apartment near metro",
+    "Mirzo Ulug'bek tumanida yangi uy",
+]
+
+# Loaded in main(); the rest of bot.warm_up() is not needed here
+encoder = None
+
+
+async def direct_encode(text):
+    return await bot.run_blocking(encoder.encode, text)
+
+
+async def run_user(encode, user, deadline, latencies):
+    i = user
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await encode(f"{QUERIES[i % len(QUERIES)]} {i}")
+        latencies.append(time.perf_counter() - started)
+        i += 1
+
+
+async def run(encode, users, duration):
+    latencies = []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(encode, user, deadline, latencies)
+                           for user in range(users)))
+    return len(latencies) / (time.perf_counter() - started), latencies
+
+
+def report(label, users, throughput, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:<8} users={users:<3} {throughput:8.1f} encodes/s  "
+          f"p50={statistics.median(latencies) * 1000:7.2f} ms  p95={p95 * 1000:7.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Query-encoding throughput with and without micro-batching")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    global encoder
+    encoder = load_encoder()
+    encoder.encode(QUERIES)
+
+    for users in args.users:
+        throughput, latencies = await run(direct_encode, users, args.duration)
+        report("direct", users, throughput, latencies)
+
+        batcher = EmbeddingBatcher(encoder, bot.executor,
+                                   max_batch_size=args.max_batch,
+                                   max_wait=args.max_wait_ms / 1000)
+        throughput, latencies = await run(batcher.encode, users, args.duration)
+        report("batched", users, throughput, latencies)
+        print(f"         mean batch size {batcher.stats()['mean_batch_size']:.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
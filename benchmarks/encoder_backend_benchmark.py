@@ -0,0 +1,142 @@
+# Compares encoder backends (torch, onnx, onnx-int8): load time, resident
+# memory, single-query latency, batch throughput and retrieval agreement with
+# the torch backend over the listings in uybor_listings.db. Each backend runs
+# in its own process so RSS numbers are not mixed up.
+#
+#   python export_onnx_encoder.py   # once, to create the ONNX models
+#   python benchmarks/encoder_backend_benchmark.py --backends torch onnx onnx-int8
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+QUERIES = [
+    "Chilonzorda 2 xonali kvartira",
+    "Yunusobod 19-kvartal 3 xonali uy",
+    "Квартира в новостройке до 60 тысяч долларов",
+    "Sergelida arzon hovli",
+    "2 bedroom apartment near metro",
+    "Mirzo Ulug'bek tumanida yangi uy",
+    "дом с участком в Ташкентской области",
+    "evro ta'mirli 4 xonali kvartira",
+    "kirpich uy, 3 xona, Olmazor",
+    "1 xonali kvartira 30 ming dollargacha",
+]
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def read_documents(db_path, limit):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("""
+        SELECT l.*, GROUP_CONCAT(p.photo_url) as photos
+        FROM listings l
+        LEFT JOIN photos p ON l.id = p.listing_id
+        GROUP BY l.id
+        LIMIT ?
+    """, (limit,)).fetchall()
+    conn.close()
+    return [str(row) for row in rows]
+
+
+def worker(backend, db_path, limit, output):
+    from encoders import load_encoder
+
+    baseline_rss = rss_mb()
+    started = time.perf_counter()
+    encoder = load_encoder(backend)
+    load_time = time.perf_counter() - started
+
+    documents = read_documents(db_path, limit)
+    encoder.encode(QUERIES[:2])  # warm up
+
+    latencies = []
+    for _ in range(5):
+        for query in QUERIES:
+            started = time.perf_counter()
+            encoder.encode(query)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    doc_vectors = np.asarray(encoder.encode(documents, batch_size=32))
+    batch_time = time.perf_counter() - started
+    query_vectors = np.asarray(encoder.encode(QUERIES))
+
+    np.savez(output + ".npz", documents=doc_vectors, queries=query_vectors)
+    with open(output + ".json", "w") as f:
+        json.dump({
+            "load_time": load_time,
+            "rss_mb": rss_mb(),
+            "rss_delta_mb": rss_mb() - baseline_rss,
+            "query_p50_ms": statistics.median(latencies) * 1000,
+            "docs_per_second": len(documents) / batch_time,
+        }, f)
+
+
+def top_k(queries, documents, k):
+    return [set(row) for row in np.argsort(-(queries @ documents.T), axis=1)[:, :k]]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare encoder backends")
+    parser.add_argument("--backends", nargs="+",
+                        default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--db", default=os.path.join(ROOT, "uybor_listings.db"))
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.db, args.limit, args.output)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    results = {}
+    for backend in args.backends:
+        output = os.path.join(tmpdir, backend)
+        subprocess.run([sys.executable, os.path.abspath(__file__),
+                        "--worker", backend, "--output", output,
+                        "--db", args.db, "--limit", str(args.limit)], check=True)
+        with open(output + ".json") as f:
+            results[backend] = json.load(f)
+        results[backend]["vectors"] = np.load(output + ".npz")
+
+    reference = results[args.backends[0]]["vectors"]
+    reference_top = top_k(reference["queries"], reference["documents"], args.k)
+    print(f"{'backend':<10} {'load s':>7} {'RSS MB':>8} {'+RSS MB':>8} "
+          f"{'query ms':>9} {'docs/s':>8} {'cosine':>7} {f'top{args.k} agree':>11}")
+    for backend, result in results.items():
+        vectors = result["vectors"]
+        cosine = float(np.mean(np.sum(vectors["documents"] * reference["documents"], axis=1)))
+        agreement = np.mean([len(a & b) / args.k for a, b in zip(
+            top_k(vectors["queries"], vectors["documents"], args.k), reference_top)])
+        print(f"{backend:<10} {result['load_time']:7.2f} {result['rss_mb']:8.1f} "
+              f"{result['rss_delta_mb']:8.1f} {result['query_p50_ms']:9.2f} "
+              f"{result['docs_per_second']:8.1f} {cosine:7.4f} {agreement:11.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# Accuracy and latency of the local real-estate classifier against the Gemini
+# gate (the verdict returned by bot.understand_query), and a calibration
+# table for CLASSIFIER_LOW / CLASSIFIER_HIGH: for each threshold, how many
+# queries it would reject or accept locally and how many of those wrongly.
+# Run it with the deployed encoder before setting either variable.
+#
+#   python benchmarks/evaluate_classifier.py            # needs GOOGLE_API_KEY
+#   python benchmarks/evaluate_classifier.py --skip-llm # local classifier only
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot  # noqa: E402
+from classifier import RealEstateClassifier  # noqa: E402
+from encoders import load_encoder  # noqa: E402
+
+# Held-out queries, none of them are in classifier.py's example lists
+EVAL_QUERIES = [
+    ("Olmazorda 3 xonali kvartira bormi", True),
+    ("Sergeli tumanida arzon uy", True),
+    ("yangi uylardan 1 xonali", True),
+    ("70 ming dollargacha hovli", True),
+    ("Yakkasaroyda ijaraga xonadon", True),
+    ("kvartira 5-qavatda bo'lsin", True),
+    ("Shayxontohurda yer sotiladi", True),
+    ("3 xonali, ta'mirli, metro yonida", True),
+    ("Мирободда 2 хонали уй", True),
+    ("Сергелида ҳовли жой", True),
+    ("Однокомнатная квартира в Юнусабаде", True),
+    ("дом с участком в Ташкентской области", True),
+    ("квартира в новостройке до 60 тысяч", True),
+    ("сдам квартиру на длительный срок", True),
+    ("Studio apartment in Mirabad", True),
+    ("looking for a house with a garden", True),
+    ("cheapest 2 room flat", True),
+    ("Bektemirda kvartira narxi", True),
+    ("Chilonzor 9-kvartal uy", True),
+    ("penthouse in Tashkent City", True),
+    ("ertaga yomg'ir yog'adimi", False),
+    ("qanday qilib pul topsa bo'ladi", False),
+    ("menga hazil aytib ber", False),
+    ("Toshkentdan Samarqandga poyezd", False),
+    ("eng yaxshi telefon qaysi", False),
+    ("яхши китоб тавсия қил", False),
+    ("бугун нечанчи сана", False),
+    ("Как дела у тебя", False),
+    ("сколько стоит Chevrolet Cobalt", False),
+    ("лучший ресторан в Ташкенте", False),
+    ("напиши сочинение про осень", False),
+    ("what is the capital of France", False),
+    ("translate hello to Uzbek", False),
+    ("how to cook samsa", False),
+    ("recommend a good movie", False),
+    ("football schedule this week", False),
+    ("kurs ishini yozib ber", False),
+    ("salom bot", False),
+    ("iPhone 15 narxi", False),
+    ("ish bormi dasturchi uchun", False),
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def calibrate(scores):
+    # scores: (score, label, text). Suggests the highest CLASSIFIER_LOW that
+    # rejects no real-estate query and the lowest CLASSIFIER_HIGH that
+    # accepts no other query, each with a 0.01 margin.
+    total = len(scores)
+    print(f"\n{'threshold':>9} {'rejected':>9} {'wrong':>6} {'accepted':>9} {'wrong':>6}")
+    for step in range(-10, 11):
+        threshold = step / 100
+        rejected = [label for score, label, _ in scores if score <= threshold]
+        accepted = [label for score, label, _ in scores if score >= threshold]
+        print(f"{threshold:>+9.2f} {len(rejected) / total:>9.0%} {sum(rejected):>6} "
+              f"{len(accepted) / total:>9.0%} {len(accepted) - sum(accepted):>6}")
+    lowest_positive = min(score for score, label, _ in scores if label)
+    highest_negative = max(score for score, label, _ in scores if not label)
+    print(f"suggested: CLASSIFIER_LOW={lowest_positive - 0.01:+.3f} "
+          f"CLASSIFIER_HIGH={highest_negative + 0.01:+.3f}")
+
+
+def report(label, correct, total, latencies):
+    print(f"{label:<22} accuracy={correct / total:6.1%} ({correct}/{total})  "
+          f"latency p50={statistics.median(latencies) * 1000:8.2f} ms  "
+          f"p95={percentile(latencies, 0.95) * 1000:8.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Evaluate the local real-estate classifier")
+    parser.add_argument("--skip-llm", action="store_true",
+                        help="do not call Gemini (local classifier only)")
+    args = parser.parse_args()
+
+    # Only the encoder, the classifier and (for the comparison) the Gemini
+    # client; the vector store is not needed here
+    encoder = load_encoder()
+    # The configured thresholds, or the defaults to calibrate from
+    classifier = bot.build_classifier(encoder) or RealEstateClassifier(encoder)
+    if not args.skip_llm:
+        bot.setup_gemini()
+
+    local_correct = local_decided = 0
+    local_latencies, scores = [], []
+    verdicts = []
+    for text, label in EVAL_QUERIES:
+        started = time.perf_counter()
+        vector = encoder.encode(text)
+        verdict = classifier.classify(vector)
+        local_latencies.append(time.perf_counter() - started)
+        scores.append((classifier.score(vector), label, text))
+        verdicts.append(verdict)
+        if verdict is not None:
+            local_decided += 1
+            local_correct += verdict == label
+
+    total = len(EVAL_QUERIES)
+    low = "off" if classifier.low is None else f"{classifier.low:+.2f}"
+    print(f"local classifier decided {local_decided}/{total} queries "
+          f"(reject <= {low}, accept >= {classifier.high:+.2f})")
+    if local_decided:
+        report("local (decided only)", local_correct,
+               local_decided, local_latencies)
+    middle = classifier.high if classifier.low is None else (classifier.low + classifier.high) / 2
+    forced = sum((score > middle) == label for score, label, _ in scores)
+    report("local (forced)", forced, total, local_latencies)
+    calibrate(scores)
+
+    if not args.skip_llm:
+        llm_correct = hybrid_correct = 0
+        llm_latencies, hybrid_latencies = [], []
+        for (text, label), verdict, local_latency in zip(EVAL_QUERIES, verdicts, local_latencies):
+            started = time.perf_counter()
+            understanding = await bot.understand_query(text, "")
+            llm_latency = time.perf_counter() - started
+            llm_latencies.append(llm_latency)
+            llm_correct += understanding["is_real_estate"] == label
+
+            if verdict is None:
+                hybrid_correct += understanding["is_real_estate"] == label
+                hybrid_latencies.append(local_latency + llm_latency)
+            else:
+                hybrid_correct += verdict == label
+                hybrid_latencies.append(local_latency)
+
+        report("gemini gate", llm_correct, total, llm_latencies)
+        report("local + gemini band", hybrid_correct, total, hybrid_latencies)
+
+    print("\nmisclassified or uncertain:")
+    for (score, label, text), verdict in zip(scores, verdicts):
+        if verdict != label:
+            print(f"  {score:+.3f}  expected={label!s:<5}  {text}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
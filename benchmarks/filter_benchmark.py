@@ -0,0 +1,144 @@
+# Filtered vs unfiltered search: latency, candidate set size and precision
+# (share of the top-k that actually satisfies the query's structured
+# filters). Points are copied from the bot's collection and multiplied with a
+# little vector noise (--scale) into a scratch collection, in memory or on a
+# Qdrant server (--url, where the payload indexes from setup_qdrant apply).
+# Local mode has no payload indexes and checks filters point by point in
+# Python, so there filtered searches are slower; the latency gain needs a
+# server.
+#
+#   python benchmarks/filter_benchmark.py --scale 200
+#   python benchmarks/filter_benchmark.py --scale 200 --url http://localhost:6333
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import bot  # noqa: E402
+
+COLLECTION = "filter_benchmark"
+
+# Structured filters as understand_query would extract them
+FILTERS = [
+    {"rooms": 2, "price_max": 50000, "price_currency": "usd"},
+    {"rooms": 3},
+    {"price_min": 80000, "price_max": 150000, "price_currency": "usd"},
+    {"is_new_building": True, "rooms": 1},
+    {"square_min": 60, "square_max": 90},
+    {"rooms": 4, "is_new_building": False, "price_max": 120000, "price_currency": "usd"},
+]
+
+
+def load_points(storage_path):
+    # Copy the storage first: local Qdrant locks its directory
+    copy = os.path.join(tempfile.mkdtemp(), "qdrant_storage")
+    shutil.copytree(storage_path, copy)
+    source = QdrantClient(path=copy)
+    points, offset = [], None
+    while True:
+        batch, offset = source.scroll(bot.collection_name, limit=256, offset=offset,
+                                      with_vectors=True)
+        points.extend(batch)
+        if offset is None:
+            break
+    source.close()
+    return points
+
+
+def build_collection(client, points, scale, seed=0):
+    rng = np.random.default_rng(seed)
+    dimension = len(points[0].vector)
+    if client.collection_exists(COLLECTION):
+        client.delete_collection(COLLECTION)
+    client.create_collection(COLLECTION, vectors_config=models.VectorParams(
+        size=dimension, distance=models.Distance.COSINE))
+    for field, schema in bot.FILTER_INDEXES.items():
+        client.create_payload_index(COLLECTION, field_name=field, field_schema=schema)
+
+    point_id = 0
+    for copy in range(scale):
+        batch = []
+        for point in points:
+            vector = np.asarray(point.vector)
+            if copy:
+                vector = vector + rng.normal(0, 0.02, dimension)
+            point_id += 1
+            batch.append(models.PointStruct(id=point_id, vector=vector.tolist(),
+                                            payload=point.payload))
+        client.upload_points(COLLECTION, batch)
+    return point_id
+
+
+def matches(payload, filters):
+    # Python version of build_search_filter, for scoring unfiltered hits
+    rooms = filters.get("rooms")
+    if rooms and payload.get("room") != (str(rooms) if rooms < 6 else "6+"):
+        return False
+    if "is_new_building" in filters and payload.get("is_new_building") != int(filters["is_new_building"]):
+        return False
+    for low_key, high_key, field in (("price_min", "price_max", "price"),
+                                     ("square_min", "square_max", "square")):
+        value = payload.get(field)
+        if low_key in filters or high_key in filters:
+            if value is None:
+                return False
+            if value < filters.get(low_key, float("-inf")) or value > filters.get(high_key, float("inf")):
+                return False
+    if "price_currency" in filters and payload.get("price_currency") != filters["price_currency"]:
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Filtered vs unfiltered Qdrant search")
+    parser.add_argument("--storage", default=os.path.join(ROOT, "qdrant_storage"))
+    parser.add_argument("--url", help="Qdrant server; in-memory local mode if omitted")
+    parser.add_argument("--scale", type=int, default=100,
+                        help="copies of each listing in the scratch collection")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    points = load_points(args.storage)
+    client = QdrantClient(url=args.url) if args.url else QdrantClient(":memory:")
+    total = build_collection(client, points, args.scale)
+    print(f"{total:,} points ({len(points)} listings x {args.scale})")
+
+    rng = np.random.default_rng(1)
+    query_vectors = [points[i].vector for i in rng.integers(0, len(points), args.queries)]
+
+    print(f"{'filters':<72} {'candidates':>10} {'unfiltered ms':>13} {'filtered ms':>11} "
+          f"{'precision':>9} {'filtered':>8}")
+    for filters in FILTERS:
+        query_filter = bot.build_search_filter(filters)
+        candidates = client.count(COLLECTION, count_filter=query_filter, exact=True).count
+        timings = {"unfiltered": [], "filtered": []}
+        precision = {"unfiltered": [], "filtered": []}
+        for vector in query_vectors:
+            for mode, search_filter in (("unfiltered", None), ("filtered", query_filter)):
+                started = time.perf_counter()
+                hits = client.search(COLLECTION, query_vector=vector,
+                                     query_filter=search_filter, limit=args.k)
+                timings[mode].append(time.perf_counter() - started)
+                if hits:
+                    precision[mode].append(
+                        sum(matches(hit.payload, filters) for hit in hits) / len(hits))
+        print(f"{str(filters):<72} {candidates:>10,} "
+              f"{statistics.median(timings['unfiltered']) * 1000:13.2f} "
+              f"{statistics.median(timings['filtered']) * 1000:11.2f} "
+              f"{statistics.mean(precision['unfiltered'] or [0]):9.0%} "
+              f"{statistics.mean(precision['filtered'] or [0]):8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Dense-only vs hybrid (dense + BM25, reciprocal rank fusion) retrieval on a
+# labelled set of place-name queries. A listing is relevant to a query when
+# its address or description matches the query's pattern, so the labels come
+# straight from uybor_listings.db. Reports recall@k, MRR and latency.
+#
+#   python benchmarks/hybrid_retrieval_benchmark.py --k 5
+import argparse
+import asyncio
+import os
+import re
+import sqlite3
+import statistics
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import bot  # noqa: E402
+
+# (query as a user would type it, pattern over address + description)
+LABELLED_QUERIES = [
+    ("Darxonda kvartira", r"дархан"),
+    ("Mustaqillik prospektida uy", r"мустакиллик"),
+    ("Chilonzor tumanida 3 xonali kvartira", r"чиланзар"),
+    ("Minor metro yaqinida kvartira", r"минор"),
+    ("Yunusobod tumanida uy", r"юнусабад"),
+    ("Bobur ko'chasida kvartira", r"бабур"),
+    ("Sayram ko'chasi", r"сайрам"),
+    ("Mirzo Ulug'bek tumani", r"мирзо.улугбек"),
+    ("Buyuk Ipak Yo'li", r"буюк ипак"),
+    ("Yakkasaroy tumanida kvartira", r"яккасара"),
+    ("Zarbuloq ko'chasi", r"зарбул"),
+    ("Olmazor tumani", r"алмазар|олмазор"),
+    ("Sergelida uy", r"сергел"),
+    ("Shayxontohur tumani", r"шайхантаур|шайхонтохур"),
+    ("Yashnobodda kvartira", r"яшнабад|яшнобод"),
+    ("Mirobod tumani", r"мирабад|миробод"),
+    ("Qoraqamishda kvartira", r"каракамыш|қорақамиш"),
+    ("Beshyog'och", r"бешагач|бешёгоч"),
+    ("Faziltepa ko'chasi", r"фазылтеп"),
+    ("Nukus ko'chasida kvartira", r"нукус"),
+    ("Botanika bog'i yaqinida", r"ботаническ"),
+    ("Amir Temur ko'chasi", r"амир.темур"),
+    ("Bunyodkor prospekti", r"бунёдкор|бунедкор"),
+    ("Halqa yo'li yaqinida", r"кольцев"),
+]
+
+
+def labelled_set(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT id, LOWER(COALESCE(address, '') || ' ' || COALESCE(description, '')) FROM listings").fetchall()
+    conn.close()
+    labelled = []
+    for query, pattern in LABELLED_QUERIES:
+        # SQLite's LOWER only folds ASCII, so lower again in Python
+        relevant = {listing_id for listing_id, text in rows
+                    if re.search(pattern, text.lower())}
+        if relevant:
+            labelled.append((query, relevant))
+    return labelled
+
+
+async def evaluate(labelled, k, hybrid):
+    recalls, reciprocal_ranks, latencies = [], [], []
+    for query, relevant in labelled:
+        vector = await bot.embed_query(query)
+        started = time.perf_counter()
+        hits = await bot.retrieve_relevant_properties(
+            vector, top_k=k, query_text=query if hybrid else None)
+        latencies.append(time.perf_counter() - started)
+        ids = [hit.id for hit in hits]
+        recalls.append(len(relevant & set(ids)) / min(len(relevant), k))
+        ranks = [rank for rank, point_id in enumerate(ids, 1) if point_id in relevant]
+        reciprocal_ranks.append(1 / ranks[0] if ranks else 0.0)
+    return statistics.mean(recalls), statistics.mean(reciprocal_ranks), latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Dense-only vs hybrid retrieval on labelled place-name queries")
+    parser.add_argument("--db", default=os.path.join(ROOT, "uybor_listings.db"))
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    bot.HYBRID_SEARCH = True
+    await bot.run_blocking(bot.warm_up)
+    labelled = labelled_set(args.db)
+    print(f"{len(labelled)} labelled queries, "
+          f"{statistics.mean(len(r) for _, r in labelled):.1f} relevant listings each")
+
+    for name, hybrid in (("dense", False), ("hybrid", True)):
+        await evaluate(labelled, args.k, hybrid)  # warm up
+        recall, mrr, latencies = await evaluate(labelled, args.k, hybrid)
+        print(f"{name:<7} recall@{args.k}={recall:.3f} MRR={mrr:.3f} "
+              f"latency p50={statistics.median(latencies) * 1000:.2f}ms "
+              f"max={max(latencies) * 1000:.2f}ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+# Initial collection load: the old setup_qdrant path (fetchall, one encode
+# call per listing, every PointStruct in one list) vs the streaming ingest
+# (fetchmany, batched encode, chunked upload_points). uybor_listings.db is
+# cloned with fresh ids up to --listings rows. Each path runs in its own
+# process so peak RSS is measured separately; the old path only gets
+# --legacy-limit listings, since it is slow, and its throughput is compared
+# per listing. The restore row is what a serving node does at startup when
+# build_index.py has produced a snapshot: load vectors, encode nothing.
+#
+#   python benchmarks/ingest_benchmark.py --listings 100000 --legacy-limit 5000
+#   python benchmarks/ingest_benchmark.py --url http://localhost:6333 --parallel 4
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from qdrant_client import QdrantClient, models  # noqa: E402
+
+from build_index import listing_batches  # noqa: E402
+from encoders import load_encoder  # noqa: E402
+from ingest import Progress, ingest_listings  # noqa: E402
+from listings import count_listings, listing_payload, read_from_sqlite  # noqa: E402
+from vector_store import restore_snapshot, write_snapshot  # noqa: E402
+
+COLLECTION = "ingest_benchmark"
+
+
+def build_database(source_path, path, listings):
+    # Copies of every source listing (and its photos) under new ids until
+    # there are `listings` rows
+    conn = sqlite3.connect(path)
+    conn.execute("ATTACH DATABASE ? AS source", (source_path,))
+    for (sql,) in conn.execute(
+            "SELECT sql FROM source.sqlite_master WHERE type = 'table' "
+            "AND name IN ('listings', 'photos')").fetchall():
+        conn.execute(sql)
+    columns = [row[1] for row in conn.execute("PRAGMA source.table_info(listings)")][1:]
+    source_count = conn.execute("SELECT COUNT(*) FROM source.listings").fetchone()[0]
+    stride = conn.execute("SELECT MAX(id) FROM source.listings").fetchone()[0] + 1
+    copy = 0
+    while copy * source_count < listings:
+        limit = min(source_count, listings - copy * source_count)
+        conn.execute(
+            f"INSERT INTO listings SELECT id + ?, {', '.join(columns)} "
+            f"FROM source.listings ORDER BY id LIMIT ?", (copy * stride, limit))
+        conn.execute(
+            "INSERT INTO photos (listing_id, photo_url) "
+            "SELECT listing_id + ?, photo_url FROM source.photos "
+            "WHERE listing_id + ? IN (SELECT id FROM listings)", (copy * stride, copy * stride))
+        copy += 1
+    conn.commit()
+    conn.execute("DETACH DATABASE source")
+    conn.close()
+
+
+def legacy_ingest(client, encoder, db_path, limit):
+    data = read_from_sqlite(db_path)[:limit]
+    client.upload_points(
+        collection_name=COLLECTION,
+        points=[
+            models.PointStruct(
+                id=row[0],
+                vector=encoder.encode(str(row)).tolist(),
+                payload=listing_payload(row),
+            )
+            for row in data
+        ],
+    )
+    return len(data)
+
+
+def run_mode(args):
+    # Child process: load the encoder, ingest once, print JSON
+    encoder = load_encoder(args.backend)
+    encoder.encode(["warm up"])
+    client = QdrantClient(url=args.url) if args.url else QdrantClient(location=":memory:")
+    if client.collection_exists(COLLECTION):
+        client.delete_collection(COLLECTION)
+    client.create_collection(COLLECTION, vectors_config=models.VectorParams(
+        size=encoder.get_sentence_embedding_dimension(), distance=models.Distance.COSINE))
+
+    if args.mode == "restore":
+        snapshot = os.path.join(os.path.dirname(args.db), "snapshot")
+        total = count_listings(args.db)
+        write_snapshot(snapshot, listing_batches(args.db, encoder, args.encode_batch, None,
+                                                 Progress(total, 60.0)),
+                       total, encoder.get_sentence_embedding_dimension())
+
+    started = time.perf_counter()
+    if args.mode == "legacy":
+        count = legacy_ingest(client, encoder, args.db, args.legacy_limit)
+    elif args.mode == "restore":
+        count = restore_snapshot(client, COLLECTION, snapshot, args.upload_batch)
+    else:
+        count = ingest_listings(client, COLLECTION, encoder, args.db,
+                                encode_batch_size=args.encode_batch,
+                                upload_batch_size=args.upload_batch,
+                                parallel=args.parallel, progress_interval=10.0)
+    seconds = time.perf_counter() - started
+    stored = client.count(COLLECTION).count
+    if args.url:
+        client.delete_collection(COLLECTION)
+    print(json.dumps({
+        "count": count,
+        "stored": stored,
+        "seconds": seconds,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Old vs streaming Qdrant ingest")
+    parser.add_argument("--source", default=os.path.join(ROOT, "uybor_listings.db"))
+    parser.add_argument("--listings", type=int, default=100000)
+    parser.add_argument("--legacy-limit", type=int, default=5000)
+    parser.add_argument("--encode-batch", type=int, default=256)
+    parser.add_argument("--upload-batch", type=int, default=256)
+    parser.add_argument("--parallel", type=int, default=1)
+    parser.add_argument("--backend", default=None, help="torch, onnx or onnx-int8")
+    parser.add_argument("--url", default=None, help="Qdrant server instead of :memory:")
+    parser.add_argument("--mode", choices=["legacy", "stream", "restore"], help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "listings.db")
+        build_database(args.source, db_path, args.listings)
+        print(f"{args.listings} listings in {db_path}")
+
+        results = {}
+        for mode in ("legacy", "stream", "restore"):
+            output = subprocess.run(
+                [sys.executable, __file__, "--mode", mode, "--db", db_path] + sys.argv[1:],
+                check=True, capture_output=True, text=True).stdout
+            for line in output.splitlines()[:-1]:
+                print(f"  {line}")
+            results[mode] = result = json.loads(output.splitlines()[-1])
+            rate = result["count"] / result["seconds"]
+            print(f"{mode:<7} {result['count']:>7} listings in {result['seconds']:.1f}s "
+                  f"({rate:.0f}/s), stored {result['stored']}, "
+                  f"peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    legacy, stream = results["legacy"], results["stream"]
+    speedup = (stream["count"] / stream["seconds"]) / (legacy["count"] / legacy["seconds"])
+    print(f"throughput x{speedup:.1f}; old path on {args.listings} listings would take "
+          f"~{args.listings * legacy['seconds'] / legacy['count']:.0f}s")
+
+
+if __name__ == "__main__":
+    main()
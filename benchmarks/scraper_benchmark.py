@@ -0,0 +1,172 @@
+# uybor.uz crawl against a local fake API: the old page-by-page loop
+# (blocking requests, no retry) vs the async crawler (pages in parallel,
+# rate limited, retried with backoff). The tornado server runs in its own
+# thread, serves --listings generated listings with --latency seconds per
+# response and fails --error-rate of the requests with a 503 or a 429 with
+# Retry-After. It also reports how many requests were in flight at once.
+#
+#   python benchmarks/scraper_benchmark.py --listings 20000 --latency 0.3
+#   python benchmarks/scraper_benchmark.py --error-rate 0.05 --concurrency 16 --rate 20
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scraper"))
+
+from uybor_scraper import SEARCH_PARAMS, create_database, save_listings, scrape_uybor_api  # noqa: E402
+
+
+def make_listing(listing_id):
+    rng = random.Random(listing_id)
+    district = rng.randint(1, 12)
+    return {
+        "id": listing_id, "userId": rng.randint(1, 500), "operationType": "sale",
+        "categoryId": 7, "subCategoryId": None,
+        "description": f"{rng.randint(1, 5)} xonali kvartira, {rng.randint(1, 16)}-qavat",
+        "price": rng.randint(20, 300) * 1000, "priceCurrency": "usd",
+        "address": f"Toshkent, {district}-tuman", "regionId": 13, "districtId": district,
+        "room": str(rng.randint(1, 5)), "lat": 41.3, "lng": 69.2, "square": rng.randint(30, 150),
+        "createdAt": "2024-09-01T00:00:00.000Z", "updatedAt": "2024-09-20T00:00:00.000Z",
+        "views": 0, "clicks": 0, "favorites": 0,
+        "media": [{"url": f"https://example.com/{listing_id}/{n}.jpg"} for n in range(3)],
+        "region": {"id": 13, "name": {"uz": "Toshkent"}},
+        "district": {"id": district, "name": {"uz": f"{district}-tuman"}},
+    }
+
+
+class FakeUybor(tornado.web.RequestHandler):
+    def initialize(self, server):
+        self.server = server
+
+    async def get(self):
+        server = self.server
+        server.requests += 1
+        server.in_flight += 1
+        server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            await asyncio.sleep(server.latency)
+            if server.rng.random() < server.error_rate:
+                server.errors += 1
+                if server.rng.random() < 0.5:
+                    self.set_header("Retry-After", "1")
+                    self.set_status(429)
+                else:
+                    self.set_status(503)
+                return
+            offset = int(self.get_argument("offset", 0))
+            limit = int(self.get_argument("limit", 100))
+            ids = range(offset + 1, min(offset + limit, server.listings) + 1)
+            self.write({"total": server.listings, "results": [make_listing(i) for i in ids]})
+        finally:
+            server.in_flight -= 1
+
+
+class FakeServer:
+    # The fake API on its own event loop thread, so the blocking client can
+    # be measured against it too
+    def __init__(self, listings, latency, error_rate):
+        self.listings = listings
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(0)
+        self.reset()
+        ready = threading.Event()
+        threading.Thread(target=self._serve, args=(ready,), daemon=True).start()
+        ready.wait()
+
+    def reset(self):
+        self.requests = self.errors = self.in_flight = self.max_in_flight = 0
+
+    def _serve(self, ready):
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        app = tornado.web.Application([(r"/api/v1/listings", FakeUybor, {"server": self})])
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        self.port = sockets[0].getsockname()[1]
+        tornado.httpserver.HTTPServer(app).add_sockets(sockets)
+        ready.set()
+        asyncio.get_event_loop().run_forever()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/api/v1/listings"
+
+
+def sequential_scrape(url, db_path):
+    # The old scrape_and_save_uybor_api loop: one page at a time, stops at
+    # the first error
+    conn = create_database(db_path)
+    params = {**SEARCH_PARAMS, "limit": 100, "offset": 0}
+    saved = 0
+    try:
+        while True:
+            response = requests.get(url, params=params)
+            response.raise_for_status()
+            data = response.json()
+            if not data["results"]:
+                break
+            save_listings(conn, data["results"])
+            saved += len(data["results"])
+            params["offset"] += params["limit"]
+            if saved >= data["total"]:
+                break
+    except requests.exceptions.RequestException as e:
+        print(f"  sequential run aborted: {e}")
+    finally:
+        conn.close()
+    return saved
+
+
+def stored(db_path):
+    conn = sqlite3.connect(db_path)
+    listings = conn.execute("SELECT COUNT(*) FROM listings").fetchone()[0]
+    photos = conn.execute("SELECT COUNT(*) FROM photos").fetchone()[0]
+    conn.close()
+    return listings, photos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sequential vs async uybor.uz crawl")
+    parser.add_argument("--listings", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=20.0)
+    parser.add_argument("--backoff", type=float, default=0.5)
+    args = parser.parse_args()
+
+    logging.getLogger("tornado.access").setLevel(logging.CRITICAL)
+    server = FakeServer(args.listings, args.latency, args.error_rate)
+    print(f"{args.listings} listings, {args.latency * 1000:.0f} ms per response, "
+          f"{args.error_rate:.0%} errors")
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("sequential", "async"):
+            db_path = os.path.join(directory, f"{mode}.db")
+            server.reset()
+            started = time.perf_counter()
+            if mode == "sequential":
+                sequential_scrape(server.url, db_path)
+            else:
+                asyncio.run(scrape_uybor_api(
+                    db_path, url=server.url, concurrency=args.concurrency, rate=args.rate,
+                    backoff=args.backoff))
+            seconds = time.perf_counter() - started
+            listings, photos = stored(db_path)
+            print(f"{mode:<10} {listings:>6} listings ({photos} photos) in {seconds:6.1f}s, "
+                  f"{server.requests} requests, {server.errors} failed, "
+                  f"max {server.max_in_flight} in flight")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# Memory used by chat histories for many synthetic users: the old
+# CHAT_HISTORIES dict of line lists against SessionStore, measured with
+# tracemalloc (build times include its overhead). Also times get and, with
+# --persist, save() and reloading every session from SQLite.
+#
+#   python benchmarks/session_store_memory.py --users 100000 --turns 3
+#   python benchmarks/session_store_memory.py --users 100000 --max-entries 20000 --persist
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from session_store import SessionStore  # noqa: E402
+
+QUERIES = [
+    "Chilonzorda 2 xonali kvartira",
+    "Yunusobod 19-kvartal 3 xonali uy, 70 ming dollargacha",
+    "Квартира в новостройке до 60 тысяч долларов",
+    "Sergelida arzon hovli",
+    "evro ta'mirli 4 xonali kvartira, metroga yaqin",
+    "1 xonali kvartira 30 ming dollargacha",
+]
+
+
+def synthetic_queries(users, turns, seed=0):
+    rng = random.Random(seed)
+    return [(user, f"{rng.choice(QUERIES)} #{rng.randrange(1000)}")
+            for _ in range(turns) for user in range(1, users + 1)]
+
+
+def measure(build):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - started
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, used, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Memory benchmark for chat history storage")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--turns", type=int, default=3,
+                        help="queries sent by each user")
+    parser.add_argument("--max-entries", type=int, default=None,
+                        help="SessionStore capacity (default: all users)")
+    parser.add_argument("--persist", action="store_true",
+                        help="also time save() and reloading from SQLite")
+    parser.add_argument("--save-every", type=int, default=10000,
+                        help="messages between save() calls with --persist")
+    args = parser.parse_args()
+
+    messages = synthetic_queries(args.users, args.turns)
+
+    def legacy():
+        histories = {}
+        for user, query in messages:
+            history = histories.get(user, [])
+            histories[user] = history[-4:] + [f"User: {query}", f"Bot: Natijalar yuborildi"]
+        return histories
+
+    db_path = os.path.join(tempfile.mkdtemp(), "sessions.db") if args.persist else None
+    max_entries = args.max_entries or args.users
+
+    def bounded():
+        store = SessionStore(max_entries=max_entries, db_path=db_path)
+        for i, (user, query) in enumerate(messages, 1):
+            store.add(user, query)
+            # Like the bot's periodic save; unsaved sessions stay in memory
+            if db_path and i % args.save_every == 0:
+                store.save()
+        return store
+
+    _, legacy_bytes, legacy_time = measure(legacy)
+    store, store_bytes, store_time = measure(bounded)
+    stats = store.stats()
+
+    print(f"{args.users:,} users x {args.turns} queries")
+    print(f"{'CHAT_HISTORIES dict':<22} {legacy_bytes / 2**20:8.1f} MB "
+          f"{legacy_bytes / args.users:7.0f} B/user {legacy_time:6.2f}s")
+    print(f"{'SessionStore':<22} {store_bytes / 2**20:8.1f} MB "
+          f"{store_bytes / args.users:7.0f} B/user {store_time:6.2f}s "
+          f"({stats['entries']:,} in memory, {stats['evictions']:,} evicted, "
+          f"payload {stats['payload_bytes'] / 2**20:.1f} MB)")
+
+    users = [user for user, _ in messages[-1000:]]
+    started = time.perf_counter()
+    for user in users:
+        store.get(user)
+    print(f"get: {(time.perf_counter() - started) / len(users) * 1e6:.1f} us")
+
+    if args.persist:
+        started = time.perf_counter()
+        saved = store.save()
+        print(f"save: {saved:,} sessions in {time.perf_counter() - started:.2f}s")
+        store.close()
+
+        reopened = SessionStore(max_entries=max_entries, db_path=db_path)
+        started = time.perf_counter()
+        for user in range(1, args.users + 1):
+            if reopened.get(user) is None:
+                reopened.load(user)
+        elapsed = time.perf_counter() - started
+        print(f"reload after restart: {args.users:,} sessions in {elapsed:.2f}s "
+              f"({elapsed / args.users * 1e6:.1f} us each)")
+        reopened.close()
+
+
+if __name__ == "__main__":
+    main()
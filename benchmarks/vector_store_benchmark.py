@@ -0,0 +1,134 @@
+# Qdrant vs the read-only snapshot stores in vector_store.py: latency and
+# recall@k (against the exact float32 scan) with and without the bot's
+# filters, then several worker processes searching one mapped snapshot at
+# once. Points come from the bot's collection, multiplied with a little
+# vector noise (--scale), as in filter_benchmark.py. The HNSW rows need
+# hnswlib and are skipped without it.
+#
+#   python benchmarks/vector_store_benchmark.py --scale 200 --processes 4
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import bot  # noqa: E402
+from filter_benchmark import COLLECTION, FILTERS, build_collection, load_points  # noqa: E402
+from vector_store import QdrantStore, SnapshotStore, export_snapshot  # noqa: E402
+
+
+def memory_mb():
+    # Resident and proportional set size; PSS splits shared pages between the
+    # processes mapping them
+    sizes = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("Rss", "Pss"):
+                sizes[name] = int(value.split()[0]) / 1024
+    return sizes
+
+
+def run_queries(store, queries, k):
+    latencies, results = [], []
+    for vector, query_filter in queries:
+        started = time.perf_counter()
+        hits = store.search(vector, k, query_filter)
+        latencies.append(time.perf_counter() - started)
+        results.append([hit.id for hit in hits])
+    return latencies, results
+
+
+def recall(results, truth, k):
+    return statistics.mean(len(set(r) & set(t)) / max(min(len(t), k), 1)
+                           for r, t in zip(results, truth))
+
+
+def worker(directory, index, queries, k, seconds, output):
+    store = SnapshotStore(directory, index=index)
+    done, deadline = 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        vector, query_filter = queries[done % len(queries)]
+        store.search(vector, k, query_filter)
+        done += 1
+    output.put((done, memory_mb()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Qdrant vs snapshot vector stores")
+    parser.add_argument("--storage", default=os.path.join(ROOT, "qdrant_storage"))
+    parser.add_argument("--scale", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    points = load_points(args.storage)
+    client = QdrantClient(":memory:")
+    total = build_collection(client, points, args.scale)
+    print(f"{total:,} points ({len(points)} listings x {args.scale})")
+
+    rng = np.random.default_rng(1)
+    filters = [None] + [bot.build_search_filter(f) for f in FILTERS]
+    queries = [
+        ((np.asarray(points[i].vector) + rng.normal(0, 0.05, len(points[i].vector))).tolist(),
+         filters[n % len(filters)])
+        for n, i in enumerate(rng.integers(0, len(points), args.queries))]
+
+    directory = tempfile.mkdtemp()
+    try:
+        import hnswlib  # noqa: F401
+        hnsw = True
+    except ImportError:
+        hnsw = False
+    started = time.perf_counter()
+    export_snapshot(client, COLLECTION, os.path.join(directory, "float32"), hnsw=hnsw)
+    print(f"export: {time.perf_counter() - started:.1f}s")
+    export_snapshot(client, COLLECTION, os.path.join(directory, "float16"), compression="float16")
+
+    stores = {
+        "qdrant :memory:": QdrantStore(client, COLLECTION),
+        "snapshot exact f32": SnapshotStore(os.path.join(directory, "float32")),
+        "snapshot exact f16": SnapshotStore(os.path.join(directory, "float16")),
+    }
+    if hnsw:
+        stores["snapshot hnsw f32"] = SnapshotStore(os.path.join(directory, "float32"), index="hnsw")
+
+    _, truth = run_queries(stores["snapshot exact f32"], queries, args.k)
+    print(f"{'store':<20} {'recall@' + str(args.k):>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, store in stores.items():
+        run_queries(store, queries[:10], args.k)  # warm up
+        latencies, results = run_queries(store, queries, args.k)
+        latencies.sort()
+        print(f"{name:<20} {recall(results, truth, args.k):>9.3f} "
+              f"{statistics.median(latencies) * 1000:>8.2f} "
+              f"{latencies[int(len(latencies) * 0.95)] * 1000:>8.2f}")
+
+    for index in ("exact", "hnsw") if hnsw else ("exact",):
+        context = multiprocessing.get_context("spawn")
+        output = context.Queue()
+        workers = [context.Process(target=worker, args=(
+            os.path.join(directory, "float32"), index, queries, args.k, args.seconds, output))
+            for _ in range(args.processes)]
+        for process in workers:
+            process.start()
+        reports = [output.get() for _ in workers]
+        for process in workers:
+            process.join()
+        searches = sum(done for done, _ in reports)
+        print(f"{args.processes} processes, {index}: {searches / args.seconds:.0f} searches/s, "
+              f"per process RSS {statistics.mean(m['Rss'] for _, m in reports):.0f} MB "
+              f"PSS {statistics.mean(m['Pss'] for _, m in reports):.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# Webhook serving throughput against a local fake Telegram Bot API.
+#
+# A tornado app plays api.telegram.org (getMe, setWebhook, sendMessage, ...),
+# the bot runs PTB's webhook server pointed at it, and the benchmark POSTs
+# updates from many chats to the webhook. The handler sleeps for a random
+# "pipeline" latency and echoes the text, so the numbers measure update
+# dispatch, not Gemini. Each processor is checked for per-chat ordering: a
+# chat's replies must come back in the order its messages were sent.
+#
+#   python benchmarks/webhook_benchmark.py --chats 50 --messages 5 --latency 0.2
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import httpx
+import tornado.web
+from telegram.ext import Application, MessageHandler, filters
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from update_processor import PerChatUpdateProcessor  # noqa: E402
+
+TOKEN = "123456:bench"
+SECRET = "bench-secret"
+
+
+class FakeTelegram(tornado.web.RequestHandler):
+    # Answers every Bot API method the benchmark needs
+    def initialize(self, replies):
+        self.replies = replies
+
+    def post(self, method):
+        params = self._params()
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            self.replies.append((time.perf_counter(), chat_id, params["text"]))
+            result = {"message_id": len(self.replies), "date": int(time.time()),
+                      "chat": {"id": chat_id, "type": "private"}, "text": params["text"]}
+        else:  # setWebhook, deleteWebhook, sendChatAction, ...
+            result = True
+        self.write({"ok": True, "result": result})
+
+    def _params(self):
+        if self.request.headers.get("Content-Type", "").startswith("application/json"):
+            return json.loads(self.request.body or b"{}")
+        return {key: values[0].decode() for key, values in self.request.body_arguments.items()}
+
+
+def make_update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+            "text": text,
+        },
+    }
+
+
+async def run(processor_name, workers, args, api_port, webhook_port, replies):
+    latency = args.latency
+
+    async def echo(update, context):
+        await asyncio.sleep(random.uniform(0, 2 * latency))
+        await update.message.reply_text(update.message.text)
+
+    concurrent = {
+        "sequential": False,
+        "concurrent": workers,
+        "per-chat": PerChatUpdateProcessor(workers),
+    }[processor_name]
+    application = (Application.builder().token(TOKEN)
+                   .base_url(f"http://127.0.0.1:{api_port}/bot")
+                   .concurrent_updates(concurrent)
+                   .connection_pool_size(workers + 8)
+                   .build())
+    application.add_handler(MessageHandler(filters.TEXT, echo))
+
+    replies.clear()
+    total = args.chats * args.messages
+    async with application:
+        await application.start()
+        await application.updater.start_webhook(
+            listen="127.0.0.1", port=webhook_port, url_path="telegram",
+            webhook_url=f"http://127.0.0.1:{webhook_port}/telegram", secret_token=SECRET)
+
+        # Like Telegram, deliver each chat's updates one after another
+        # (over up to max_connections connections in parallel)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{webhook_port}") as client:
+            started = time.perf_counter()
+            update_id = 0
+            for i in range(args.messages):
+                posts = []
+                for chat_id in range(1, args.chats + 1):
+                    update_id += 1
+                    posts.append(client.post(
+                        "/telegram", json=make_update(update_id, chat_id, str(i)),
+                        headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}))
+                await asyncio.gather(*posts)
+            while len(replies) < total:
+                await asyncio.sleep(0.005)
+            wall = time.perf_counter() - started
+
+        await application.updater.stop()
+        await application.stop()
+
+    out_of_order = 0
+    last = {}
+    for _, chat_id, text in replies:
+        if int(text) < last.get(chat_id, -1):
+            out_of_order += 1
+        last[chat_id] = int(text)
+    print(f"{processor_name:<11} workers={workers:<4} updates={total:<5} wall={wall:6.2f}s "
+          f"throughput={total / wall:8.1f} updates/s out-of-order={out_of_order}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Webhook throughput against a fake Telegram endpoint")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5,
+                        help="messages per chat, sent back to back")
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="mean simulated handler latency in seconds")
+    parser.add_argument("--workers", type=int, nargs="+", default=[8, 32, 128])
+    parser.add_argument("--processors", nargs="+",
+                        default=["sequential", "concurrent", "per-chat"])
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=8082)
+    args = parser.parse_args()
+
+    replies = []
+    api = tornado.web.Application(
+        [(r"/bot[^/]+/(\w+)", FakeTelegram, {"replies": replies})])
+    server = api.listen(args.api_port, address="127.0.0.1")
+
+    for processor_name in args.processors:
+        for workers in ([1] if processor_name == "sequential" else args.workers):
+            await run(processor_name, workers, args, args.api_port,
+                      args.webhook_port, replies)
+    server.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
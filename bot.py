@@ -1,184 +1,664 @@
+from startup import StartupProfile
 import os
+import sys
 from dotenv import load_dotenv
-from telegram import Update, InputMediaPhoto
+from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from telegram.constants import ChatAction
-from qdrant_client import models, QdrantClient
-from sentence_transformers import SentenceTransformer
-import google.generativeai as genai
-import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import fcntl
+import functools
+import glob
+import threading
 import asyncio
+import json
+from admission import AdmissionController
+from classifier import RealEstateClassifier
+from credit_store import CreditLedger, CreditStore
+from description_cache import DescriptionCache
+from embedding_service import EmbeddingBatcher
+from embedding_cache import EmbeddingCache
+from encoders import encoder_id, load_encoder
+from listings import DOCUMENT_VERSION, FILTER_INDEXES, read_listing_texts
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from places import find_place, load_places
+from photo_cache import PhotoCache, album_urls, prewarm_photos, send_cached_album
+from query_cache import SemanticQueryCache
+from session_store import SessionStore
+from update_processor import PerChatUpdateProcessor
+from vector_store import QdrantStore, SnapshotStore, find_snapshot
 
 # Load environment variables
 load_dotenv()
 
-# Set up the Gemini API
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-
-# Initialize the sentence transformer model
-encoder = SentenceTransformer("all-MiniLM-L6-v2")
+# Heavy services (Gemini client, sentence encoder, Qdrant) are created by
+# warm_up() in the background after the bot has started polling;
+# services_ready is set once they are usable
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+llm = None
+query_llm = None
+encoder = None
+real_estate_classifier = None
+embedding_batcher = None
+embedding_cache = None
+client = None
+services_ready = asyncio.Event()
+
+# How long a message that arrives during warm-up waits before giving up
+STARTUP_WAIT_TIMEOUT = float(os.getenv("STARTUP_WAIT_TIMEOUT", 120))
+# A failed warm-up is retried, waiting twice as long each time up to the max
+WARM_UP_RETRY_DELAY = float(os.getenv("WARM_UP_RETRY_DELAY", 5))
+WARM_UP_RETRY_MAX_DELAY = float(os.getenv("WARM_UP_RETRY_MAX_DELAY", 300))
+
+NOT_REAL_ESTATE_REPLY = "Kechirasiz, men faqat ko'chmas mulk va uy-joy haqidagi so'rovlarga javob bera olaman. Iltimos, ko'chmas mulk bilan bog'liq savol bering."
+
+# Per-user debounce and a global cap on running query pipelines
+admission = AdmissionController(
+    window=float(os.getenv("ADMISSION_WINDOW", 0.8)),
+    max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 16)),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 64)),
+)
+BUSY_REPLY = "Hozir so'rovlar juda ko'p. Iltimos, birozdan so'ng qayta urinib ko'ring."
+
+# Serving: polling by default, PTB's webhook server when WEBHOOK_URL is set.
+# UPDATE_WORKERS handlers run at once; one chat's updates stay in order.
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 32))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
 
 # Set up Qdrant client
 qdrant_storage_path = "./qdrant_storage"
-client = QdrantClient(path=qdrant_storage_path)
+# An alias: the points live in versioned collections uybozor_data_vN, and
+# reindex.py builds the next version and moves the alias to it while the bot
+# keeps serving
 collection_name = "uybozor_data"
+# A Qdrant server instead of the local storage; payload indexes only take
+# effect there
+QDRANT_URL = os.getenv("QDRANT_URL")
+# Local-mode Qdrant is not safe to write while searching, so searches and
+# sync writes take turns; a server needs no lock
+qdrant_lock = contextlib.nullcontext() if QDRANT_URL else threading.Lock()
+
+# Serve vectors from a snapshot written by export_vector_snapshot.py instead
+# of Qdrant. Every process maps it read-only, so several bot processes (with
+# BOT_PROCESSES set, see below) and main.py can run at once; it is refreshed
+# by exporting again and restarting. VECTOR_INDEX is "exact" or "hnsw"
+# (needs hnswlib).
+VECTOR_SNAPSHOT_DIR = os.getenv("VECTOR_SNAPSHOT_DIR")
+VECTOR_INDEX = os.getenv("VECTOR_INDEX", "exact")
+vector_store = None
+
+# Snapshots built offline by build_index.py. A new collection version is
+# filled from the newest one matching the encoder and listing document version
+# instead of embedding every listing. VECTOR_SNAPSHOT_DIR may point at this
+# directory too, and then serves the newest compatible snapshot in it.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+
+# Vector compression. Snapshots are compressed when exported
+# (export_vector_snapshot.py --compression int8 --pca 128); on a Qdrant server
+# QDRANT_QUANTIZATION=int8 keeps int8 copies in RAM and the float32 vectors
+# on disk, and QDRANT_VECTOR_DATATYPE=float16 halves the stored vectors for
+# collections created from then on. Either way searches run on the
+# compressed vectors and the best top_k * VECTOR_OVERSAMPLING candidates are
+# rescored at full precision.
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "")
+QDRANT_VECTOR_DATATYPE = os.getenv("QDRANT_VECTOR_DATATYPE", "float32")
+VECTOR_OVERSAMPLING = float(os.getenv("VECTOR_OVERSAMPLING", 4))
+
+# Initial load of the collection: listings per encode call, points per
+# upload request and upload processes (server mode only)
+INGEST_ENCODE_BATCH = int(os.getenv("INGEST_ENCODE_BATCH", 256))
+INGEST_UPLOAD_BATCH = int(os.getenv("INGEST_UPLOAD_BATCH", 256))
+INGEST_PARALLEL = int(os.getenv("INGEST_PARALLEL", 1))
+
+# Listing embeddings keyed by document text, shared by the initial load and
+# the sync so only new or edited listings go through the encoder
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200000))
+
+# Incremental sync from uybor_listings.db every QDRANT_SYNC_INTERVAL seconds
+# (0 disables), re-embedding only listings changed since the last run
+QDRANT_SYNC_INTERVAL = float(os.getenv("QDRANT_SYNC_INTERVAL", 600))
+QDRANT_SYNC_STATE = os.getenv("QDRANT_SYNC_STATE", "qdrant_sync_state.json")
+
+# Which encoder and listing document version built each collection version.
+# With AUTO_REINDEX, when the live version's document version is behind, the
+# sync task builds a new one in the background and switches to it, and
+# retired versions are deleted after REINDEX_GRACE_PERIOD seconds. The state
+# files are per host, so bots sharing a Qdrant server would race each other
+# for the same version names: there it is off by default and versions are
+# built with reindex.py. Local-mode storage is only ever open in one process.
+REINDEX_STATE = os.getenv("REINDEX_STATE", "reindex_state.json")
+REINDEX_GRACE_PERIOD = float(os.getenv("REINDEX_GRACE_PERIOD", 3600))
+AUTO_REINDEX = os.getenv("AUTO_REINDEX", "0" if QDRANT_URL else "1") == "1"
+reindexer = None
+
+# Hybrid retrieval: a BM25 index over listing addresses and descriptions,
+# built by setup_qdrant, is searched next to the vectors and the two rankings
+# are merged with reciprocal rank fusion. Helps with street, metro and
+# complex names the embedding barely sees.
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+lexical_index = None
+
+# Region and district names the scraper saw, for turning names in a query
+# into region_id / district_id filters; filled in by warm_up
+places = {"region": {}, "district": {}}
 
 # Set up user database
 USER_DB_PATH = 'user_data.db'
+credit_store = None
+# Credit changes are journaled and written to USER_DB_PATH in batches
+CREDIT_JOURNAL_DIR = os.getenv("CREDIT_JOURNAL_DIR", "credit_journal")
+CREDIT_FLUSH_INTERVAL = float(os.getenv("CREDIT_FLUSH_INTERVAL", 2.0))
+
+# The credit ledger and the session store keep state in memory and assume
+# they are the only writers of their databases, so by default one bot
+# process is enforced with an exclusive flock on USER_DB_PATH.lock. Set
+# BOT_PROCESSES above 1 on every process (e.g. webhook workers sharing a
+# snapshot) to take a shared lock instead: credits then go straight to
+# SQLite through CreditStore's atomic statements and chat history stays in
+# each process's memory. The two modes cannot run side by side.
+BOT_PROCESSES = int(os.getenv("BOT_PROCESSES", 1))
+process_lock = None
+
+# Set up chat history: bounded, idle sessions expire, and with
+# SESSION_DB_PATH set (empty to disable) they survive restarts; opened by
+# setup_local_stores
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+session_store = None
+SESSION_SAVE_INTERVAL = float(os.getenv("SESSION_SAVE_INTERVAL", 30))
+
+# Generated property descriptions, reused until the listing's updated_at
+# changes; opened by setup_local_stores
+DESCRIPTION_CACHE_PATH = os.getenv("DESCRIPTION_CACHE_PATH", "description_cache.db")
+description_cache = None
+
+# Telegram file_ids of listing photos, so albums are not re-fetched from the
+# CDN. With PHOTO_WARMUP_CHAT_ID set (a private service chat), photos of the
+# most viewed listings are uploaded there ahead of time. Opened by
+# setup_local_stores.
+PHOTO_CACHE_PATH = os.getenv("PHOTO_CACHE_PATH", "photo_cache.db")
+photo_cache = None
+PHOTO_WARMUP_CHAT_ID = os.getenv("PHOTO_WARMUP_CHAT_ID")
+PHOTO_WARMUP_LISTINGS = int(os.getenv("PHOTO_WARMUP_LISTINGS", 100))
+PHOTO_WARMUP_INTERVAL = float(os.getenv("PHOTO_WARMUP_INTERVAL", 6 * 3600))
+
+# Result cards of recent searches, matched by query embedding similarity.
+# Cleared whenever the collection is (re)loaded.
+query_cache = SemanticQueryCache(
+    threshold=float(os.getenv("QUERY_CACHE_THRESHOLD", 0.92)),
+    ttl=int(os.getenv("QUERY_CACHE_TTL", 3600)),
+    max_entries=int(os.getenv("QUERY_CACHE_MAX_ENTRIES", 5000)),
+)
+
+# Bounded thread pool for blocking work (encoding, Qdrant, SQLite) so the
+# event loop stays free while one user's request is being processed
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", 4))
+executor = ThreadPoolExecutor(
+    max_workers=BLOCKING_WORKERS, thread_name_prefix="blocking")
+
+
+# Property descriptions are generated concurrently; this caps how many Gemini
+# description calls one request has in flight. Across all users that is at
+# most ADMISSION_MAX_IN_FLIGHT times as many.
+DESCRIPTION_CONCURRENCY = int(os.getenv("DESCRIPTION_CONCURRENCY", 5))
+
+# "rank" sends cards in search order, "completed" sends each card as soon as
+# its description is ready
+CARD_ORDER = os.getenv("CARD_ORDER", "rank")
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+def setup_gemini():
+    global llm, query_llm
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    llm = genai.GenerativeModel(GEMINI_MODEL)
+    query_llm = genai.GenerativeModel(
+        GEMINI_MODEL, generation_config={"response_mime_type": "application/json"})
+
+
+def build_classifier(encoder):
+    # Local real-estate gate: scores at or below CLASSIFIER_LOW are rejected
+    # without asking Gemini, at or above CLASSIFIER_HIGH accepted whatever
+    # Gemini says. The shipped examples are not calibrated for the deployed
+    # encoder, so it is only used with both thresholds set (from
+    # benchmarks/evaluate_classifier.py); otherwise None and Gemini decides.
+    low, high = os.getenv("CLASSIFIER_LOW"), os.getenv("CLASSIFIER_HIGH")
+    if not (low and high):
+        return None
+    return RealEstateClassifier(encoder, low=float(low), high=float(high))
+
+
+def warm_up(profile=None):
+    # Safe to call again after a failure: an already opened Qdrant client is
+    # reused (local storage can only be opened once per process)
+    global encoder, real_estate_classifier, embedding_batcher, embedding_cache
+    global client, vector_store, lexical_index, places
+    profile = profile or StartupProfile()
+
+    with profile.phase("gemini client"):
+        setup_gemini()
+
+    # Initialize the sentence encoder (ENCODER_BACKEND selects torch or ONNX)
+    with profile.phase("encoder"):
+        encoder = load_encoder()
+        encoder.encode("warm up")
+        embedding_cache = EmbeddingCache(
+            EMBEDDING_CACHE_DIR, encoder_id(), encoder.get_sentence_embedding_dimension(),
+            max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+
+    with profile.phase("classifier"):
+        real_estate_classifier = build_classifier(encoder)
+
+    # Concurrent query encodes are coalesced into one batched forward pass
+    embedding_batcher = EmbeddingBatcher(
+        encoder, executor,
+        max_batch_size=int(os.getenv("EMBEDDING_MAX_BATCH", 32)),
+        max_wait=float(os.getenv("EMBEDDING_MAX_WAIT_MS", 5)) / 1000,
+    )
 
-# Set up chat history
-CHAT_HISTORIES = {}
+    snapshot_path = VECTOR_SNAPSHOT_DIR and compatible_snapshot(VECTOR_SNAPSHOT_DIR)
+    if VECTOR_SNAPSHOT_DIR and not snapshot_path:
+        print(f"{VECTOR_SNAPSHOT_DIR} da mos snapshot topilmadi, Qdrant ishlatiladi.")
+    if snapshot_path:
+        with profile.phase("vector snapshot"):
+            vector_store = SnapshotStore(snapshot_path, index=VECTOR_INDEX,
+                                         oversampling=VECTOR_OVERSAMPLING)
+        print(f"Vektorlar {snapshot_path} dan yuklandi.")
+    elif client is None:
+        with profile.phase("qdrant open"):
+            from qdrant_client import QdrantClient
+            if QDRANT_URL:
+                client = QdrantClient(url=QDRANT_URL, api_key=os.getenv("QDRANT_API_KEY"))
+            else:
+                client = QdrantClient(path=qdrant_storage_path)
+
+    with profile.phase("places"):
+        places = load_places('uybor_listings.db')
+    if not places["district"]:
+        print("uybor_listings.db da hudud nomlari yo'q, tuman filtrlari ishlamaydi: "
+              "python scraper/uybor_scraper.py --places-only")
+
+    if not snapshot_path:
+        with profile.phase("setup_qdrant"):
+            setup_qdrant()
+        vector_store = QdrantStore(
+            client, collection_name, qdrant_lock,
+            oversampling=VECTOR_OVERSAMPLING if QDRANT_QUANTIZATION else None)
+
+    if HYBRID_SEARCH:
+        with profile.phase("lexical index"):
+            lexical_index = BM25Index(read_listing_texts('uybor_listings.db'))
+
+    return profile
+
+
+async def warm_up_in_background(profile):
+    # Messages keep getting the "not ready yet" reply while this retries
+    delay = WARM_UP_RETRY_DELAY
+    while True:
+        try:
+            await run_blocking(warm_up, profile)
+            break
+        except Exception as e:
+            print(f"Xizmatlarni ishga tushirishda xatolik: {e}; "
+                  f"{delay:.0f}s dan so'ng qayta urinib ko'riladi.")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, WARM_UP_RETRY_MAX_DELAY)
+    profile.mark("services ready")
+    services_ready.set()
+    print("Bot tayyor.")
+
+
+async def prewarm_photos_periodically(bot):
+    while True:
+        try:
+            uploaded = await prewarm_photos(
+                bot, photo_cache, 'uybor_listings.db', PHOTO_WARMUP_CHAT_ID,
+                run_blocking, limit=PHOTO_WARMUP_LISTINGS)
+            print(f"{uploaded} ta rasm oldindan yuklandi.")
+        except Exception as e:
+            print(f"Rasmlarni oldindan yuklashda xatolik: {e}")
+        await asyncio.sleep(PHOTO_WARMUP_INTERVAL)
+
+
+def sync_qdrant():
+    # Blocking: one incremental sync; refreshes what is derived from the
+    # listings when anything changed
+    global lexical_index, places
+    from qdrant_sync import ListingSync
+
+    stats = ListingSync(client, collection_name, encoder, 'uybor_listings.db',
+                        QDRANT_SYNC_STATE, lock=qdrant_lock, cache=embedding_cache).run()
+    if stats["upserted"] or stats["deleted"] or stats["photos_updated"]:
+        if HYBRID_SEARCH:
+            lexical_index = BM25Index(read_listing_texts('uybor_listings.db'))
+        places = load_places('uybor_listings.db')
+        query_cache.invalidate()
+    return stats
+
+
+def reindex_qdrant():
+    # Blocking: builds and validates a new collection version, then moves
+    # the alias to it
+    stats = reindexer.run()
+    query_cache.invalidate()
+    return stats
+
+
+async def sync_qdrant_periodically():
+    await services_ready.wait()
+    if client is None:
+        # Serving from a read-only snapshot
+        return
+    while True:
+        try:
+            if AUTO_REINDEX and await run_blocking(reindexer.stale):
+                stats = await run_blocking(reindex_qdrant)
+                print(f"Qdrant qayta indekslandi: {stats['previous']} -> {stats['collection']} "
+                      f"({stats['points']} ta e'lon, {stats['seconds']:.1f}s)")
+            stats = await run_blocking(sync_qdrant)
+            if stats["upserted"] or stats["deleted"] or stats["photos_updated"]:
+                print(f"Qdrant yangilandi: {stats['upserted']} ta qo'shildi/yangilandi, "
+                      f"{stats['deleted']} ta o'chirildi, {stats['photos_updated']} ta rasm "
+                      f"({stats['seconds']:.1f}s)")
+            removed = await run_blocking(reindexer.collect_garbage) if AUTO_REINDEX else []
+            if removed:
+                print(f"Eski to'plamlar o'chirildi: {', '.join(removed)}")
+        except Exception as e:
+            print(f"Qdrant bilan sinxronlashda xatolik: {e}")
+        await asyncio.sleep(QDRANT_SYNC_INTERVAL)
+
+
+async def save_sessions_periodically():
+    while True:
+        await asyncio.sleep(SESSION_SAVE_INTERVAL)
+        try:
+            await run_blocking(session_store.save)
+        except Exception as e:
+            print(f"Suhbatlarni saqlashda xatolik: {e}")
+
+
+async def wait_until_ready(update):
+    # Politely hold messages that arrive while the models are still loading
+    if services_ready.is_set():
+        return True
+    await update.message.reply_text("Bot ishga tushmoqda, so'rovingiz bir necha soniyadan so'ng ko'rib chiqiladi...")
+    try:
+        await asyncio.wait_for(services_ready.wait(), STARTUP_WAIT_TIMEOUT)
+        return True
+    except asyncio.TimeoutError:
+        await update.message.reply_text("Kechirasiz, bot hali tayyor emas. Iltimos, birozdan so'ng qayta urinib ko'ring.")
+        return False
 
 
 def setup_user_db():
-    conn = sqlite3.connect(USER_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        credits INTEGER DEFAULT 200,
-        referrer_id INTEGER
+    global credit_store, process_lock
+    process_lock = open(f"{USER_DB_PATH}.lock", "a")
+    try:
+        fcntl.flock(process_lock,
+                    (fcntl.LOCK_SH if BOT_PROCESSES > 1 else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+    except BlockingIOError:
+        raise RuntimeError(f"{USER_DB_PATH} boshqa bot jarayonida ochiq. Bir nechta jarayon "
+                           f"uchun hammasida BOT_PROCESSES ni 1 dan katta qiling.")
+    if BOT_PROCESSES == 1:
+        credit_store = CreditLedger(CreditStore(USER_DB_PATH), CREDIT_JOURNAL_DIR,
+                                    flush_interval=CREDIT_FLUSH_INTERVAL)
+        return
+    if any(os.path.getsize(path)
+           for path in glob.glob(os.path.join(CREDIT_JOURNAL_DIR, "journal.*.log"))):
+        # Only a single-process start replays them
+        raise RuntimeError(f"{CREDIT_JOURNAL_DIR} da yozilmagan kredit jurnallari bor; "
+                           f"botni bir marta BOT_PROCESSES=1 bilan ishga tushiring.")
+    credit_store = CreditStore(USER_DB_PATH)
+
+
+def setup_local_stores():
+    # SQLite-backed stores, opened by main() rather than on import so
+    # importing bot (benchmarks, tools) leaves no files behind
+    global session_store, description_cache, photo_cache
+    session_store = SessionStore(
+        max_entries=int(os.getenv("SESSION_MAX_ENTRIES", 50000)),
+        idle_ttl=int(os.getenv("SESSION_IDLE_TTL", 86400)),
+        db_path=(SESSION_DB_PATH or None) if BOT_PROCESSES == 1 else None,
+    )
+    description_cache = DescriptionCache(
+        DESCRIPTION_CACHE_PATH,
+        max_memory_entries=int(os.getenv("DESCRIPTION_CACHE_MEMORY_ENTRIES", 2000)),
+        max_db_entries=int(os.getenv("DESCRIPTION_CACHE_DB_ENTRIES", 100000)),
     )
-    ''')
-    conn.commit()
-    conn.close()
-
-
-def get_user_credits(user_id):
-    conn = sqlite3.connect(USER_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT credits FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-
-def update_user_credits(user_id, credits):
-    conn = sqlite3.connect(USER_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT OR REPLACE INTO users (user_id, credits) VALUES (?, ?)', (user_id, credits))
-    conn.commit()
-    conn.close()
-
-
-def add_referral(user_id, referrer_id):
-    conn = sqlite3.connect(USER_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        'UPDATE users SET referrer_id = ? WHERE user_id = ?', (referrer_id, user_id))
-    cursor.execute(
-        'UPDATE users SET credits = credits + 25 WHERE user_id = ?', (referrer_id,))
-    conn.commit()
-    conn.close()
-
-
-def read_from_sqlite(db_path):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT l.*, GROUP_CONCAT(p.photo_url) as photos
-        FROM listings l
-        LEFT JOIN photos p ON l.id = p.listing_id
-        GROUP BY l.id
-    """)
-    data = cursor.fetchall()
-    conn.close()
-    return data
+    photo_cache = PhotoCache(PHOTO_CACHE_PATH)
 
 
-def setup_qdrant():
-    collections = client.get_collections()
-    collection_exists = any(
-        collection.name == collection_name for collection in collections.collections)
+def compatible_snapshot(path):
+    return find_snapshot(path, encoder=encoder_id(), document_version=DOCUMENT_VERSION)
 
-    if not collection_exists:
-        print(f"Yangi to'plam yaratilmoqda: {collection_name}")
-        client.create_collection(
-            collection_name=collection_name,
-            vectors_config=models.VectorParams(
-                size=encoder.get_sentence_embedding_dimension(),
-                distance=models.Distance.COSINE,
-            ),
-        )
 
-        # Read data from SQLite and upload to Qdrant
-        db_path = 'uybor_listings.db'
-        data = read_from_sqlite(db_path)
-
-        client.upload_points(
-            collection_name=collection_name,
-            points=[
-                models.PointStruct(
-                    id=row[0],
-                    vector=encoder.encode(str(row)).tolist(),
-                    payload={
-                        "id": row[0],
-                        "user_id": row[1],
-                        "operation_type": row[2],
-                        "category_id": row[3],
-                        "sub_category_id": row[4],
-                        "description": row[5],
-                        "price": row[6],
-                        "price_currency": row[7],
-                        "address": row[8],
-                        "region_id": row[9],
-                        "district_id": row[10],
-                        "street_id": row[11],
-                        "zone_id": row[12],
-                        "room": row[13],
-                        "lat": row[14],
-                        "lng": row[15],
-                        "square": row[16],
-                        "floor": row[17],
-                        "floor_total": row[18],
-                        "is_new_building": row[19],
-                        "repair": row[20],
-                        "foundation": row[21],
-                        "created_at": row[22],
-                        "updated_at": row[23],
-                        "media_count": row[24],
-                        "views": row[25],
-                        "clicks": row[26],
-                        "favorites": row[27],
-                        "photos": row[28].split(',') if row[28] else []
-                    }
-                )
-                for row in data
-            ],
-        )
-        print("Ma'lumotlar muvaffaqiyatli yuklandi.")
-    else:
-        print(
-            f"{collection_name} to'plami allaqachon mavjud. Mavjud ma'lumotlardan foydalanilmoqda.")
-
-
-def improve_query(query, chat_history):
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    prompt = f"""Foydalanuvchi so'rovini yaxshilang va aniqlashtiring. Quyidagi suhbat tarixi va so'rovdan foydalaning:
+def setup_qdrant():
+    # reindex pulls in qdrant_client; a bot serving a snapshot never needs it
+    global reindexer
+    from reindex import Reindexer, quantization_config
+
+    reindexer = Reindexer(
+        client, collection_name, encoder, 'uybor_listings.db', REINDEX_STATE, QDRANT_SYNC_STATE,
+        lock=qdrant_lock, cache=embedding_cache, snapshot_dir=SNAPSHOT_DIR,
+        quantization=QDRANT_QUANTIZATION, datatype=QDRANT_VECTOR_DATATYPE,
+        # Indexes for the fields build_search_filter filters on, so filtered
+        # searches only visit matching points; they only take effect on a server
+        payload_indexes=FILTER_INDEXES if QDRANT_URL else None,
+        encode_batch_size=INGEST_ENCODE_BATCH,
+        upload_batch_size=INGEST_UPLOAD_BATCH,
+        parallel=INGEST_PARALLEL,
+        grace_period=REINDEX_GRACE_PERIOD,
+    )
+    live = reindexer.live()
+    build = reindexer.live_build()
+
+    if live is None or (build is not None and build.get("encoder") != encoder_id()):
+        # Nothing to serve yet, or vectors from another (or an unknown, e.g.
+        # the copied pre-versioning uybozor_data_v0) encoder that this one's
+        # queries cannot be compared with: build the first (or next) version
+        # before serving. It is filled from a compatible snapshot when
+        # build_index.py made one, otherwise by embedding every listing.
+        if not AUTO_REINDEX:
+            # warm_up is retried, so the bot starts once reindex.py has run
+            raise RuntimeError(f"{collection_name} uchun mos to'plam yo'q, "
+                               f"reindex.py ni ishga tushiring")
+        print(f"Yangi to'plam yaratilmoqda: {collection_name}")
+        stats = reindexer.run()
+        query_cache.invalidate()
+        print(f"Ma'lumotlar muvaffaqiyatli yuklandi: {stats['collection']}.")
+        return
 
-Suhbat tarixi:
+    print(f"{collection_name} to'plami allaqachon mavjud ({live}). "
+          f"Mavjud ma'lumotlardan foydalanilmoqda.")
+    if QDRANT_URL and QDRANT_QUANTIZATION:
+        # Qdrant builds the quantized copy in the background
+        client.update_collection(
+            collection_name=live, quantization_config=quantization_config(QDRANT_QUANTIZATION))
+    if QDRANT_URL:
+        # Creating an index again is a no-op
+        for field, schema in FILTER_INDEXES.items():
+            client.create_payload_index(
+                collection_name=live, field_name=field, field_schema=schema)
+
+
+async def understand_query(query, chat_history):
+    # One Gemini round trip answers the relevance gate, rewrites the query for
+    # vector search and extracts structured filters
+    prompt = f"""You are the query understanding step of a real estate search bot for Uzbekistan. Use the chat history and the user's message below.
+
+Chat history:
 {chat_history}
 
-Asl so'rov: {query}
+User message: {query}
 
-Yaxshilangan so'rov:"""
+Respond with a JSON object with exactly these keys:
+- "is_real_estate": true if the message is related to real estate or property searching, otherwise false
+- "search_query": the message rewritten as a clear, specific property search query in Uzbek (Latin script), using the chat history for missing details
+- "filters": an object with the keys "rooms" (integer or null), "price_min" (number or null), "price_max" (number or null), "price_currency" ("usd", "uzs" or null), "square_min" (square meters or null), "square_max" (square meters or null), "region" (region name or null), "district" (district name or null) and "is_new_building" (true, false or null). Use null for anything the user did not ask for.{place_hint()}"""
 
-    response = model.generate_content(prompt)
-    return response.text
+    response = await query_llm.generate_content_async(prompt)
+    return parse_query_understanding(response.text, query)
 
 
-def retrieve_relevant_properties(query, top_k=5):
-    hits = client.search(
-        collection_name=collection_name,
-        query_vector=encoder.encode(query).tolist(),
-        limit=top_k,
-    )
-    return hits
+def place_hint():
+    # Lets Gemini answer with names build_search_filter can map to ids
+    hints = []
+    for kind in ("region", "district"):
+        if places[kind]:
+            hints.append(f'\nKnown {kind} names: {", ".join(sorted(places[kind]))}.')
+    return "".join(hints)
+
 
+def parse_query_understanding(text, query):
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict):
+        # Fall back to searching with the original message rather than
+        # rejecting it
+        return {"is_real_estate": True, "search_query": query, "filters": {}}
 
-def generate_property_description(property_data, query):
-    model = genai.GenerativeModel('gemini-1.5-flash')
+    filters = data.get("filters")
+    if not isinstance(filters, dict):
+        filters = {}
+    return {
+        "is_real_estate": data.get("is_real_estate") is not False,
+        "search_query": str(data.get("search_query") or query),
+        "filters": {key: value for key, value in filters.items() if value is not None},
+    }
+
+
+def number_range(filters, low_key, high_key):
+    from qdrant_client import models
+
+    def number(value):
+        return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+    low, high = number(filters.get(low_key)), number(filters.get(high_key))
+    if low is None and high is None:
+        return None
+    return models.Range(gte=low, lte=high)
+
+
+def build_search_filter(filters):
+    from qdrant_client import models
+
+    conditions = []
+    rooms = filters.get("rooms")
+    if isinstance(rooms, int) and not isinstance(rooms, bool) and rooms > 0:
+        # uybor stores rooms as text and lumps six and more into "6+"
+        room = str(rooms) if rooms < 6 else "6+"
+        conditions.append(models.FieldCondition(
+            key="room", match=models.MatchValue(value=room)))
+    if isinstance(filters.get("is_new_building"), bool):
+        conditions.append(models.FieldCondition(
+            key="is_new_building", match=models.MatchValue(value=int(filters["is_new_building"]))))
+
+    for kind in ("region", "district"):
+        # Names the scraper never saw are left to the embedding
+        place_id = find_place(places, kind, filters.get(kind))
+        if place_id is not None:
+            conditions.append(models.FieldCondition(
+                key=f"{kind}_id", match=models.MatchValue(value=place_id)))
+
+    price_range = number_range(filters, "price_min", "price_max")
+    if price_range:
+        conditions.append(models.FieldCondition(key="price", range=price_range))
+        # A price only means something in its currency
+        if filters.get("price_currency") in ("usd", "uzs"):
+            conditions.append(models.FieldCondition(
+                key="price_currency", match=models.MatchValue(value=filters["price_currency"])))
+
+    square_range = number_range(filters, "square_min", "square_max")
+    if square_range:
+        conditions.append(models.FieldCondition(key="square", range=square_range))
+
+    return models.Filter(must=conditions) if conditions else None
+
+
+async def embed_query(query):
+    vector = await embedding_batcher.encode(query)
+    return vector.tolist()
+
+
+async def classify_query(query):
+    # None (leave it to Gemini) without a configured classifier
+    if real_estate_classifier is None:
+        return None
+    vector = await embedding_batcher.encode(query)
+    return real_estate_classifier.classify(vector)
+
+
+def search_properties(query_vector, top_k=5, filters=None):
+    return vector_store.search(query_vector, top_k, build_search_filter(filters or {}))
+
+
+def lexical_search(query_text, top_k=5, filters=None):
+    ids = lexical_index.search(query_text, top_k)
+    if not ids:
+        return []
+    # The vector store applies the same filters to the BM25 candidates
+    return vector_store.retrieve(ids, build_search_filter(filters or {}))
+
+
+async def retrieve_relevant_properties(query_vector, top_k=5, filters=None, query_text=None):
+    if not (HYBRID_SEARCH and query_text and lexical_index):
+        return await run_blocking(search_properties, query_vector, top_k, filters)
+
+    depth = max(top_k, HYBRID_CANDIDATES)
+    dense, lexical = await asyncio.gather(
+        run_blocking(search_properties, query_vector, depth, filters),
+        run_blocking(lexical_search, query_text, depth, filters))
+    hits = {hit.id: hit for hit in lexical}
+    hits.update((hit.id, hit) for hit in dense)
+    fused = reciprocal_rank_fusion(
+        [[hit.id for hit in dense], [hit.id for hit in lexical]])
+    return [hits[point_id] for point_id in fused[:top_k]]
+
+
+def intent_bucket(filters):
+    # Coarse query intent used to share cached descriptions between similar
+    # queries; prices are left out so every budget reuses the same text
+    bucket = {key: filters[key]
+              for key in ("rooms", "district", "is_new_building") if key in filters}
+    if isinstance(bucket.get("district"), str):
+        bucket["district"] = bucket["district"].strip().lower()
+    return json.dumps(bucket, sort_keys=True, ensure_ascii=False)
+
+
+async def describe_property(property_data, query, intent, semaphore):
+    listing_id = property_data['id']
+    updated_at = property_data.get('updated_at')
+
+    description = description_cache.lookup_memory(listing_id, updated_at, intent)
+    if description is None:
+        description = await run_blocking(
+            description_cache.lookup, listing_id, updated_at, intent)
+    if description is None:
+        async with semaphore:
+            description = await generate_property_description(property_data, query)
+        await run_blocking(
+            description_cache.store, listing_id, updated_at, intent, description)
+    return property_data, description
+
+
+async def generate_property_description(property_data, query):
+    # Backslashes are not allowed inside f-string expressions before Python 3.12
+    new_building = 'Ha' if property_data['is_new_building'] else "Yo'q"
     prompt = f"""Quyidagi ma'lumotlardan foydalanib, uy-joy haqida qisqa va ma'lumotli tavsif yozing. YouTube, Instagram yoki Telegram havolalarini olib tashlang. Oddiy matn ishlatib, asosiy ma'lumotlarni ta'kidlang. Javob uy joyga aloqador bo'lishi shart.
 
 Ma'lumotlar:
@@ -187,7 +667,7 @@ Ma'lumotlar:
 - Xonalar soni: {property_data['room']}
 - Maydon: {property_data['square']} kv.m
 - Qavat: {property_data['floor']}/{property_data['floor_total']}
-- Yangi qurilish: {'Ha' if property_data['is_new_building'] else 'Yo\'q'}
+- Yangi qurilish: {new_building}
 - Ta'mirlash: {property_data['repair']}
 - Poydevor: {property_data['foundation']}
 - Tavsif: {property_data['description']}
@@ -195,19 +675,16 @@ Ma'lumotlar:
 So'rov: {query}
 Tavsif:"""
 
-    response = model.generate_content(prompt)
+    response = await llm.generate_content_async(prompt)
     return response.text
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    credits = get_user_credits(user_id)
-    if credits is None:
-        update_user_credits(user_id, 200)
-        credits = 200
+    credits = await credit_store.ensure_user(user_id)
 
     # Initialize an empty chat history for the user
-    CHAT_HISTORIES[user_id] = []
+    session_store.reset(user_id)
 
     referral_link = f"https://t.me/{context.bot.username}?start={user_id}"
     await update.message.reply_text(
@@ -216,76 +693,125 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     )
 
 
-def is_real_estate_query(query):
-    model = genai.GenerativeModel('gemini-1.5-flash')
-    prompt = f"""Determine if the following query is related to real estate or property searching. Respond with only 'Yes' or 'No'.
+async def send_property_card(update, context, property_data, description):
+    urls = album_urls(property_data.get('photos', []))  # Limit to 10 photos
+
+    # Send photos if available; a photo that cannot be fetched only costs the
+    # album, not the whole answer
+    if urls:
+        await send_cached_album(context.bot, update.effective_chat.id, urls,
+                                photo_cache, run_blocking)
 
-Query: {query}
+    # Send property description
+    await update.message.reply_text(description)
 
-Is this query related to real estate?"""
 
-    response = model.generate_content(prompt)
-    return response.text.strip().lower() == 'yes'
+async def stream_property_cards(update, context, hits, query, intent):
+    # Start every description at once; the semaphore keeps this request's
+    # Gemini usage bounded
+    semaphore = asyncio.Semaphore(DESCRIPTION_CONCURRENCY)
+    tasks = [asyncio.create_task(describe_property(hit.payload, query, intent, semaphore))
+             for hit in hits]
+
+    try:
+        ready = asyncio.as_completed(tasks) if CARD_ORDER == "completed" else tasks
+        for task in ready:
+            property_data, description = await task
+            await send_property_card(update, context, property_data, description)
+    finally:
+        # Don't leave descriptions running if sending a card failed
+        for task in tasks:
+            task.cancel()
+
+    # Cards in rank order, for the query cache
+    return [task.result() for task in tasks]
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    credits = get_user_credits(user_id)
 
-    if credits <= 0:
-        await update.message.reply_text("Sizda kreditlar tugadi. Ko'proq kredit olish uchun do'stingizni taklif qiling!")
-        return
+    # Quick follow-up messages are merged into one query and replace work
+    # still running for the previous ones; the reply goes to the latest
+    admission.submit(
+        user_id, update.message.text,
+        functools.partial(process_query, update, context, user_id),
+        functools.partial(update.message.reply_text, BUSY_REPLY))
 
-    query = update.message.text
 
-    # Check if the query is related to real estate
-    if not is_real_estate_query(query):
-        await update.message.reply_text("Kechirasiz, men faqat ko'chmas mulk va uy-joy haqidagi so'rovlarga javob bera olaman. Iltimos, ko'chmas mulk bilan bog'liq savol bering.")
+async def process_query(update, context, user_id, query):
+    # Charge the credit up front in one atomic step; it is given back if the
+    # query is rejected, fails or is superseded by a newer message
+    new_credits = await credit_store.charge(user_id)
+    if new_credits is None:
+        await update.message.reply_text("Sizda kreditlar tugadi. Ko'proq kredit olish uchun do'stingizni taklif qiling!")
         return
 
-    # Start typing action
-    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
+    answered = False
+    try:
+        answered = await answer_query(update, context, user_id, query)
+    finally:
+        if not answered:
+            await credit_store.refund(user_id)
 
-    # Get the user's chat history
-    user_history = CHAT_HISTORIES.get(user_id, [])
-    chat_history = "\n".join(user_history)
+    if answered:
+        await update.message.reply_text(f"Sizda {new_credits} ta kredit qoldi.")
 
-    # Improve the query
-    improved_query = improve_query(query, chat_history)
 
-    # Retrieve relevant properties
-    relevant_properties = retrieve_relevant_properties(improved_query)
+async def answer_query(update, context, user_id, query):
+    if not await wait_until_ready(update):
+        return False
 
-    if not relevant_properties:
-        await update.message.reply_text("Kechirasiz, so'rovingizga mos uy-joylar topilmadi.")
-        return
+    # Check the query is related to real estate with the local classifier,
+    # if one is configured; otherwise and for uncertain queries the LLM's
+    # verdict below decides
+    verdict = await classify_query(query)
+    if verdict is False:
+        await update.message.reply_text(NOT_REAL_ESTATE_REPLY)
+        return False
 
-    # Send each property as a separate message
-    for hit in relevant_properties:
-        property_data = hit.payload
-        photos = property_data.get('photos', [])
+    # Start typing action
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action=ChatAction.TYPING)
 
-        # Generate description for the property
-        description = generate_property_description(property_data, query)
+    # Get the user's chat history
+    chat_history = session_store.get(user_id)
+    if chat_history is None:
+        chat_history = await run_blocking(session_store.load, user_id)
+
+    # Improve the query and extract filters
+    understanding = await understand_query(query, chat_history)
+    if verdict is None and not understanding["is_real_estate"]:
+        await update.message.reply_text(NOT_REAL_ESTATE_REPLY)
+        return False
+
+    # Reuse the cards of a near-identical earlier query if there is one
+    query_vector = await embed_query(understanding["search_query"])
+    filters_key = json.dumps(
+        understanding["filters"], sort_keys=True, ensure_ascii=False)
+    cards = query_cache.lookup(query_vector, filters_key)
+
+    if cards is not None:
+        for property_data, description in cards:
+            await send_property_card(update, context, property_data, description)
+    else:
+        # Retrieve relevant properties
+        relevant_properties = await retrieve_relevant_properties(
+            query_vector, filters=understanding["filters"],
+            query_text=f"{query} {understanding['search_query']}")
 
-        # Send photos if available
-        if photos:
-            media_group = [InputMediaPhoto(photo.strip())
-                           for photo in photos[:10]]  # Limit to 10 photos
-            await context.bot.send_media_group(chat_id=update.effective_chat.id, media=media_group)
+        if not relevant_properties:
+            await update.message.reply_text("Kechirasiz, so'rovingizga mos uy-joylar topilmadi.")
+            return False
 
-        # Send property description
-        await update.message.reply_text(description)
+        # Send each property as a separate message, as soon as its description is ready
+        cards = await stream_property_cards(
+            update, context, relevant_properties, query,
+            intent_bucket(understanding["filters"]))
+        query_cache.store(query_vector, filters_key, cards)
 
     # Update chat history
-    user_history = user_history[-4:] + \
-        [f"User: {query}", f"Bot: Natijalar yuborildi"]
-    CHAT_HISTORIES[user_id] = user_history
+    session_store.add(user_id, query)
+    return True
 
-    # Update user credits
-    new_credits = credits - 1
-    update_user_credits(user_id, new_credits)
-    await update.message.reply_text(f"Sizda {new_credits} ta kredit qoldi.")
 
 async def handle_referral(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     args = context.args
@@ -293,21 +819,56 @@ async def handle_referral(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         referrer_id = int(args[0])
         user_id = update.effective_user.id
         if referrer_id != user_id:
-            add_referral(user_id, referrer_id)
-            await update.message.reply_text("Taklif havolasidan foydalanganingiz uchun rahmat! Siz va do'stingiz 25 ta kredit oldingiz.")
+            if await credit_store.add_referral(user_id, referrer_id):
+                await update.message.reply_text("Taklif havolasidan foydalanganingiz uchun rahmat! Siz va do'stingiz 25 ta kredit oldingiz.")
         else:
             await update.message.reply_text("O'zingizni taklif qila olmaysiz!")
     await start(update, context)
 
 
 def main() -> None:
-    # Set up databases
-    setup_qdrant()
-    setup_user_db()
+    profile = StartupProfile()
+    profile.mark("imports done")
+
+    # Set up databases; the vector store is loaded in the background
+    with profile.phase("user db"):
+        setup_user_db()
+    with profile.phase("local stores"):
+        setup_local_stores()
+
+    if "--profile-startup" in sys.argv:
+        # Run the same phases in the foreground and report instead of polling
+        profile.mark("accepting updates")
+        warm_up(profile)
+        profile.mark("services ready")
+        print(profile.report())
+        return
+
+    async def post_init(application):
+        profile.mark("accepting updates")
+        if isinstance(credit_store, CreditLedger):
+            credit_store.start()
+        application.create_task(save_sessions_periodically())
+        if QDRANT_SYNC_INTERVAL > 0:
+            application.create_task(sync_qdrant_periodically())
+        if PHOTO_WARMUP_CHAT_ID:
+            application.create_task(prewarm_photos_periodically(application.bot))
+        application.create_task(warm_up_in_background(profile))
+
+    async def post_shutdown(application):
+        # Write out pending credit changes and sessions before exiting
+        if isinstance(credit_store, CreditLedger):
+            await credit_store.close()
+        else:
+            credit_store.close()
+        session_store.close()
 
     # Set up the Telegram bot
-    application = Application.builder().token(
-        os.getenv("TELEGRAM_BOT_TOKEN")).build()
+    # Handlers are fully async, so updates from different users run side by
+    # side; each user's own messages are still handled in order
+    application = (Application.builder().token(os.getenv("TELEGRAM_BOT_TOKEN"))
+                   .concurrent_updates(PerChatUpdateProcessor(UPDATE_WORKERS))
+                   .post_init(post_init).post_shutdown(post_shutdown).build())
 
     # Add handlers
     application.add_handler(CommandHandler("start", handle_referral))
@@ -315,7 +876,18 @@ def main() -> None:
         filters.TEXT & ~filters.COMMAND, handle_message))
 
     # Run the bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL:
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == '__main__':
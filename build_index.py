@@ -0,0 +1,99 @@
+# Offline index build: embeds uybor_listings.db into a versioned vector
+# snapshot under snapshots/<time>-<checksum>/, so serving nodes load vectors
+# instead of running the encoder at startup. Each snapshot records the
+# encoder, the listing document version, the payload indexes and a checksum
+# of the source database; the bot only picks up snapshots that match its own
+# encoder and document version. Nothing is built when the newest snapshot
+# already covers the same database (--force rebuilds anyway).
+#
+#   python build_index.py [--db uybor_listings.db] [--output snapshots]
+#                         [--compression int8] [--pca 128] [--hnsw] [--keep 3]
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from embedding_cache import EmbeddingCache
+from encoders import encoder_id, load_encoder
+from ingest import Progress, encode_documents
+from listings import (DOCUMENT_VERSION, FILTER_INDEXES, count_listings, iter_listings,
+                      listing_document, listing_payload)
+from vector_compression import COMPRESSIONS
+from vector_store import find_snapshot, write_snapshot
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def listing_batches(db_path, encoder, batch_size, cache, progress):
+    for rows in iter_listings(db_path, batch_size):
+        vectors = encode_documents(
+            encoder, [listing_document(row) for row in rows], batch_size, cache)
+        yield [row[0] for row in rows], vectors, [listing_payload(row) for row in rows]
+        progress.advance(len(rows))
+
+
+def prune_snapshots(output, keep):
+    # Deletes all but the `keep` newest snapshots. Processes still serving a
+    # deleted one keep their mapped files until they restart.
+    snapshots = []
+    for name in os.listdir(output):
+        try:
+            with open(os.path.join(output, name, "meta.json")) as f:
+                snapshots.append((json.load(f)["created_at"], name))
+        except (OSError, ValueError, KeyError):
+            continue
+    for _, name in sorted(snapshots, reverse=True)[keep:]:
+        shutil.rmtree(os.path.join(output, name))
+        print(f"Removed old snapshot {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a versioned vector snapshot of the listings")
+    parser.add_argument("--db", default="uybor_listings.db")
+    parser.add_argument("--output", default=os.getenv("SNAPSHOT_DIR", "snapshots"))
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("INGEST_ENCODE_BATCH", 256)))
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="none")
+    parser.add_argument("--pca", type=int, default=None)
+    parser.add_argument("--hnsw", action="store_true")
+    parser.add_argument("--keep", type=int, default=3, help="snapshots to keep, newest first")
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    checksum = file_checksum(args.db)
+    requirements = {"encoder": encoder_id(), "document_version": DOCUMENT_VERSION}
+    latest = find_snapshot(args.output, **requirements)
+    if latest and not args.force:
+        with open(os.path.join(latest, "meta.json")) as f:
+            if json.load(f).get("source_checksum") == checksum:
+                print(f"{latest} already covers {args.db}; nothing to build")
+                return
+
+    encoder = load_encoder()
+    dimension = encoder.get_sentence_embedding_dimension()
+    cache = EmbeddingCache(os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"), encoder_id(), dimension)
+    count = count_listings(args.db)
+    directory = os.path.join(args.output, f"{time.strftime('%Y%m%d-%H%M%S')}-{checksum[:8]}")
+
+    started = time.perf_counter()
+    write_snapshot(
+        directory, listing_batches(args.db, encoder, args.batch_size, cache, Progress(count)),
+        count, dimension, hnsw=args.hnsw, compression=args.compression, pca_dimension=args.pca,
+        metadata={**requirements, "collection": "uybozor_data",
+                  "source_db": os.path.basename(args.db), "source_checksum": checksum,
+                  "payload_indexes": FILTER_INDEXES})
+    print(f"Built {directory}: {count} listings in {time.perf_counter() - started:.1f}s, "
+          f"{cache.stats()['misses']} newly encoded")
+    prune_snapshots(args.output, args.keep)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import numpy as np
+
+# Labelled example queries the local real-estate gate is scored against.
+# Uzbek (Latin and Cyrillic), Russian and English, like the bot's users.
+REAL_ESTATE_EXAMPLES = [
+    "Chilonzorda 2 xonali kvartira",
+    "2 xonali Chilonzor",
+    "Yunusobodda 3 xonali uy sotiladi",
+    "Toshkentda arzon kvartira kerak",
+    "50 ming dollargacha 2 xonali kvartira",
+    "yangi qurilgan uydan kvartira",
+    "Mirzo Ulug'bek tumanida hovli uy",
+    "Sergelida 1 xonali kvartira ijaraga",
+    "metroga yaqin kvartira qidiryapman",
+    "ta'mirlangan 4 xonali kvartira",
+    "Musaffo turar joy majmuasida kvartira",
+    "Yunusobod 19-kvartal 2 xonali",
+    "uy sotib olmoqchiman",
+    "hovli joy narxi qancha",
+    "100 kv.m dan katta kvartira",
+    "yer uchastkasi sotiladi",
+    "Чиланзарда 2 хонали квартира",
+    "Юнусободда уй сотилади",
+    "арзон хонадон керак",
+    "Квартира в Чиланзаре 2 комнаты",
+    "Купить квартиру в Ташкенте",
+    "Продается дом в Юнусабаде",
+    "новостройка в Мирзо-Улугбекском районе",
+    "3-комнатная квартира до 70000 долларов",
+    "снять квартиру посуточно",
+    "квартира с ремонтом рядом с метро",
+    "участок под строительство",
+    "коммерческая недвижимость в центре",
+    "2 bedroom apartment in Tashkent",
+    "house for sale in Chilanzar",
+    "cheap flat near metro",
+    "new building apartment with renovation",
+    "how much does a 3 room flat cost in Yunusabad",
+    "office space for rent",
+    "kvartira narxlari qanday",
+    "4 qavatli uyning 2-qavatidan kvartira",
+    "ipotekaga kvartira olsa bo'ladimi",
+    "kirpich uy, 3 xona, Olmazor",
+    "дача в Паркенте",
+    "evro ta'mirli kvartira",
+]
+
+OTHER_EXAMPLES = [
+    "salom",
+    "qalaysiz",
+    "rahmat",
+    "bugun ob-havo qanday",
+    "futbol natijalari",
+    "menga she'r yozib ber",
+    "dollar kursi qancha",
+    "eng yaxshi restoran qayerda",
+    "telefon sotib olmoqchiman",
+    "mashina sotiladi Nexia 3",
+    "ingliz tilini qanday o'rganish mumkin",
+    "Python dasturlash tili haqida",
+    "сен кимсан",
+    "ассалому алайкум",
+    "ошни қандай пиширади",
+    "Привет, как дела?",
+    "Какая погода в Ташкенте",
+    "расскажи анекдот",
+    "курс доллара на сегодня",
+    "продаю iPhone 13",
+    "где купить билеты на самолет",
+    "как приготовить плов",
+    "переведи текст на английский",
+    "hello",
+    "what can you do",
+    "tell me a joke",
+    "who won the football match",
+    "write a poem about love",
+    "how to learn programming",
+    "best laptop under 1000 dollars",
+    "buy a used car",
+    "what time is it",
+    "ish qidiryapman",
+    "kitob tavsiya qiling",
+    "taksi chaqirish",
+    "кто президент Узбекистана",
+    "помоги решить задачу по математике",
+    "recipe for lagman",
+    "bitcoin narxi",
+    "yangi yil tabriklari",
+]
+
+
+class RealEstateClassifier:
+    # Scores a query embedding by how much closer it is to the real-estate
+    # examples than to the other examples (mean similarity of the top_k
+    # nearest of each). Scores above `high` are accepted, anything lower is
+    # left to the LLM. With `low` set, scores below it are rejected without
+    # asking the LLM; it is off by default because a wrong rejection turns a
+    # user away, so set it only from benchmarks/evaluate_classifier.py's
+    # calibration on the deployed encoder.
+
+    def __init__(self, encoder, positives=None, negatives=None, low=None, high=0.05, top_k=3):
+        self.low = low
+        self.high = high
+        self.top_k = top_k
+        positives = positives or REAL_ESTATE_EXAMPLES
+        negatives = negatives or OTHER_EXAMPLES
+        self.positives = self._encode(encoder, positives)
+        self.negatives = self._encode(encoder, negatives)
+
+    def score(self, query_vector):
+        vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector = vector / norm
+        return self._nearest(self.positives, vector) - self._nearest(self.negatives, vector)
+
+    def classify(self, query_vector):
+        # True / False when confident, None when the LLM should decide
+        score = self.score(query_vector)
+        if score >= self.high:
+            return True
+        if self.low is not None and score <= self.low:
+            return False
+        return None
+
+    def _nearest(self, examples, vector):
+        similarities = examples @ vector
+        k = min(self.top_k, len(similarities))
+        return float(np.mean(np.partition(similarities, -k)[-k:]))
+
+    @staticmethod
+    def _encode(encoder, texts):
+        vectors = np.asarray(encoder.encode(list(texts)), dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
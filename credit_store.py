@@ -0,0 +1,327 @@
+import asyncio
+import glob
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CreditStore:
+    # User credits on one long-lived WAL-mode SQLite connection. Every
+    # operation is a single atomic statement (or one short transaction) run on
+    # the store's own worker thread, so async handlers can await it without
+    # blocking the event loop and concurrent handlers cannot lose updates.
+
+    def __init__(self, db_path, starting_credits=200, referral_bonus=25):
+        self.starting_credits = starting_credits
+        self.referral_bonus = referral_bonus
+        # One thread owns the connection, which also serialises writers
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="credits")
+        self.conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            credits INTEGER DEFAULT {int(starting_credits)},
+            referrer_id INTEGER
+        )
+        ''')
+        # Sequence number of the last CreditLedger batch written to users
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_applied INTEGER
+        )
+        ''')
+        self.conn.execute(
+            'INSERT OR IGNORE INTO ledger_state (id, last_applied) VALUES (1, 0)')
+
+    async def get_credits(self, user_id):
+        return await self._run(self._get_credits, user_id)
+
+    async def ensure_user(self, user_id):
+        # Creates the user with the starting balance if needed; returns the balance
+        return await self._run(self._ensure_user, user_id)
+
+    async def charge(self, user_id, amount=1):
+        # Returns the new balance, or None if the user cannot afford it
+        return await self._run(self._charge, user_id, amount)
+
+    async def refund(self, user_id, amount=1):
+        return await self._run(self._refund, user_id, amount)
+
+    async def add_referral(self, user_id, referrer_id):
+        # Returns True if the referral was recorded and the bonus paid
+        return await self._run(self._add_referral, user_id, referrer_id)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.conn.close()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    def _get_user(self, user_id):
+        return self.conn.execute(
+            'SELECT credits, referrer_id FROM users WHERE user_id = ?', (user_id,)).fetchone()
+
+    def _last_applied(self):
+        return self.conn.execute(
+            'SELECT last_applied FROM ledger_state WHERE id = 1').fetchone()[0]
+
+    def _apply_batch(self, seq, deltas, referrals):
+        # Applies one ledger batch in a single transaction; batches that were
+        # already applied (seq <= last_applied) are skipped, which makes
+        # journal replay after a crash idempotent
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            if seq <= self._last_applied():
+                return False
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO users (user_id, credits) VALUES (?, ?)',
+                [(user_id, self.starting_credits) for user_id in deltas])
+            self.conn.executemany(
+                'UPDATE users SET credits = credits + ? WHERE user_id = ?',
+                [(delta, user_id) for user_id, delta in deltas.items() if delta])
+            self.conn.executemany(
+                'UPDATE users SET referrer_id = ? WHERE user_id = ? AND referrer_id IS NULL',
+                [(referrer_id, user_id) for user_id, referrer_id in referrals.items()])
+            self.conn.execute(
+                'UPDATE ledger_state SET last_applied = ? WHERE id = 1', (seq,))
+        return True
+
+    def _get_credits(self, user_id):
+        row = self.conn.execute(
+            'SELECT credits FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def _ensure_user(self, user_id):
+        return self.conn.execute('''
+            INSERT INTO users (user_id, credits) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET credits = credits
+            RETURNING credits
+        ''', (user_id, self.starting_credits)).fetchone()[0]
+
+    def _charge(self, user_id, amount):
+        # Unknown users start with the default balance; the WHERE clause makes
+        # the check and the decrement a single atomic step
+        row = self.conn.execute('''
+            INSERT INTO users (user_id, credits) SELECT ?, ? WHERE ? >= 0
+            ON CONFLICT (user_id) DO UPDATE SET credits = credits - ?
+            WHERE credits >= ?
+            RETURNING credits
+        ''', (user_id, self.starting_credits - amount, self.starting_credits - amount,
+              amount, amount)).fetchone()
+        return row[0] if row else None
+
+    def _refund(self, user_id, amount):
+        row = self.conn.execute(
+            'UPDATE users SET credits = credits + ? WHERE user_id = ? RETURNING credits',
+            (amount, user_id)).fetchone()
+        return row[0] if row else None
+
+    def _add_referral(self, user_id, referrer_id):
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute(
+                'INSERT OR IGNORE INTO users (user_id, credits) VALUES (?, ?)',
+                (user_id, self.starting_credits))
+            # Only the first referral of a user counts
+            recorded = self.conn.execute(
+                'UPDATE users SET referrer_id = ? WHERE user_id = ? AND referrer_id IS NULL',
+                (referrer_id, user_id)).rowcount
+            if recorded:
+                self.conn.execute(
+                    'UPDATE users SET credits = credits + ? WHERE user_id = ?',
+                    (self.referral_bonus, referrer_id))
+        return bool(recorded)
+
+
+class CreditLedger:
+    # Write-behind front for a CreditStore. Charges, refunds and referral
+    # bonuses are decided against in-memory balances, appended to a journal
+    # file and written to SQLite in one transaction per flush window (one
+    # fsync per window instead of one commit per message). Reads include the
+    # pending changes. Journals left behind by a crash are replayed on start.
+    # Assumes this process is the only writer of the users table.
+
+    def __init__(self, store, journal_dir, flush_interval=2.0, max_cached_users=100000):
+        self.store = store
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+        self.max_cached_users = max_cached_users
+        self.starting_credits = store.starting_credits
+        self.referral_bonus = store.referral_bonus
+
+        self.users = {}       # user_id -> [balance, referrer_id], incl. pending
+        self.deltas = {}      # user_id -> pending credit change
+        self.referrals = {}   # user_id -> pending referrer_id
+        self.flush_lock = asyncio.Lock()
+        self.flusher = None
+        # Journals of failed flushes; their changes were put back into the
+        # pending set, so they can go once a later batch is committed
+        self.failed_journals = []
+
+        os.makedirs(journal_dir, exist_ok=True)
+        self.seq = self._replay() + 1
+        self.journal = self._open_journal(self.seq)
+
+    async def get_credits(self, user_id):
+        user = await self._load(user_id)
+        return user[0] if user else None
+
+    async def ensure_user(self, user_id):
+        user = await self._load_or_create(user_id)
+        return user[0]
+
+    async def charge(self, user_id, amount=1):
+        user = await self._load_or_create(user_id)
+        # No await between the check and the update, so this is atomic
+        if user[0] < amount:
+            return None
+        self._record(user_id, -amount)
+        return user[0]
+
+    async def refund(self, user_id, amount=1):
+        user = await self._load(user_id)
+        if user is None:
+            return None
+        self._record(user_id, amount)
+        return user[0]
+
+    async def add_referral(self, user_id, referrer_id):
+        referrer = await self._load(referrer_id)
+        user = await self._load_or_create(user_id)
+        if user[1] is not None:
+            return False
+
+        user[1] = referrer_id
+        self.referrals[user_id] = referrer_id
+        self._write({"op": "referral", "user": user_id, "referrer": referrer_id})
+        # Like CreditStore, the bonus only goes to a referrer that exists. A
+        # flush may have evicted it (unchanged) while the user was loading;
+        # if another task has reloaded it since, that copy is the current one
+        if referrer is not None:
+            self.users.setdefault(referrer_id, referrer)
+            self._record(referrer_id, self.referral_bonus)
+        return True
+
+    def start(self):
+        if self.flusher is None:
+            self.flusher = asyncio.ensure_future(self._flush_periodically())
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.deltas and not self.referrals:
+                return
+            seq, deltas, referrals = self.seq, self.deltas, self.referrals
+            journal = self.journal
+            self.deltas, self.referrals = {}, {}
+            self.seq += 1
+            self.journal = self._open_journal(self.seq)
+
+            try:
+                await self.store._run(self._commit, journal, seq, deltas, referrals)
+            except Exception:
+                for user_id, delta in deltas.items():
+                    self.deltas[user_id] = self.deltas.get(user_id, 0) + delta
+                self.referrals.update(referrals)
+                self.failed_journals.append(journal.name)
+                raise
+
+            if len(self.users) > self.max_cached_users:
+                for user_id in [u for u in self.users if u not in self.deltas]:
+                    del self.users[user_id]
+
+    async def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        await self.flush()
+        self.journal.close()
+        os.remove(self.journal.name)
+        self.store.close()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Kredit jurnalini yozishda xatolik: {e}")
+
+    async def _load(self, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            row = await self.store._run(self.store._get_user, user_id)
+            # Another task may have loaded (and changed) it meanwhile
+            user = self.users.get(user_id)
+            if user is None and row is not None:
+                user = self.users[user_id] = [row[0], row[1]]
+        return user
+
+    async def _load_or_create(self, user_id):
+        await self._load(user_id)
+        # Re-read after the last await: another task may have created the
+        # user meanwhile, and creating it again would drop that task's changes
+        user = self.users.get(user_id)
+        if user is None:
+            user = self._create(user_id)
+        return user
+
+    def _create(self, user_id):
+        user = self.users[user_id] = [self.starting_credits, None]
+        self._record(user_id, 0)
+        return user
+
+    def _record(self, user_id, amount):
+        self.users[user_id][0] += amount
+        self.deltas[user_id] = self.deltas.get(user_id, 0) + amount
+        self._write({"op": "delta", "user": user_id, "amount": amount})
+
+    def _write(self, record):
+        # Reaches the OS right away (survives a process crash); fsync happens
+        # once per flush window in _commit
+        self.journal.write(json.dumps(record) + "\n")
+        self.journal.flush()
+
+    def _commit(self, journal, seq, deltas, referrals):
+        if not journal.closed:
+            os.fsync(journal.fileno())
+            journal.close()
+        self.store._apply_batch(seq, deltas, referrals)
+        for path in self.failed_journals + [journal.name]:
+            os.remove(path)
+        self.failed_journals = []
+
+    def _open_journal(self, seq):
+        return open(os.path.join(self.journal_dir, f"journal.{seq:012d}.log"), "a")
+
+    def _replay(self):
+        # Applies journals left over from a previous run, oldest first, and
+        # returns the last batch sequence number in the database
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "journal.*.log"))):
+            seq = int(os.path.basename(path).split(".")[1])
+            deltas, referrals = {}, {}
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # torn write at the end of the file
+                    if record["op"] == "delta":
+                        deltas[record["user"]] = deltas.get(
+                            record["user"], 0) + record["amount"]
+                    elif record["op"] == "referral":
+                        referrals[record["user"]] = record["referrer"]
+                        deltas.setdefault(record["user"], 0)
+            if deltas or referrals:
+                if self.store._apply_batch(seq, deltas, referrals):
+                    print(f"Kredit jurnali tiklandi: {os.path.basename(path)}")
+            os.remove(path)
+        return self.store._last_applied()
@@ -0,0 +1,147 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class DescriptionCache:
+    # Two-tier cache of generated property descriptions: an in-memory LRU in
+    # front of a SQLite table. Entries are keyed by listing id and query-intent
+    # bucket and remember the listing's updated_at, so a listing re-scraped
+    # with a newer updated_at is treated as a miss and its old text dropped.
+
+    def __init__(self, db_path, max_memory_entries=2000, max_db_entries=100000):
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_db_entries = max_db_entries
+        self.memory = OrderedDict()
+        # `lock` guards the LRU and counters and is never held during
+        # SQLite I/O, so lookup_memory on the event loop never waits on a
+        # commit; `db_lock` serialises the connection
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "invalidations": 0,
+            "memory_evictions": 0,
+            "db_evictions": 0,
+        }
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS descriptions (
+            listing_id INTEGER,
+            intent TEXT,
+            updated_at TEXT,
+            description TEXT,
+            last_used REAL,
+            PRIMARY KEY (listing_id, intent)
+        )
+        ''')
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS descriptions_last_used ON descriptions (last_used)')
+        self.conn.commit()
+        # Rows in the table, kept in memory so stores only count them again
+        # when the limit is crossed. Replacing an existing row still counts
+        # as one more, which at worst triggers that recount early.
+        self.db_count = self.conn.execute('SELECT COUNT(*) FROM descriptions').fetchone()[0]
+
+    def lookup_memory(self, listing_id, updated_at, intent):
+        with self.lock:
+            return self._lookup_memory((listing_id, intent), updated_at)
+
+    def lookup(self, listing_id, updated_at, intent):
+        key = (listing_id, intent)
+        with self.lock:
+            description = self._lookup_memory(key, updated_at)
+        if description is not None:
+            return description
+
+        with self.db_lock:
+            row = self.conn.execute(
+                'SELECT updated_at, description FROM descriptions WHERE listing_id = ? AND intent = ?',
+                key).fetchone()
+            if row is not None and row[0] != updated_at:
+                # The scraper saw a newer version of the listing
+                deleted = self.conn.execute(
+                    'DELETE FROM descriptions WHERE listing_id = ?', (listing_id,)).rowcount
+                self.conn.commit()
+                self.db_count -= deleted
+            elif row is not None:
+                self.conn.execute(
+                    'UPDATE descriptions SET last_used = ? WHERE listing_id = ? AND intent = ?',
+                    (time.time(), listing_id, intent))
+                self.conn.commit()
+
+        with self.lock:
+            if row is None or row[0] != updated_at:
+                if row is not None:
+                    self.counters["invalidations"] += 1
+                self.counters["misses"] += 1
+                return None
+            self.counters["db_hits"] += 1
+            self._remember(key, updated_at, row[1])
+        return row[1]
+
+    def store(self, listing_id, updated_at, intent, description):
+        key = (listing_id, intent)
+        with self.lock:
+            self._remember(key, updated_at, description)
+        with self.db_lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO descriptions (listing_id, intent, updated_at, description, last_used) VALUES (?, ?, ?, ?, ?)',
+                (listing_id, intent, updated_at, description, time.time()))
+            self.db_count += 1
+            if self.db_count > self.max_db_entries:
+                self._evict_db()
+            self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+        with self.db_lock:
+            stats["db_entries"] = self.conn.execute(
+                'SELECT COUNT(*) FROM descriptions').fetchone()[0]
+        lookups = stats["memory_hits"] + stats["db_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            stats["memory_hits"] + stats["db_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self.db_lock:
+            self.conn.close()
+
+    def _lookup_memory(self, key, updated_at):
+        entry = self.memory.get(key)
+        if entry is None:
+            return None
+        if entry[0] != updated_at:
+            del self.memory[key]
+            return None
+        self.memory.move_to_end(key)
+        self.counters["memory_hits"] += 1
+        return entry[1]
+
+    def _remember(self, key, updated_at, description):
+        self.memory[key] = (updated_at, description)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+            self.counters["memory_evictions"] += 1
+
+    def _evict_db(self):
+        # Called with db_lock held, once db_count is past the limit
+        count = self.conn.execute(
+            'SELECT COUNT(*) FROM descriptions').fetchone()[0]
+        overflow = count - self.max_db_entries
+        if overflow > 0:
+            self.conn.execute(
+                'DELETE FROM descriptions WHERE rowid IN (SELECT rowid FROM descriptions ORDER BY last_used LIMIT ?)',
+                (overflow,))
+            with self.lock:
+                self.counters["db_evictions"] += overflow
+        self.db_count = min(count, self.max_db_entries)
@@ -0,0 +1,180 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+
+class EmbeddingCache:
+    # Document embeddings keyed by a hash of the exact text that was encoded,
+    # so re-ingests, syncs and reindexes only run the encoder on documents
+    # whose text changed. On disk, in `directory`:
+    #   vectors.f32  float32 rows, appended as new texts are encoded
+    #   index.bin    one 20-byte sha1 digest per row, in the same order
+    #   meta.json    encoder and dimension; a different encoder starts afresh
+    #   lock         flock()ed around every read and write of the files
+    # Several processes (the bot's sync, build_index.py, reindex.py, main.py)
+    # can share one directory: under the lock each first picks up the rows
+    # the others appended, and a new row's number is taken from the file
+    # size, not from what this process last saw. Rows are written before
+    # their digests, so a crash can at worst leave rows without a digest,
+    # which are cut off on the next open. Past `max_entries` rows the files
+    # are rewritten with the newest half; the other processes notice the new
+    # files and reload.
+
+    DIGEST_SIZE = 20
+
+    def __init__(self, directory, model, dimension, max_entries=200000):
+        self.directory = directory
+        self.dimension = dimension
+        self.max_entries = max_entries
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.index_path = os.path.join(directory, "index.bin")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.meta = {"model": model, "dimension": dimension}
+        self.row_bytes = 4 * dimension
+        self.lock = threading.Lock()
+        self.hits = self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.lock_file = open(os.path.join(directory, "lock"), "a")
+
+        with self._locked():
+            try:
+                with open(self.meta_path) as f:
+                    same_encoder = json.load(f) == self.meta
+            except (OSError, ValueError):
+                same_encoder = False
+            if not same_encoder:
+                for path in (self.vectors_path, self.index_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                with open(self.meta_path, "w") as f:
+                    json.dump(self.meta, f)
+            # Nobody else is appending while the lock is held, so rows past
+            # the shorter of the two files are left over from a crash
+            count = min(self._size(self.index_path) // self.DIGEST_SIZE,
+                        self._size(self.vectors_path) // self.row_bytes)
+            for path, size in ((self.index_path, count * self.DIGEST_SIZE),
+                               (self.vectors_path, count * self.row_bytes)):
+                with open(path, "ab") as f:
+                    f.truncate(size)
+            self._reset()
+            self._refresh()
+
+    def __len__(self):
+        return self.count
+
+    def encode(self, encoder, texts, batch_size=256):
+        # Vectors for texts, as a float32 array; only unseen texts are encoded
+        keys = [hashlib.sha1(text.encode("utf-8")).digest() for text in texts]
+        texts_by_key = dict(zip(keys, texts))
+        encoded = {}
+        with self.lock:
+            while True:
+                with self._locked():
+                    self._refresh()
+                    absent = [key for key in texts_by_key if key not in self.rows]
+                    if not encoded:
+                        self.misses += sum(key not in self.rows for key in keys)
+                        self.hits += sum(key in self.rows for key in keys)
+                    needed = [key for key in absent if key not in encoded]
+                    if not needed:
+                        if absent:
+                            self._append(absent, np.stack([encoded[key] for key in absent]))
+                        result = self._read(keys)
+                        if self.count > self.max_entries:
+                            self._compact(self.max_entries // 2)
+                        return result
+                # Encoded without the file lock. Rows another process
+                # compacted away meanwhile come back as needed on the next
+                # pass; texts it appended meanwhile are not written twice.
+                vectors = np.asarray(encoder.encode(
+                    [texts_by_key[key] for key in needed], batch_size=batch_size), dtype=np.float32)
+                encoded.update(zip(needed, vectors.reshape(len(needed), self.dimension)))
+
+    def stats(self):
+        return {"entries": self.count, "hits": self.hits, "misses": self.misses}
+
+    @contextlib.contextmanager
+    def _locked(self):
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _size(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _reset(self):
+        self.rows = {}
+        self.count = 0
+        self.vectors = None
+        self.inode = os.stat(self.index_path).st_ino if os.path.exists(self.index_path) else None
+
+    def _refresh(self):
+        # Under the file lock: picks up rows other processes appended, and
+        # starts over when the files were replaced (compaction, new encoder)
+        inode = os.stat(self.index_path).st_ino if os.path.exists(self.index_path) else None
+        if inode != self.inode or self._size(self.index_path) < self.count * self.DIGEST_SIZE:
+            with open(self.meta_path) as f:
+                if json.load(f) != self.meta:
+                    raise RuntimeError(f"{self.directory} is now used by another encoder")
+            self._reset()
+        count = min(self._size(self.index_path) // self.DIGEST_SIZE,
+                    self._size(self.vectors_path) // self.row_bytes)
+        if count > self.count:
+            with open(self.index_path, "rb") as f:
+                f.seek(self.count * self.DIGEST_SIZE)
+                digests = f.read((count - self.count) * self.DIGEST_SIZE)
+            for i in range(count - self.count):
+                self.rows[digests[i * self.DIGEST_SIZE:(i + 1) * self.DIGEST_SIZE]] = self.count + i
+            self.count = count
+            self.vectors = None
+
+    def _append(self, keys, vectors):
+        # Under the file lock; row numbers come from the file size
+        row = self._size(self.vectors_path) // self.row_bytes
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+        with open(self.index_path, "ab") as f:
+            f.write(b"".join(keys))
+        for offset, key in enumerate(keys):
+            self.rows[key] = row + offset
+        self.count = row + len(keys)
+        self.vectors = None
+        if self.inode is None:
+            self.inode = os.stat(self.index_path).st_ino
+
+    def _read(self, keys):
+        if not keys:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        # Fancy indexing copies, so the rows stay valid after the lock is let go
+        return self._mapped()[[self.rows[key] for key in keys]]
+
+    def _compact(self, keep):
+        # Rewrites both files with the newest `keep` rows and swaps them in;
+        # other processes see a new index.bin inode and reload
+        start = self.count - keep
+        vectors = np.array(self._mapped()[start:])
+        with open(self.index_path, "rb") as f:
+            f.seek(start * self.DIGEST_SIZE)
+            digests = f.read(keep * self.DIGEST_SIZE)
+        self.vectors = None
+        for path, data in ((self.vectors_path, vectors.tobytes()), (self.index_path, digests)):
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+        self._reset()
+        self._refresh()
+
+    def _mapped(self):
+        # Re-mapped lazily after appends
+        if self.vectors is None:
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                     shape=(self.count, self.dimension))
+        return self.vectors
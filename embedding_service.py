@@ -0,0 +1,76 @@
+import asyncio
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    # Collects encode requests that arrive within max_wait seconds of each
+    # other (or until max_batch_size is reached) and runs them as a single
+    # batched encoder.encode call on the executor, so concurrent users share
+    # one forward pass instead of each running their own. When no batch is
+    # running a request is sent straight away, so a lone user never waits.
+
+    def __init__(self, encoder, executor, max_batch_size=32, max_wait=0.005):
+        self.encoder = encoder
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.flush_handle = None
+        self.running = set()
+        self.in_flight = 0
+        self.batches = 0
+        self.encoded = 0
+
+    async def encode(self, text):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+
+        if len(self.pending) >= self.max_batch_size or not self.in_flight:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "mean_batch_size": self.encoded / self.batches if self.batches else 0.0,
+        }
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            self.in_flight += 1
+            task = asyncio.ensure_future(self._run(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _run(self, batch):
+        texts = [text for text, _ in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            vectors = await loop.run_in_executor(
+                self.executor, self._encode_batch, texts)
+        except Exception as e:
+            self.in_flight -= 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.in_flight -= 1
+        self.batches += 1
+        self.encoded += len(batch)
+        for (_, future), vector in zip(batch, vectors):
+            # The caller may have been cancelled while the batch was running
+            if not future.done():
+                future.set_result(vector)
+
+    def _encode_batch(self, texts):
+        return np.asarray(self.encoder.encode(texts, batch_size=len(texts)))
@@ -0,0 +1,95 @@
+import json
+import os
+
+import numpy as np
+
+ENCODER_MODEL = "all-MiniLM-L6-v2"
+ONNX_MODEL_DIR = os.path.join("models", "all-MiniLM-L6-v2-onnx")
+
+
+def encoder_id(backend=None):
+    # Names the vectors load_encoder(backend) produces, for caches of them
+    return f"{ENCODER_MODEL}/{backend or os.getenv('ENCODER_BACKEND', 'torch')}"
+
+
+def load_encoder(backend=None):
+    # "torch" is the stock SentenceTransformer; "onnx" and "onnx-int8" run the
+    # model exported by export_onnx_encoder.py on ONNX Runtime without torch.
+    # Both expose the same encode / get_sentence_embedding_dimension interface.
+    backend = backend or os.getenv("ENCODER_BACKEND", "torch")
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(ENCODER_MODEL)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEncoder(os.getenv("ONNX_MODEL_DIR", ONNX_MODEL_DIR),
+                           quantized=backend == "onnx-int8")
+    raise ValueError(f"Unknown encoder backend: {backend}")
+
+
+class OnnxEncoder:
+    # Mean-pooled (and, like all-MiniLM-L6-v2, L2-normalised) sentence
+    # embeddings computed with ONNX Runtime on the CPU
+
+    def __init__(self, model_dir, quantized=True, threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, "encoder_config.json")) as f:
+            config = json.load(f)
+        self.dimension = config["dimension"]
+        self.normalize = config["normalize"]
+
+        self.tokenizer = Tokenizer.from_file(
+            os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=config["max_seq_length"])
+        self.tokenizer.enable_padding(
+            pad_id=config["pad_token_id"], pad_token=config["pad_token"])
+
+        options = ort.SessionOptions()
+        threads = threads or int(os.getenv("ONNX_THREADS", 0))
+        if threads:
+            options.intra_op_num_threads = threads
+        model_file = "model_int8.onnx" if quantized else "model.onnx"
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options,
+            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def encode(self, sentences, batch_size=32, **kwargs):
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        if not sentences:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        # Batch similar lengths together to keep padding small
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        vectors = np.empty((len(sentences), self.dimension), dtype=np.float32)
+        for start in range(0, len(sentences), batch_size):
+            indices = order[start:start + batch_size]
+            vectors[indices] = self._encode_batch(
+                [sentences[i] for i in indices])
+
+        return vectors[0] if single else vectors
+
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array(
+            [e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.array(
+                [e.type_ids for e in encodings], dtype=np.int64)
+
+        token_embeddings = self.session.run(None, inputs)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / \
+            np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1,
+                              keepdims=True), 1e-12, None)
+        return pooled
@@ -0,0 +1,74 @@
+# Exports the sentence encoder to ONNX and writes a dynamically int8-quantized
+# copy next to it, for ENCODER_BACKEND=onnx / onnx-int8. Needs torch and
+# sentence-transformers once, at export time only.
+#
+#   python export_onnx_encoder.py [--output models/all-MiniLM-L6-v2-onnx]
+import argparse
+import json
+import os
+
+import torch
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from sentence_transformers import SentenceTransformer
+
+from encoders import ENCODER_MODEL, ONNX_MODEL_DIR
+
+
+class TokenEmbeddings(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                          token_type_ids=token_type_ids)[0]
+
+
+def export(model_name, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device="cpu")
+    tokenizer = st_model.tokenizer
+    transformer = st_model[0].auto_model.eval()
+
+    sample = tokenizer(["Chilonzorda 2 xonali kvartira"], return_tensors="pt")
+    model_path = os.path.join(output_dir, "model.onnx")
+    dynamic_axes = {name: {0: "batch", 1: "sequence"}
+                    for name in ("input_ids", "attention_mask", "token_type_ids")}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+    torch.onnx.export(
+        TokenEmbeddings(transformer),
+        (sample["input_ids"], sample["attention_mask"],
+         sample.get("token_type_ids", torch.zeros_like(sample["input_ids"]))),
+        model_path,
+        input_names=["input_ids", "attention_mask", "token_type_ids"],
+        output_names=["token_embeddings"],
+        dynamic_axes=dynamic_axes,
+        opset_version=14,
+    )
+    print(f"Exported {model_path}")
+
+    quantized_path = os.path.join(output_dir, "model_int8.onnx")
+    quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8)
+    print(f"Quantized {quantized_path}")
+
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, "tokenizer.json"))
+    config = {
+        "model": model_name,
+        "dimension": st_model.get_sentence_embedding_dimension(),
+        "max_seq_length": st_model.max_seq_length,
+        "normalize": any(type(module).__name__ == "Normalize" for module in st_model),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+    }
+    with open(os.path.join(output_dir, "encoder_config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    print(f"Saved tokenizer and encoder_config.json to {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the sentence encoder to ONNX (fp32 and int8)")
+    parser.add_argument("--model", default=ENCODER_MODEL)
+    parser.add_argument("--output", default=ONNX_MODEL_DIR)
+    args = parser.parse_args()
+    export(args.model, args.output)
@@ -0,0 +1,47 @@
+# Exports the Qdrant collection to a read-only snapshot (see
+# vector_store.export_snapshot) for VECTOR_SNAPSHOT_DIR. Bot processes serving
+# from the snapshot never open Qdrant, so any number of them can run next to
+# each other and next to main.py. Run it while the bot is stopped when Qdrant
+# is in local mode: the storage directory can only be opened once.
+#
+#   python export_vector_snapshot.py [--output vector_snapshot] [--hnsw]
+#                                    [--compression int8] [--pca 128]
+import argparse
+import os
+
+from qdrant_client import QdrantClient
+
+from encoders import encoder_id
+from listings import DOCUMENT_VERSION
+from vector_compression import COMPRESSIONS
+from vector_store import export_snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Qdrant collection to a vector snapshot")
+    parser.add_argument("--output", default=os.getenv("VECTOR_SNAPSHOT_DIR") or "vector_snapshot")
+    parser.add_argument("--collection", default="uybozor_data")
+    parser.add_argument("--storage", default="./qdrant_storage")
+    parser.add_argument("--url", default=os.getenv("QDRANT_URL"))
+    parser.add_argument("--compression", choices=COMPRESSIONS, default="none",
+                        help="storage of the searched copy; float32 is kept for rescoring")
+    parser.add_argument("--pca", type=int, default=None,
+                        help="reduce the searched copy to this many dimensions")
+    parser.add_argument("--hnsw", action="store_true", help="also build an hnswlib index")
+    args = parser.parse_args()
+
+    if args.url:
+        client = QdrantClient(url=args.url, api_key=os.getenv("QDRANT_API_KEY"))
+    else:
+        client = QdrantClient(path=args.storage)
+    # The collection was embedded by this configuration's encoder
+    metadata = {"encoder": encoder_id(), "document_version": DOCUMENT_VERSION}
+    count = export_snapshot(client, args.collection, args.output, hnsw=args.hnsw,
+                            compression=args.compression, pca_dimension=args.pca,
+                            metadata=metadata)
+    client.close()
+    print(f"Exported {count} points from {args.collection} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import contextlib
+import itertools
+import time
+
+from qdrant_client import models
+
+from listings import count_listings, iter_listings, listing_document, listing_payload
+
+
+class Progress:
+    # Prints points done, rate and ETA at most every `interval` seconds
+
+    def __init__(self, total, interval=5.0, label="Yuklandi"):
+        self.total = total
+        self.interval = interval
+        self.label = label
+        self.done = 0
+        self.started = self.last_report = time.perf_counter()
+
+    def advance(self, count):
+        self.done += count
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval or self.done >= self.total:
+            self.last_report = now
+            rate = self.done / max(now - self.started, 1e-9)
+            eta = (self.total - self.done) / rate if rate else 0.0
+            print(f"{self.label}: {self.done}/{self.total} "
+                  f"({rate:.0f} ta/s, qoldi ~{eta:.0f}s)")
+
+
+def encode_documents(encoder, documents, batch_size=256, cache=None):
+    if cache is not None:
+        return cache.encode(encoder, documents, batch_size)
+    return encoder.encode(documents, batch_size=batch_size)
+
+
+def embedded_points(db_path, encoder, encode_batch_size=256, progress=None, cache=None):
+    # Reads, encodes and yields points one batch at a time, so memory stays
+    # bounded by the batch size no matter how large the database is
+    for rows in iter_listings(db_path, encode_batch_size):
+        vectors = encode_documents(
+            encoder, [listing_document(row) for row in rows], encode_batch_size, cache)
+        for row, vector in zip(rows, vectors):
+            yield models.PointStruct(id=row[0], vector=vector.tolist(),
+                                     payload=listing_payload(row))
+        if progress:
+            progress.advance(len(rows))
+
+
+def ingest_listings(client, collection_name, encoder, db_path,
+                    encode_batch_size=256, upload_batch_size=256, parallel=1,
+                    progress_interval=5.0, cache=None, lock=None):
+    # `lock` is held around each upload, for collections that are being
+    # searched at the same time in local mode
+    lock = lock or contextlib.nullcontext()
+    progress = Progress(count_listings(db_path), progress_interval)
+    points = embedded_points(db_path, encoder, encode_batch_size, progress, cache)
+    if parallel > 1:
+        # Server mode: qdrant-client spreads the batches over `parallel`
+        # upload processes, pulling from the generator as they go
+        with lock:
+            client.upload_points(collection_name=collection_name, points=points,
+                                 batch_size=upload_batch_size, parallel=parallel)
+    else:
+        # Local mode collects everything it is given into one list first, so
+        # hand it one chunk at a time to keep memory bounded there as well
+        while chunk := list(itertools.islice(points, upload_batch_size)):
+            with lock:
+                client.upload_points(collection_name=collection_name, points=chunk,
+                                     batch_size=upload_batch_size)
+    return progress.done
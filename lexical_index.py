@@ -0,0 +1,93 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+
+# Cyrillic (Russian and Uzbek) to Latin, close to how people type Uzbek
+CYRILLIC_TO_LATIN = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "yo",
+    "ж": "j", "з": "z", "и": "i", "й": "y", "к": "k", "л": "l", "м": "m",
+    "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u",
+    "ф": "f", "х": "x", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "sh", "ъ": "",
+    "ы": "i", "ь": "", "э": "e", "ю": "yu", "я": "ya", "ў": "o", "қ": "q",
+    "ғ": "g", "ҳ": "h",
+}
+
+# Uzbek Latin spelling vs Russian names of the same place: Chilonzor /
+# Чиланзар, Qoraqamish / Каракамыш, Darxon / Дархан. Folding both sides
+# the same way lets them meet.
+FOLD = str.maketrans({"o": "a", "q": "k", "x": "h", "'": "", "ʻ": "", "ʼ": "", "‘": "", "’": "", "`": ""})
+
+
+def normalize(text):
+    text = "".join(CYRILLIC_TO_LATIN.get(char, char) for char in text.lower())
+    return text.translate(FOLD)
+
+
+def tokenize(text):
+    # Whole words plus character trigrams of each word, so inflected or
+    # differently spelled names ("chilonzorda") still share most tokens
+    tokens = []
+    for word in re.findall(r"\w+", normalize(text)):
+        tokens.append(word)
+        padded = f"^{word}$"
+        if len(padded) > 4:
+            tokens.extend(padded[i:i + 3] for i in range(len(padded) - 2))
+    return tokens
+
+
+class BM25Index:
+    # In-memory BM25 over listing text. Each token's postings are stored as
+    # arrays of document positions and precomputed BM25 weights, so a query
+    # is a few vectorised adds into one score array.
+
+    def __init__(self, documents, k1=1.2, b=0.75):
+        # documents: iterable of (id, text)
+        ids, counts = [], []
+        for doc_id, text in documents:
+            ids.append(doc_id)
+            counts.append(Counter(tokenize(text or "")))
+        self.ids = np.asarray(ids)
+
+        lengths = np.asarray([sum(c.values()) for c in counts], dtype=np.float32)
+        average = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+        postings = {}
+        for position, doc_counts in enumerate(counts):
+            norm = k1 * (1 - b + b * lengths[position] / average)
+            for token, tf in doc_counts.items():
+                postings.setdefault(token, []).append((position, tf * (k1 + 1) / (tf + norm)))
+
+        self.postings = {}
+        for token, entries in postings.items():
+            idf = math.log(1 + (len(ids) - len(entries) + 0.5) / (len(entries) + 0.5))
+            positions = np.fromiter((p for p, _ in entries), dtype=np.int32, count=len(entries))
+            weights = np.fromiter((w for _, w in entries), dtype=np.float32, count=len(entries))
+            self.postings[token] = (positions, weights * idf)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, query, limit=10):
+        # Ids of the best matching documents, best first
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is not None:
+                scores[posting[0]] += posting[1]
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        if len(matched) > limit:
+            matched = matched[np.argpartition(-scores[matched], limit - 1)[:limit]]
+        order = matched[np.argsort(-scores[matched], kind="stable")]
+        return [self.ids[i].item() for i in order]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    # rankings: lists of ids, best first. Returns ids by fused score.
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
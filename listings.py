@@ -0,0 +1,143 @@
+import sqlite3
+
+# One row per listing: every listings column, then its photo urls joined by
+# commas
+LISTINGS_QUERY = """
+    SELECT l.*, GROUP_CONCAT(p.photo_url) as photos
+    FROM listings l
+    LEFT JOIN photos p ON l.id = p.listing_id
+    {where}
+    GROUP BY l.id
+"""
+
+PAYLOAD_FIELDS = [
+    "id", "user_id", "operation_type", "category_id", "sub_category_id",
+    "description", "price", "price_currency", "address", "region_id",
+    "district_id", "street_id", "zone_id", "room", "lat", "lng", "square",
+    "floor", "floor_total", "is_new_building", "repair", "foundation",
+    "created_at", "updated_at", "media_count", "views", "clicks", "favorites",
+]
+
+# Payload fields build_search_filter uses, with their index types
+FILTER_INDEXES = {
+    "room": "keyword",
+    "price": "float",
+    "price_currency": "keyword",
+    "district_id": "integer",
+    "region_id": "integer",
+    "square": "float",
+    "is_new_building": "integer",
+}
+
+# Bumped whenever listing_document changes, so the sync re-embeds points
+# written with an older document format
+DOCUMENT_VERSION = 1
+
+CATEGORY_NAMES = {7: "Kvartira", 8: "Hovli uy", 10: "Tijorat binosi", 11: "Yer uchastkasi"}
+OPERATION_NAMES = {"sale": "sotiladi", "rent": "ijaraga beriladi"}
+
+
+def read_from_sqlite(db_path):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    cursor.execute(LISTINGS_QUERY.format(where=""))
+    data = cursor.fetchall()
+    conn.close()
+    return data
+
+
+def iter_listings(db_path, chunk_size=256):
+    # Same rows as read_from_sqlite, streamed in chunks of chunk_size
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.execute(LISTINGS_QUERY.format(where=""))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def count_listings(db_path):
+    conn = sqlite3.connect(db_path)
+    count = conn.execute('SELECT COUNT(*) FROM listings').fetchone()[0]
+    conn.close()
+    return count
+
+
+def listing_ids(db_path):
+    conn = sqlite3.connect(db_path)
+    ids = [listing_id for (listing_id,) in conn.execute('SELECT id FROM listings ORDER BY id')]
+    conn.close()
+    return ids
+
+
+def read_listings_by_id(db_path, ids, chunk_size=500):
+    # Same rows as read_from_sqlite, for the given listing ids only
+    conn = sqlite3.connect(db_path)
+    rows = []
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        rows += conn.execute(
+            LISTINGS_QUERY.format(where=f"WHERE l.id IN ({','.join('?' * len(chunk))})"),
+            chunk).fetchall()
+    conn.close()
+    return rows
+
+
+def read_listing_texts(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT id, COALESCE(address, '') || ' ' || COALESCE(description, '') FROM listings").fetchall()
+    conn.close()
+    return rows
+
+
+def listing_payload(row):
+    payload = dict(zip(PAYLOAD_FIELDS, row))
+    payload["document_version"] = DOCUMENT_VERSION
+    payload["photos"] = row[28].split(',') if row[28] else []
+    return payload
+
+
+def number_text(value):
+    return f"{value:.15g}" if isinstance(value, float) else str(value)
+
+
+def listing_document(row):
+    # The text embedded for a listing: its meaningful fields in a fixed order,
+    # with no ids, timestamps, counters, photo urls or empty values, so
+    # MiniLM's 256-token window goes to what users actually search for.
+    # Structured fields come first and the description last, where any
+    # truncation falls.
+    listing = dict(zip(PAYLOAD_FIELDS, row))
+    parts = []
+    kind = CATEGORY_NAMES.get(listing["category_id"], "Uy-joy")
+    operation = OPERATION_NAMES.get(listing["operation_type"])
+    parts.append(f"{kind} {operation}" if operation else kind)
+    if listing["room"] == "freeLayout":
+        parts.append("erkin reja")
+    elif listing["room"]:
+        parts.append(f"{listing['room']} xonali")
+    if listing["square"]:
+        parts.append(f"{number_text(listing['square'])} kv.m")
+    if listing["floor"] and listing["floor_total"]:
+        parts.append(f"{listing['floor']}/{listing['floor_total']} qavat")
+    elif listing["floor_total"]:
+        parts.append(f"{listing['floor_total']} qavatli")
+    if listing["price"]:
+        parts.append(f"{number_text(listing['price'])} {listing['price_currency'] or ''}".strip())
+    if listing["is_new_building"]:
+        parts.append("yangi qurilish")
+    if listing["repair"]:
+        parts.append(f"ta'mir: {listing['repair']}")
+    if listing["foundation"]:
+        parts.append(f"devor: {listing['foundation']}")
+    if listing["address"]:
+        parts.append(" ".join(listing["address"].split()))
+    document = ", ".join(parts)
+    if listing["description"]:
+        document += ". " + " ".join(listing["description"].split())
+    return document
@@ -1,8 +1,9 @@
 from qdrant_client import models, QdrantClient
-from sentence_transformers import SentenceTransformer
 import sqlite3
 import google.generativeai as genai
 import os
+from embedding_cache import EmbeddingCache
+from encoders import encoder_id, load_encoder
 
 # Load environment variables
 from dotenv import load_dotenv
@@ -11,8 +12,13 @@ load_dotenv()
 # Set up the Gemini API
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
-# Initialize the sentence transformer model
-encoder = SentenceTransformer("all-MiniLM-L6-v2")
+# Initialize the sentence encoder (ENCODER_BACKEND selects torch or ONNX)
+encoder = load_encoder()
+
+# Message embeddings keyed by text, so re-running only encodes new messages
+embedding_cache = EmbeddingCache(
+    os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"), encoder_id(),
+    encoder.get_sentence_embedding_dimension())
 
 
 def read_from_sqlite(db_path, table_name):
@@ -27,7 +33,9 @@ def read_from_sqlite(db_path, table_name):
 # Set up paths and names
 db_path = 'uybozor.db'
 table_name = 'scraped_data'
-collection_name = "uybozor_data"
+# Not uybozor_data: that name is the alias bot.py serves listings through,
+# and creating a collection under it would shadow the alias
+collection_name = "uybozor_messages"
 qdrant_storage_path = "./qdrant_storage"
 
 # Create QdrantClient with persistent storage
@@ -48,18 +56,21 @@ if not collection_exists:
         ),
     )
 
-    # Read data from SQLite and upload to Qdrant
-    data = read_from_sqlite(db_path, table_name)
+    # Read data from SQLite and upload to Qdrant. Messages are embedded with
+    # their whitespace collapsed, in one batched call through the cache.
+    data = read_from_sqlite(db_path, table_name)[:100]
+    vectors = embedding_cache.encode(
+        encoder, [" ".join((message_text or "").split()) for _, message_text in data])
 
     client.upload_points(
         collection_name=collection_name,
         points=[
             models.PointStruct(
                 id=idx,
-                vector=encoder.encode(message_text).tolist(),
+                vector=vector.tolist(),
                 payload={"link": link, "message_text": message_text}
             )
-            for idx, (link, message_text) in enumerate(data[:100], start=1)
+            for idx, ((link, message_text), vector) in enumerate(zip(data, vectors), start=1)
         ],
     )
     print("Data uploaded successfully.")
@@ -0,0 +1,173 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+from telegram import InputMediaPhoto
+from telegram.error import RetryAfter, TelegramError
+
+
+class PhotoCache:
+    # Telegram file_ids of listing photos, keyed by photo_url. Once Telegram
+    # has fetched a photo from the uybor CDN, later albums reuse its file_id,
+    # so they send without another download. All ids are kept in memory;
+    # the SQLite table only makes them survive restarts.
+
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0}
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS photo_file_ids (
+            photo_url TEXT PRIMARY KEY,
+            file_id TEXT,
+            updated_at REAL
+        )
+        ''')
+        self.conn.commit()
+        self.file_ids = dict(self.conn.execute(
+            'SELECT photo_url, file_id FROM photo_file_ids'))
+
+    def get(self, photo_url):
+        file_id = self.file_ids.get(photo_url)
+        self.counters["hits" if file_id else "misses"] += 1
+        return file_id
+
+    def store_many(self, pairs):
+        # Blocking: pairs of (photo_url, file_id)
+        self.file_ids.update(pairs)
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO photo_file_ids (photo_url, file_id, updated_at) VALUES (?, ?, ?)',
+                [(url, file_id, now) for url, file_id in pairs])
+            self.conn.commit()
+
+    def invalidate_many(self, photo_urls):
+        # Blocking: drops file_ids Telegram no longer accepts
+        for url in photo_urls:
+            self.file_ids.pop(url, None)
+        with self.lock:
+            self.conn.executemany(
+                'DELETE FROM photo_file_ids WHERE photo_url = ?', [(url,) for url in photo_urls])
+            self.conn.commit()
+        self.counters["invalidations"] += len(photo_urls)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["entries"] = len(self.file_ids)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def album_urls(photos, limit=10):
+    # The photos join repeats urls; keep the first `limit` distinct ones
+    urls = []
+    for photo in photos:
+        url = photo.strip()
+        if url and url not in urls:
+            urls.append(url)
+            if len(urls) == limit:
+                break
+    return urls
+
+
+async def send_album(bot, chat_id, urls, cache, run_blocking):
+    # Sends the photos as one album, using cached file_ids where there are
+    # any, and remembers the file_ids of the newly uploaded ones. Returns the
+    # sent messages.
+    file_ids = [cache.get(url) for url in urls]
+    if len(urls) == 1:
+        # Albums need at least two items
+        messages = [await bot.send_photo(chat_id=chat_id, photo=file_ids[0] or urls[0])]
+    else:
+        messages = await bot.send_media_group(
+            chat_id=chat_id,
+            media=[InputMediaPhoto(file_id or url) for url, file_id in zip(urls, file_ids)])
+
+    new = [(url, message.photo[-1].file_id)
+           for url, file_id, message in zip(urls, file_ids, messages)
+           if file_id is None and message.photo]
+    if new:
+        await run_blocking(cache.store_many, new)
+    return messages
+
+
+async def send_cached_album(bot, chat_id, urls, cache, run_blocking):
+    # Like send_album, but a failed send never fails the caller. When every
+    # photo went out as a cached file_id, one of them must be stale: they
+    # are dropped and the album retried from urls once. Otherwise a CDN
+    # fetch is the likelier culprit, so the cache is left alone and only the
+    # photos Telegram already has are resent. If that fails too the album
+    # is skipped.
+    cached = [url for url in urls if url in cache.file_ids]
+    try:
+        await send_album(bot, chat_id, urls, cache, run_blocking)
+        return True
+    except RetryAfter:
+        raise
+    except TelegramError as e:
+        print(f"Rasmlarni yuborishda xatolik: {e}")
+    if not cached:
+        return False
+
+    if len(cached) == len(urls):
+        await run_blocking(cache.invalidate_many, cached)
+        retry = urls
+    else:
+        retry = cached
+    try:
+        await send_album(bot, chat_id, retry, cache, run_blocking)
+        return True
+    except TelegramError as e:
+        print(f"Rasmlarni qayta yuborishda xatolik: {e}")
+        return False
+
+
+def most_viewed_listings(db_path, limit):
+    # Blocking: photo urls of the most viewed / favorited listings
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute('''
+        SELECT l.id, GROUP_CONCAT(p.photo_url)
+        FROM listings l
+        JOIN photos p ON l.id = p.listing_id
+        GROUP BY l.id
+        ORDER BY COALESCE(l.views, 0) + 10 * COALESCE(l.favorites, 0) DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+    conn.close()
+    return [(listing_id, album_urls(photos.split(','))) for listing_id, photos in rows]
+
+
+async def prewarm_photos(bot, cache, listings_db, chat_id, run_blocking,
+                         limit=100, delay=3.0):
+    # Uploads the photos of the most popular listings to a service chat so
+    # their first real send is already cached, then deletes the messages.
+    # delay keeps us under Telegram's per-chat rate limits.
+    uploaded = 0
+    for listing_id, urls in await run_blocking(most_viewed_listings, listings_db, limit):
+        missing = [url for url in urls if url not in cache.file_ids]
+        if not missing:
+            continue
+        try:
+            messages = await send_album(bot, chat_id, missing, cache, run_blocking)
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except TelegramError as e:
+            print(f"E'lon {listing_id} rasmlarini yuklab bo'lmadi: {e}")
+            continue
+        uploaded += len(missing)
+        for message in messages:
+            try:
+                await message.delete()
+            except TelegramError:
+                pass
+        await asyncio.sleep(delay)
+    return uploaded
@@ -0,0 +1,47 @@
+import re
+import sqlite3
+
+# Words people add around a place name in Uzbek, Russian and English
+PLACE_WORDS = {
+    "tumani", "tuman", "shahri", "shahar", "viloyati", "viloyat",
+    "район", "города", "город", "область", "district", "region", "city",
+}
+
+
+def normalize_place(name):
+    name = re.sub(r"[ʻʼ‘’`']", "", name.lower())
+    words = [word for word in re.findall(r"\w+", name) if word not in PLACE_WORDS]
+    return " ".join(words)
+
+
+def load_places(db_path):
+    # {"region": {normalized name: id}, "district": {...}} from the scraper's
+    # places table; empty if the listings were scraped before it existed
+    places = {"region": {}, "district": {}}
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('SELECT kind, id, name FROM places').fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+    for kind, place_id, name in rows:
+        if kind in places and normalize_place(name):
+            places[kind][normalize_place(name)] = place_id
+    return places
+
+
+def find_place(places, kind, name):
+    # Exact match on the normalized name, else a known name that starts with
+    # it ("chilonzor" -> "chilonzor"); None if unknown or ambiguous
+    if not isinstance(name, str):
+        return None
+    known = places.get(kind, {})
+    key = normalize_place(name)
+    if not key:
+        return None
+    if key in known:
+        return known[key]
+    ids = {place_id for known_name, place_id in known.items()
+           if known_name.startswith(key) or key.startswith(known_name)}
+    return ids.pop() if len(ids) == 1 else None
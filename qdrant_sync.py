@@ -0,0 +1,156 @@
+import contextlib
+import json
+import os
+import sqlite3
+import time
+
+from qdrant_client import models
+
+from ingest import encode_documents
+from listings import DOCUMENT_VERSION, listing_document, listing_payload, read_listings_by_id
+
+
+class ListingSync:
+    # Brings the Qdrant collection up to date with uybor_listings.db without
+    # re-embedding everything. Only listings with updated_at at or past the
+    # stored watermark (all of them on the first run), or that Qdrant has
+    # never seen, are looked at in detail:
+    #   - those whose point has a different updated_at or was embedded from
+    #     an older listing_document format are re-embedded and upserted,
+    #   - the others get their photo list rewritten in the payload if it
+    #     changed, without re-embedding.
+    # Points whose listing is gone from the database are deleted; finding
+    # them takes a scroll over point ids only, no payload. A DOCUMENT_VERSION
+    # change for the whole collection is the Reindexer's job (stale()).
+    # Writes go out in small batches under `lock` (shared with searches when
+    # Qdrant runs in local mode), so it can run while the bot is serving.
+
+    def __init__(self, client, collection_name, encoder, db_path, state_path,
+                 lock=None, batch_size=64, cache=None):
+        self.client = client
+        self.collection_name = collection_name
+        self.encoder = encoder
+        self.db_path = db_path
+        self.state_path = state_path
+        self.lock = lock or contextlib.nullcontext()
+        self.batch_size = batch_size
+        self.cache = cache
+
+    def run(self):
+        started = time.perf_counter()
+        watermark = self._load_watermark()
+        listings = self._read_listings()
+        point_ids = self._read_point_ids()
+
+        # >= so listings written with the watermark's own timestamp after the
+        # last run are not missed; unchanged ones cost a payload read only
+        recent = [listing_id for listing_id, updated_at in listings.items()
+                  if watermark is None or updated_at is None or updated_at >= watermark]
+        candidates = sorted(set(recent) | (listings.keys() - point_ids))
+        photos = self._read_photos(candidates)
+        points = self._read_points([listing_id for listing_id in candidates
+                                    if listing_id in point_ids])
+
+        changed = [listing_id for listing_id in candidates
+                   if (listing_id not in points
+                       or points[listing_id][2] != DOCUMENT_VERSION
+                       or points[listing_id][0] != listings[listing_id])]
+        changed_set = set(changed)
+        photo_updates = [
+            listing_id for listing_id in candidates
+            if listing_id in points and listing_id not in changed_set
+            and set(points[listing_id][1]) != set(photos.get(listing_id, []))]
+        deleted = [point_id for point_id in point_ids if point_id not in listings]
+
+        for start in range(0, len(changed), self.batch_size):
+            self._upsert(read_listings_by_id(self.db_path, changed[start:start + self.batch_size]))
+        for start in range(0, len(deleted), self.batch_size):
+            with self.lock:
+                self.client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.PointIdsList(points=deleted[start:start + self.batch_size]))
+        for listing_id in photo_updates:
+            with self.lock:
+                self.client.set_payload(
+                    collection_name=self.collection_name,
+                    payload={"photos": photos.get(listing_id, [])},
+                    points=[listing_id])
+
+        if listings:
+            self._save_watermark(max(filter(None, listings.values()), default=watermark))
+        return {
+            "upserted": len(changed),
+            "deleted": len(deleted),
+            "photos_updated": len(photo_updates),
+            "seconds": time.perf_counter() - started,
+        }
+
+    def _read_listings(self):
+        conn = sqlite3.connect(self.db_path)
+        listings = dict(conn.execute('SELECT id, updated_at FROM listings'))
+        conn.close()
+        return listings
+
+    def _read_photos(self, listing_ids):
+        photos = {}
+        conn = sqlite3.connect(self.db_path)
+        for start in range(0, len(listing_ids), 500):
+            chunk = listing_ids[start:start + 500]
+            for listing_id, url in conn.execute(
+                    f'SELECT DISTINCT listing_id, photo_url FROM photos '
+                    f'WHERE listing_id IN ({",".join("?" * len(chunk))}) ORDER BY id', chunk):
+                photos.setdefault(listing_id, []).append(url)
+        conn.close()
+        return photos
+
+    def _read_point_ids(self):
+        point_ids, offset = set(), None
+        while True:
+            with self.lock:
+                records, offset = self.client.scroll(
+                    collection_name=self.collection_name, limit=1000, offset=offset,
+                    with_payload=False, with_vectors=False)
+            point_ids.update(record.id for record in records)
+            if offset is None:
+                return point_ids
+
+    def _read_points(self, point_ids):
+        # point id -> (updated_at, photos, document_version)
+        points = {}
+        for start in range(0, len(point_ids), 1000):
+            with self.lock:
+                records = self.client.retrieve(
+                    collection_name=self.collection_name, ids=point_ids[start:start + 1000],
+                    with_payload=["updated_at", "photos", "document_version"], with_vectors=False)
+            for record in records:
+                points[record.id] = (record.payload.get("updated_at"),
+                                     record.payload.get("photos") or [],
+                                     record.payload.get("document_version"))
+        return points
+
+    def _upsert(self, rows):
+        vectors = encode_documents(
+            self.encoder, [listing_document(row) for row in rows], self.batch_size, self.cache)
+        batch = [models.PointStruct(id=row[0], vector=vector.tolist(), payload=listing_payload(row))
+                 for row, vector in zip(rows, vectors)]
+        with self.lock:
+            self.client.upsert(collection_name=self.collection_name, points=batch)
+
+    def _load_watermark(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f).get(self.collection_name)
+        except (OSError, ValueError):
+            return None
+
+    def _save_watermark(self, watermark):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state[self.collection_name] = watermark
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
@@ -0,0 +1,110 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SemanticQueryCache:
+    # Caches the result cards of a search under the embedding of its query.
+    # A new query whose embedding is close enough (cosine similarity above the
+    # threshold) to a stored one, with the same filters, reuses its cards and
+    # skips both the vector search and the description calls.
+
+    def __init__(self, threshold=0.92, ttl=3600, max_entries=5000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # Entries are only added at the back and removed from the front
+        # (expiry, eviction), so they stay in creation order and their keys
+        # are consecutive numbers from first_key. Entry `key`'s vector is row
+        # key % len(matrix) of a ring buffer that doubles up to max_entries.
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.first_key = 0
+        self.matrix = None
+        self.counters = {"hits": 0, "misses": 0, "expired": 0,
+                         "evictions": 0, "invalidations": 0}
+
+    def lookup(self, vector, filters_key):
+        vector = self._normalize(vector)
+        with self.lock:
+            self._expire()
+            if not self.entries:
+                self.counters["misses"] += 1
+                return None
+
+            keys = np.arange(self.first_key, self.first_key + len(self.entries))
+            scores = (self.matrix @ vector)[keys % len(self.matrix)]
+            for index in np.argsort(-scores):
+                if scores[index] < self.threshold:
+                    break
+                entry = self.entries[int(keys[index])]
+                if entry["filters_key"] == filters_key:
+                    self.counters["hits"] += 1
+                    return entry["cards"]
+
+            self.counters["misses"] += 1
+            return None
+
+    def store(self, vector, filters_key, cards):
+        vector = self._normalize(vector)
+        entry = {
+            "filters_key": filters_key,
+            "cards": cards,
+            "created": time.monotonic(),
+        }
+        with self.lock:
+            key = next(self.ids)
+            if not self.entries:
+                self.first_key = key
+            if self.matrix is None:
+                self.matrix = np.zeros((min(16, self.max_entries), vector.shape[0]), dtype=np.float32)
+            elif len(self.entries) == len(self.matrix) < self.max_entries:
+                self._grow()
+            self.entries[key] = entry
+            self.matrix[key % len(self.matrix)] = vector
+            while len(self.entries) > self.max_entries:
+                self._pop_oldest()
+                self.counters["evictions"] += 1
+
+    def invalidate(self):
+        # Called whenever the collection behind the cached results changes
+        with self.lock:
+            self.entries.clear()
+            self.counters["invalidations"] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _expire(self):
+        # Oldest first; stops at the first entry still within the TTL
+        deadline = time.monotonic() - self.ttl
+        while self.entries and self.entries[self.first_key]["created"] < deadline:
+            self._pop_oldest()
+            self.counters["expired"] += 1
+
+    def _pop_oldest(self):
+        del self.entries[self.first_key]
+        self.first_key += 1
+
+    def _grow(self):
+        # Doubles the ring buffer, moving the live rows to their new slots
+        keys = np.arange(self.first_key, self.first_key + len(self.entries))
+        matrix = np.zeros((min(2 * len(self.matrix), self.max_entries), self.matrix.shape[1]),
+                          dtype=np.float32)
+        matrix[keys % len(matrix)] = self.matrix[keys % len(self.matrix)]
+        self.matrix = matrix
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
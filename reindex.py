@@ -0,0 +1,399 @@
+# Zero-downtime reindex. The bot searches and syncs through the Qdrant alias
+# uybozor_data; the points live in versioned collections uybozor_data_v1,
+# uybozor_data_v2, ... A reindex:
+#   1. creates the next version next to the live one and fills it from the
+#      newest compatible snapshot (build_index.py), or by embedding every
+#      listing,
+#   2. catches it up with the database with a ListingSync of its own,
+#   3. validates it: one point per listing, sampled listings find
+#      themselves, the sample queries return results,
+#   4. moves the alias in a single update_collection_aliases call, so every
+#      request runs against either the old or the new version,
+#   5. deletes versions retired more than `grace_period` seconds ago; until
+#      then --rollback can point the alias back.
+# A collection from before versioning, named uybozor_data itself, is copied
+# to uybozor_data_v0 on the first switch and retired like any other version.
+# A failed build or validation deletes the new collection and leaves the
+# alias alone. The state file records the encoder and listing document
+# version each collection was built with and when it was retired.
+#
+# Local-mode storage can only be opened by one process, so run this while the
+# bot is stopped there; the bot reindexes by itself when the listing document
+# version changes. Against a Qdrant server it runs next to the serving bots,
+# which leave versioned rebuilds and --gc to it unless AUTO_REINDEX=1 (one
+# bot only: the state files are per host).
+#
+#   python reindex.py [--db uybor_listings.db] [--url http://localhost:6333]
+#   python reindex.py --gc
+#   python reindex.py --rollback
+import argparse
+import contextlib
+import json
+import os
+import re
+import sys
+import time
+
+from encoders import encoder_id
+from ingest import encode_documents, ingest_listings
+from listings import (DOCUMENT_VERSION, FILTER_INDEXES, count_listings, listing_document,
+                      listing_ids, read_listings_by_id)
+from qdrant_sync import ListingSync
+from vector_store import find_snapshot, restore_snapshot
+
+# Every one of these has to return something from a new collection
+VALIDATION_QUERIES = [
+    "Chilonzorda 2 xonali kvartira",
+    "Yunusobodda ijaraga uy",
+    "Sergelida hovli uy sotiladi",
+    "Mirzo Ulug'bek tumanida 3 xonali kvartira",
+    "Yangi binoda ta'mirlangan kvartira",
+]
+
+
+def quantization_config(quantization):
+    from qdrant_client import models
+
+    if not quantization:
+        return None
+    if quantization != "int8":
+        raise ValueError(f"Unknown QDRANT_QUANTIZATION: {quantization}")
+    return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+        type=models.ScalarType.INT8, quantile=0.99, always_ram=True))
+
+
+class Reindexer:
+    # Builds, validates and switches versions of the collection behind
+    # `alias`. `lock` is held around every Qdrant call, as for ListingSync,
+    # so in local mode it can run while the bot is searching.
+
+    def __init__(self, client, alias, encoder, db_path, state_path, sync_state_path,
+                 lock=None, cache=None, snapshot_dir=None, quantization="", datatype="float32",
+                 payload_indexes=None, encode_batch_size=256, upload_batch_size=256, parallel=1,
+                 grace_period=3600, validation_sample=50, min_self_recall=0.9):
+        self.client = client
+        self.alias = alias
+        self.encoder = encoder
+        self.db_path = db_path
+        self.state_path = state_path
+        self.sync_state_path = sync_state_path
+        self.lock = lock or contextlib.nullcontext()
+        self.cache = cache
+        self.snapshot_dir = snapshot_dir
+        self.quantization = quantization
+        self.datatype = datatype
+        self.payload_indexes = payload_indexes or {}
+        self.encode_batch_size = encode_batch_size
+        self.upload_batch_size = upload_batch_size
+        self.parallel = parallel
+        self.grace_period = grace_period
+        self.validation_sample = validation_sample
+        self.min_self_recall = min_self_recall
+        self.build_info = {"encoder": encoder_id(), "document_version": DOCUMENT_VERSION}
+
+    def versions(self):
+        # version number -> collection name
+        pattern = re.compile(rf"{re.escape(self.alias)}_v(\d+)")
+        with self.lock:
+            collections = self.client.get_collections().collections
+        return {int(match.group(1)): collection.name for collection in collections
+                if (match := pattern.fullmatch(collection.name))}
+
+    def live(self):
+        # The collection the alias points at; the alias name itself for a
+        # collection created before versioning; None when there is neither
+        with self.lock:
+            for alias in self.client.get_aliases().aliases:
+                if alias.alias_name == self.alias:
+                    return alias.collection_name
+            if self.client.collection_exists(self.alias):
+                return self.alias
+        return None
+
+    def live_build(self):
+        # What the live collection was built with; None when unknown
+        return self._load_state().get(self.live())
+
+    def stale(self):
+        build = self.live_build()
+        return build is not None and any(
+            build.get(key) != value for key, value in self.build_info.items())
+
+    def run(self):
+        started = time.perf_counter()
+        previous = self.live()
+        name = f"{self.alias}_v{max(self.versions(), default=0) + 1}"
+        self._create(name)
+        try:
+            self._fill(name)
+            report = self.validate(name, previous)
+        except Exception:
+            with self.lock:
+                self.client.delete_collection(name)
+            self._update_state(lambda state: state.pop(name, None))
+            raise
+        self.switch(name)
+        removed = self.collect_garbage()
+        return {"collection": name, "previous": previous, **report, "removed": removed,
+                "seconds": time.perf_counter() - started}
+
+    def validate(self, name, previous=None):
+        # Raises RuntimeError unless `name` looks fit to serve. `overlap` is
+        # the share of top-5 results the sample queries have in common with
+        # `previous`, when it was built with the same encoder.
+        expected = count_listings(self.db_path)
+        with self.lock:
+            count = self.client.count(collection_name=name, exact=True).count
+        if count != expected:
+            raise RuntimeError(f"{name}: {count} ta nuqta, {expected} ta e'lon")
+
+        ids = listing_ids(self.db_path)
+        sample = ids[::max(1, len(ids) // self.validation_sample)][:self.validation_sample]
+        rows = read_listings_by_id(self.db_path, sample)
+        vectors = encode_documents(self.encoder, [listing_document(row) for row in rows],
+                                   self.encode_batch_size, self.cache)
+        found = 0
+        for row, vector in zip(rows, vectors):
+            with self.lock:
+                hits = self.client.search(collection_name=name, query_vector=vector.tolist(), limit=5)
+            found += any(hit.id == row[0] for hit in hits)
+        self_recall = found / len(rows) if rows else 1.0
+        if self_recall < self.min_self_recall:
+            raise RuntimeError(f"{name}: e'lonlarning faqat {self_recall:.0%} i o'zini topdi")
+
+        comparable = previous and (self._load_state().get(previous) or {}).get(
+            "encoder") == self.build_info["encoder"]
+        overlaps = []
+        for query, vector in zip(VALIDATION_QUERIES, self.encoder.encode(VALIDATION_QUERIES)):
+            with self.lock:
+                hits = self.client.search(collection_name=name, query_vector=vector.tolist(), limit=5)
+                old_hits = self.client.search(
+                    collection_name=previous, query_vector=vector.tolist(),
+                    limit=5) if comparable else []
+            if count and not hits:
+                raise RuntimeError(f"{name}: {query!r} uchun natija yo'q")
+            if old_hits:
+                overlaps.append(len({hit.id for hit in hits} & {hit.id for hit in old_hits})
+                                / len(old_hits))
+        return {"points": count, "self_recall": self_recall,
+                "overlap": sum(overlaps) / len(overlaps) if overlaps else None}
+
+    def switch(self, name):
+        # Points the alias at `name`. Searches that already resolved the old
+        # collection finish there; it is kept for the grace period.
+        from qdrant_client import models
+
+        previous = self.live()
+        legacy = previous == self.alias
+        if legacy:
+            previous = self._preserve_legacy()
+        operations = [models.CreateAliasOperation(create_alias=models.CreateAlias(
+            collection_name=name, alias_name=self.alias))]
+        with self.lock:
+            if legacy:
+                # The collection from before versioning holds the name the
+                # alias needs; its copy serves as the retired version. Under
+                # the lock no local-mode search sees the name missing (a
+                # server can answer one search "not found" in between).
+                self.client.delete_collection(self.alias)
+            elif previous:
+                operations.insert(0, models.DeleteAliasOperation(
+                    delete_alias=models.DeleteAlias(alias_name=self.alias)))
+            self.client.update_collection_aliases(change_aliases_operations=operations)
+
+        def retire(state):
+            state[name].pop("retired_at", None)
+            if previous in state:
+                state[previous]["retired_at"] = time.time()
+        self._update_state(retire)
+        self._adopt_watermark(name)
+
+    def rollback(self):
+        # Points the alias back at the newest retired version still around
+        live = self.live()
+        state = self._load_state()
+        versions = self.versions()
+        live_version = next((version for version, name in versions.items() if name == live), None)
+        earlier = [version for version, name in versions.items()
+                   if "retired_at" in state.get(name, {})
+                   and (live_version is None or version < live_version)]
+        if not earlier:
+            raise RuntimeError(f"{self.alias} uchun qaytariladigan versiya yo'q")
+        name = versions[max(earlier)]
+        self.switch(name)
+        return name
+
+    def collect_garbage(self, now=None):
+        # Deletes versions retired at least grace_period seconds ago
+        now = now or time.time()
+        live = self.live()
+        state = self._load_state()
+        removed = []
+        for name in self.versions().values():
+            retired_at = state.get(name, {}).get("retired_at")
+            if name != live and retired_at is not None and now - retired_at >= self.grace_period:
+                with self.lock:
+                    self.client.delete_collection(name)
+                removed.append(name)
+        if removed:
+            self._update_state(lambda state: [state.pop(name, None) for name in removed])
+        return removed
+
+    def _preserve_legacy(self):
+        # Copies the collection from before versioning, which holds the
+        # alias's name, into version 0 so it stays searchable until the
+        # switch and can be rolled back to for the grace period. Batches are
+        # copied under the lock; the legacy collection keeps serving meanwhile.
+        from qdrant_client import models
+
+        name = f"{self.alias}_v0"
+        with self.lock:
+            config = self.client.get_collection(self.alias).config.params
+            if self.client.collection_exists(name):
+                self.client.delete_collection(name)
+            self.client.create_collection(
+                collection_name=name, vectors_config=config.vectors)
+        offset = None
+        while True:
+            with self.lock:
+                records, offset = self.client.scroll(
+                    collection_name=self.alias, limit=self.upload_batch_size, offset=offset,
+                    with_payload=True, with_vectors=True)
+                if records:
+                    self.client.upsert(collection_name=name, points=[
+                        models.PointStruct(id=record.id, vector=record.vector,
+                                           payload=record.payload)
+                        for record in records])
+            if offset is None:
+                break
+        # What it was built with is unknown, so a rollback to it is stale()
+        # and gets reindexed again
+        self._update_state(lambda state: state.update({name: {"created_at": time.time()}}))
+        return name
+
+    def _create(self, name):
+        from qdrant_client import models
+
+        with self.lock:
+            self.client.create_collection(
+                collection_name=name,
+                vectors_config=models.VectorParams(
+                    size=self.encoder.get_sentence_embedding_dimension(),
+                    distance=models.Distance.COSINE,
+                    datatype=models.Datatype(self.datatype),
+                    on_disk=bool(self.quantization),
+                ),
+                quantization_config=quantization_config(self.quantization),
+            )
+            for field, schema in self.payload_indexes.items():
+                self.client.create_payload_index(
+                    collection_name=name, field_name=field, field_schema=schema)
+        self._update_state(lambda state: state.update(
+            {name: {**self.build_info, "created_at": time.time()}}))
+
+    def _fill(self, name):
+        snapshot = self.snapshot_dir and find_snapshot(self.snapshot_dir, **self.build_info)
+        if snapshot:
+            restored = restore_snapshot(self.client, name, snapshot, self.upload_batch_size,
+                                        lock=self.lock)
+            print(f"{restored} ta e'lon {snapshot} dan tiklandi.")
+        else:
+            ingest_listings(self.client, name, self.encoder, self.db_path,
+                            encode_batch_size=self.encode_batch_size,
+                            upload_batch_size=self.upload_batch_size,
+                            parallel=self.parallel, cache=self.cache, lock=self.lock)
+        # Listings that changed since the snapshot was built or while the
+        # collection was filling; the sync keeps its own watermark for `name`
+        ListingSync(self.client, name, self.encoder, self.db_path, self.sync_state_path,
+                    lock=self.lock, cache=self.cache).run()
+
+    def _adopt_watermark(self, name):
+        # The alias continues from `name`'s sync watermark; a version that
+        # has none (a rollback) gets a full comparison on the next sync
+        state = self._read_json(self.sync_state_path)
+        state[self.alias] = state.pop(name, None)
+        self._write_json(self.sync_state_path, state)
+
+    def _load_state(self):
+        return self._read_json(self.state_path)
+
+    def _update_state(self, change):
+        state = self._load_state()
+        change(state)
+        self._write_json(self.state_path, state)
+
+    @staticmethod
+    def _read_json(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+def main():
+    from qdrant_client import QdrantClient
+
+    from embedding_cache import EmbeddingCache
+    from encoders import load_encoder
+
+    parser = argparse.ArgumentParser(description="Rebuild the listings collection behind its alias")
+    parser.add_argument("--db", default="uybor_listings.db")
+    parser.add_argument("--collection", default="uybozor_data", help="alias the bot searches")
+    parser.add_argument("--storage", default="./qdrant_storage")
+    parser.add_argument("--url", default=os.getenv("QDRANT_URL"))
+    parser.add_argument("--state", default=os.getenv("REINDEX_STATE", "reindex_state.json"))
+    parser.add_argument("--sync-state", default=os.getenv("QDRANT_SYNC_STATE", "qdrant_sync_state.json"))
+    parser.add_argument("--snapshots", default=os.getenv("SNAPSHOT_DIR", "snapshots"))
+    parser.add_argument("--grace", type=float, default=float(os.getenv("REINDEX_GRACE_PERIOD", 3600)),
+                        help="seconds a retired version is kept")
+    parser.add_argument("--gc", action="store_true", help="only delete expired versions")
+    parser.add_argument("--rollback", action="store_true", help="switch back to the previous version")
+    args = parser.parse_args()
+
+    if args.url:
+        client = QdrantClient(url=args.url, api_key=os.getenv("QDRANT_API_KEY"))
+    else:
+        client = QdrantClient(path=args.storage)
+    encoder = cache = None
+    if not (args.gc or args.rollback):
+        encoder = load_encoder()
+        cache = EmbeddingCache(os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache"), encoder_id(),
+                               encoder.get_sentence_embedding_dimension())
+    reindexer = Reindexer(
+        client, args.collection, encoder, args.db, args.state, args.sync_state,
+        cache=cache, snapshot_dir=args.snapshots,
+        quantization=os.getenv("QDRANT_QUANTIZATION", ""),
+        datatype=os.getenv("QDRANT_VECTOR_DATATYPE", "float32"),
+        payload_indexes=FILTER_INDEXES if args.url else None,
+        encode_batch_size=int(os.getenv("INGEST_ENCODE_BATCH", 256)),
+        upload_batch_size=int(os.getenv("INGEST_UPLOAD_BATCH", 256)),
+        parallel=int(os.getenv("INGEST_PARALLEL", 1)),
+        grace_period=args.grace)
+
+    if args.gc:
+        print(f"Removed {reindexer.collect_garbage() or 'nothing'}")
+    elif args.rollback:
+        try:
+            print(f"{args.collection} -> {reindexer.rollback()}")
+        except RuntimeError as e:
+            sys.exit(str(e))
+    else:
+        stats = reindexer.run()
+        overlap = "n/a" if stats["overlap"] is None else f"{stats['overlap']:.0%}"
+        print(f"{args.collection} -> {stats['collection']} (was {stats['previous']}): "
+              f"{stats['points']} points, self-recall {stats['self_recall']:.0%}, "
+              f"overlap with previous {overlap}, {stats['seconds']:.1f}s; "
+              f"removed {stats['removed'] or 'nothing'}")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
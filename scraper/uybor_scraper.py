@@ -1,11 +1,14 @@
-import requests
-import json
+import argparse
+import asyncio
+import random
 import sqlite3
-from datetime import datetime
+import time
 
+import httpx
 
-def create_database():
-    conn = sqlite3.connect('uybor_listings.db')
+
+def create_database(db_path='uybor_listings.db'):
+    conn = sqlite3.connect(db_path)
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS listings
                  (id INTEGER PRIMARY KEY,
@@ -44,107 +47,262 @@ def create_database():
                   photo_url TEXT,
                   FOREIGN KEY (listing_id) REFERENCES listings (id))''')
 
+    # Names of regions and districts, so the bot can turn "Chilonzor" into
+    # a district_id filter
+    c.execute('''CREATE TABLE IF NOT EXISTS places
+                 (kind TEXT,
+                  id INTEGER,
+                  name TEXT,
+                  PRIMARY KEY (kind, id, name))''')
+
     conn.commit()
     return conn
 
 
-def scrape_and_save_uybor_api():
-    url = "https://api.uybor.uz/api/v1/listings"
-    params = {
-        "mode": "search",
-        "includeFeatured": "true",
-        "limit": 100,
-        "embed": "category,subCategory,residentialComplex,region,city,district,zone,street,metro,media,user,user.avatar,user.organization,user.organization.logo",
-        "order": "upAt",
-        "operationType__eq": "sale",
-        "priceCurrency__eq": "usd",
-        "offset": 0
-    }
-
-    conn = create_database()
+def place_names(place):
+    # Embedded region/district objects carry the name either as a string or
+    # per language, e.g. {"uz": ..., "ru": ...}
+    name = place.get('name')
+    if isinstance(name, dict):
+        return [value for value in name.values() if isinstance(value, str) and value]
+    return [name] if isinstance(name, str) and name else []
+
+
+API_URL = "https://api.uybor.uz/api/v1/listings"
+SEARCH_PARAMS = {
+    "mode": "search",
+    "includeFeatured": "true",
+    "embed": "category,subCategory,residentialComplex,region,city,district,zone,street,metro,media,user,user.avatar,user.organization,user.organization.logo",
+    "order": "upAt",
+    "operationType__eq": "sale",
+    "priceCurrency__eq": "usd",
+}
+
+# Worth another try: rate limiting and server-side trouble
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def save_listings(conn, listings):
     c = conn.cursor()
+    for listing in listings:
+        c.execute('''INSERT OR REPLACE INTO listings
+                     (id, user_id, operation_type, category_id, sub_category_id,
+                      description, price, price_currency, address, region_id,
+                      district_id, street_id, zone_id, room, lat, lng, square,
+                      floor, floor_total, is_new_building, repair, foundation,
+                      created_at, updated_at, media_count, views, clicks, favorites)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                  (listing['id'],
+                   listing['userId'],
+                   listing['operationType'],
+                   listing['categoryId'],
+                   listing.get('subCategoryId'),
+                   listing['description'],
+                   listing['price'],
+                   listing['priceCurrency'],
+                   listing['address'],
+                   listing.get('regionId'),
+                   listing.get('districtId'),
+                   listing.get('streetId'),
+                   listing.get('zoneId'),
+                   listing.get('room'),
+                   listing['lat'],
+                   listing['lng'],
+                   listing.get('square'),
+                   listing.get('floor'),
+                   listing.get('floorTotal'),
+                   listing.get('isNewBuilding'),
+                   listing.get('repair'),
+                   listing.get('foundation'),
+                   listing['createdAt'],
+                   listing['updatedAt'],
+                   len(listing.get('media', [])),
+                   listing['views'],
+                   listing['clicks'],
+                   listing['favorites']))
+
+        save_places(c, listing)
+
+        # Save photo URLs; a listing seen again (on a later page, or in an
+        # earlier run) replaces its photos instead of adding them twice
+        c.execute('DELETE FROM photos WHERE listing_id = ?', (listing['id'],))
+        for media in listing.get('media', []):
+            c.execute('''INSERT INTO photos (listing_id, photo_url)
+                         VALUES (?, ?)''', (listing['id'], media['url']))
+    conn.commit()
+
+
+def save_places(c, listing):
+    # Returns the (kind, id) pairs the listing carried names for
+    found = set()
+    for kind in ('region', 'district'):
+        place = listing.get(kind)
+        if isinstance(place, dict) and place.get('id') is not None:
+            for name in place_names(place):
+                c.execute('''INSERT OR IGNORE INTO places (kind, id, name)
+                             VALUES (?, ?, ?)''', (kind, place['id'], name))
+                found.add((kind, place['id']))
+    return found
+
+
+def missing_places(conn):
+    # Region and district ids used by stored listings that have no name yet
+    rows = conn.execute('''
+        SELECT DISTINCT 'region', region_id FROM listings WHERE region_id IS NOT NULL
+        UNION
+        SELECT DISTINCT 'district', district_id FROM listings WHERE district_id IS NOT NULL
+        EXCEPT
+        SELECT kind, id FROM places
+    ''').fetchall()
+    return set(rows)
+
+
+class RateLimiter:
+    # Starts at most `rate` requests per second, however many are in flight
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0.0
+        self.next_start = 0.0
+
+    async def wait(self):
+        now = asyncio.get_running_loop().time()
+        start = max(now, self.next_start)
+        self.next_start = start + self.interval
+        await asyncio.sleep(start - now)
 
-    total_saved = 0
 
+class UyborCrawler:
+    # Fetches every page of the search: the first one for `total`, then all
+    # other offsets at once, at most `concurrency` requests in flight and
+    # `rate` started per second, over one pooled HTTP client. Failed
+    # requests are retried `retries` times, `backoff` * 2^attempt seconds
+    # apart (with jitter, or as long as Retry-After asks); a page that still
+    # fails is reported and skipped, the rest of the crawl goes on.
+
+    def __init__(self, conn, url=API_URL, page_size=100, concurrency=8, rate=5.0,
+                 retries=5, backoff=1.0, timeout=30.0):
+        self.conn = conn
+        self.url = url
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.retried = 0
+
+    async def run(self):
+        started = time.perf_counter()
+        limits = httpx.Limits(max_connections=self.concurrency,
+                              max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout) as client:
+            first = await self.fetch_page(client, 0)
+            total = first['total']
+            save_listings(self.conn, first['results'])
+            saved = len(first['results'])
+            print(f"Saved {saved}/{total} listings so far...")
+
+            pages = {asyncio.ensure_future(self.fetch_page(client, offset)): offset
+                     for offset in range(self.page_size, total, self.page_size)}
+            failed = 0
+            for page in asyncio.as_completed(pages):
+                try:
+                    data = await page
+                except (httpx.HTTPError, ValueError) as e:
+                    failed += 1
+                    print(f"Giving up on a page: {e!r}")
+                    continue
+                save_listings(self.conn, data['results'])
+                saved += len(data['results'])
+                print(f"Saved {saved}/{total} listings so far...")
+        return {"saved": saved, "total": total, "failed_pages": failed,
+                "retries": self.retried, "seconds": time.perf_counter() - started}
+
+    async def fetch_page(self, client, offset):
+        params = {**SEARCH_PARAMS, "limit": self.page_size, "offset": offset}
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+            async with self.semaphore:
+                await self.limiter.wait()
+                try:
+                    response = await client.get(self.url, params=params)
+                    response.raise_for_status()
+                    return response.json()
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                        raise
+                    retry_after = e.response.headers.get('Retry-After', '')
+                    if retry_after.isdigit():
+                        delay = float(retry_after)
+                    error = f"HTTP {e.response.status_code}"
+                except (httpx.TransportError, ValueError) as e:
+                    # Connection trouble, timeouts, a cut-off JSON body
+                    if attempt == self.retries:
+                        raise
+                    error = repr(e)
+            self.retried += 1
+            print(f"offset={offset}: {error}, retrying in {delay:.1f}s")
+            # Outside the semaphore, so other pages use the slot meanwhile
+            await asyncio.sleep(delay)
+
+
+async def backfill_places(db_path='uybor_listings.db', **options):
+    # Fills the places table of a database scraped before it existed without
+    # touching the listings: walks the search pages in order and stops as
+    # soon as every region and district id in the listings has a name
+    conn = create_database(db_path)
+    try:
+        missing = missing_places(conn)
+        crawler = UyborCrawler(conn, **options)
+        pages = 0
+        async with httpx.AsyncClient(timeout=crawler.timeout) as client:
+            offset = 0
+            while missing:
+                data = await crawler.fetch_page(client, offset)
+                pages += 1
+                c = conn.cursor()
+                for listing in data['results']:
+                    missing -= save_places(c, listing)
+                conn.commit()
+                offset += crawler.page_size
+                if not data['results'] or offset >= data['total']:
+                    break
+        print(f"Place names backfilled from {pages} pages; "
+              f"{len(missing)} region/district ids still without a name.")
+        return missing
+    finally:
+        conn.close()
+
+
+async def scrape_uybor_api(db_path='uybor_listings.db', **options):
+    conn = create_database(db_path)
+    try:
+        stats = await UyborCrawler(conn, **options).run()
+        print(f"Saved {stats['saved']} of {stats['total']} listings in {stats['seconds']:.1f}s "
+              f"({stats['retries']} retries, {stats['failed_pages']} pages failed).")
+        return stats
+    finally:
+        conn.close()
+
+
+def scrape_and_save_uybor_api(db_path='uybor_listings.db', **options):
     try:
-        while True:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-
-            if not data['results']:
-                break
-
-            for listing in data['results']:
-                c.execute('''INSERT OR REPLACE INTO listings
-                             (id, user_id, operation_type, category_id, sub_category_id,
-                              description, price, price_currency, address, region_id,
-                              district_id, street_id, zone_id, room, lat, lng, square,
-                              floor, floor_total, is_new_building, repair, foundation,
-                              created_at, updated_at, media_count, views, clicks, favorites)
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (listing['id'],
-                           listing['userId'],
-                           listing['operationType'],
-                           listing['categoryId'],
-                           listing.get('subCategoryId'),
-                           listing['description'],
-                           listing['price'],
-                           listing['priceCurrency'],
-                           listing['address'],
-                           listing.get('regionId'),
-                           listing.get('districtId'),
-                           listing.get('streetId'),
-                           listing.get('zoneId'),
-                           listing.get('room'),
-                           listing['lat'],
-                           listing['lng'],
-                           listing.get('square'),
-                           listing.get('floor'),
-                           listing.get('floorTotal'),
-                           listing.get('isNewBuilding'),
-                           listing.get('repair'),
-                           listing.get('foundation'),
-                           listing['createdAt'],
-                           listing['updatedAt'],
-                           len(listing.get('media', [])),
-                           listing['views'],
-                           listing['clicks'],
-                           listing['favorites']))
-
-                # Save photo URLs
-                for media in listing.get('media', []):
-                    c.execute('''INSERT INTO photos (listing_id, photo_url)
-                                 VALUES (?, ?)''', (listing['id'], media['url']))
-
-            conn.commit()
-            total_saved += len(data['results'])
-            print(f"Saved {total_saved} listings so far...")
-
-            params['offset'] += params['limit']
-
-            if total_saved >= data['total']:
-                break
-
-        print(
-            f"Successfully saved all {total_saved} listings to the database.")
-
-    except requests.exceptions.RequestException as e:
-        print(f"An error occurred while fetching data: {e}")
-    except json.JSONDecodeError:
+        return asyncio.run(scrape_uybor_api(db_path, **options))
+    except httpx.HTTPError as e:
+        print(f"An error occurred while fetching data: {e!r}")
+    except ValueError:
         print("Failed to parse the JSON response")
     except KeyError as e:
         print(f"Expected key not found in the response: {e}")
     except sqlite3.Error as e:
         print(f"An error occurred while working with the database: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 
-def display_data_summary():
+def display_data_summary(db_path='uybor_listings.db'):
+    conn = None
     try:
-        conn = sqlite3.connect('uybor_listings.db')
+        conn = sqlite3.connect(db_path)
         c = conn.cursor()
         c.execute("SELECT COUNT(*) FROM listings")
         count = c.fetchone()[0]
@@ -176,5 +334,21 @@ def display_data_summary():
 
 
 if __name__ == "__main__":
-    scrape_and_save_uybor_api()
-    display_data_summary()
+    parser = argparse.ArgumentParser(description="Scrape uybor.uz sale listings into SQLite")
+    parser.add_argument("--db", default="uybor_listings.db")
+    parser.add_argument("--url", default=API_URL, help="API endpoint, e.g. a local fake server")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--rate", type=float, default=5.0, help="requests started per second (0: no limit)")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--backoff", type=float, default=1.0, help="first retry delay in seconds")
+    parser.add_argument("--places-only", action="store_true",
+                        help="only fill in missing region/district names, keep the listings")
+    args = parser.parse_args()
+
+    if args.places_only:
+        asyncio.run(backfill_places(args.db, url=args.url, rate=args.rate,
+                                    retries=args.retries, backoff=args.backoff))
+        raise SystemExit
+    scrape_and_save_uybor_api(args.db, url=args.url, concurrency=args.concurrency,
+                              rate=args.rate, retries=args.retries, backoff=args.backoff)
+    display_data_summary(args.db)
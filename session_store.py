@@ -0,0 +1,194 @@
+import sqlite3
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Separates the queries of one session inside its packed bytes
+SEPARATOR = "\x1f"
+# Packed sessions start with last_used as whole seconds
+TIMESTAMP = struct.Struct("<I")
+
+
+class SessionStore:
+    # Per-user chat history, replacing the old unbounded CHAT_HISTORIES dict.
+    # A session is only the user's last few queries (the bot's side of the
+    # history is always the same line), packed with its last-use time into a
+    # single bytes object so a session costs one allocation, and sessions
+    # are evicted least-recently-used past max_entries or after idle_ttl
+    # seconds without a message. With db_path set, changed sessions are
+    # written out by save() and read back after a restart.
+
+    def __init__(self, max_entries=50000, idle_ttl=86400, max_turns=3,
+                 max_query_chars=500, db_path=None):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.max_turns = max_turns
+        self.max_query_chars = max_query_chars
+        self.sessions = OrderedDict()  # user_id -> packed session
+        self.dirty = set()
+        self.unsaved = {}  # dirty sessions evicted from memory before save()
+        self.payload_bytes = 0
+        # `lock` guards the in-memory sessions and is never held during
+        # SQLite I/O, which get/add/reset on the event loop would wait on;
+        # `db_lock` serialises the connection
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+        self.conn = None
+        if db_path:
+            self.conn = sqlite3.connect(db_path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id INTEGER PRIMARY KEY,
+                last_used INTEGER,
+                queries TEXT
+            )
+            ''')
+            self.conn.commit()
+
+    def get(self, user_id):
+        # Rendered history from memory, or None if the session has to be
+        # load()ed from the database first
+        with self.lock:
+            self._expire()
+            packed = self._entry(user_id)
+            if packed is None:
+                if self.conn is None:
+                    return ""
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits"] += 1
+            return self._render(packed)
+
+    def load(self, user_id):
+        # Blocking: reads the session from the database into memory
+        with self.lock:
+            packed = self._entry(user_id)
+        if packed is None and self.conn is not None:
+            with self.db_lock:
+                row = self.conn.execute(
+                    'SELECT last_used, queries FROM sessions WHERE user_id = ?',
+                    (user_id,)).fetchone()
+            with self.lock:
+                # A message may have created the session meanwhile
+                packed = self._entry(user_id)
+                if packed is None and row and row[0] >= time.time() - self.idle_ttl:
+                    packed = TIMESTAMP.pack(row[0]) + row[1].encode()
+                    self._put(user_id, packed, dirty=False)
+        return self._render(packed) if packed else ""
+
+    def add(self, user_id, query):
+        with self.lock:
+            self._expire()
+            packed = self._entry(user_id)
+            queries = self._queries(packed) if packed else []
+            queries.append(query[:self.max_query_chars].replace(SEPARATOR, " "))
+            self._put(user_id, self._pack(queries[-self.max_turns:]))
+
+    def reset(self, user_id):
+        with self.lock:
+            self._put(user_id, self._pack([]))
+
+    def save(self):
+        # Blocking: writes changed sessions in one transaction and drops
+        # expired ones from the database
+        if self.conn is None:
+            return 0
+        # db_lock is taken first, so a load() of a session that is only in
+        # this batch waits until it has been written
+        with self.db_lock:
+            with self.lock:
+                rows = list(self.unsaved.items())
+                rows += [(user_id, self.sessions[user_id])
+                         for user_id in self.dirty if user_id in self.sessions]
+                self.dirty.clear()
+                self.unsaved.clear()
+            try:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO sessions (user_id, last_used, queries) VALUES (?, ?, ?)',
+                    [(user_id, TIMESTAMP.unpack_from(packed)[0], packed[TIMESTAMP.size:].decode())
+                     for user_id, packed in rows])
+                self.conn.execute(
+                    'DELETE FROM sessions WHERE last_used < ?', (time.time() - self.idle_ttl,))
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                with self.lock:
+                    # Keep them for the next save, unless changed since
+                    for user_id, packed in rows:
+                        if user_id in self.sessions:
+                            self.dirty.add(user_id)
+                        else:
+                            self.unsaved.setdefault(user_id, packed)
+                raise
+        return len(rows)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = len(self.sessions)
+            stats["payload_bytes"] = self.payload_bytes
+            stats["unsaved"] = len(self.dirty) + len(self.unsaved)
+        return stats
+
+    def close(self):
+        self.save()
+        if self.conn is not None:
+            with self.db_lock:
+                self.conn.close()
+
+    def _pack(self, queries):
+        return TIMESTAMP.pack(int(time.time())) + SEPARATOR.join(queries).encode()
+
+    def _queries(self, packed):
+        text = packed[TIMESTAMP.size:].decode()
+        return text.split(SEPARATOR) if text else []
+
+    def _render(self, packed):
+        return "\n".join(f"User: {query}\nBot: Natijalar yuborildi"
+                         for query in self._queries(packed))
+
+    def _entry(self, user_id):
+        # Only writes move a session to the back, so the order stays by
+        # last use and _expire() can stop at the first live session
+        packed = self.sessions.get(user_id)
+        if packed is None and user_id in self.unsaved:
+            # Evicted but not saved yet; bring it back
+            packed = self.unsaved[user_id]
+            self._put(user_id, packed)
+        if packed is not None and TIMESTAMP.unpack_from(packed)[0] < time.time() - self.idle_ttl:
+            return None
+        return packed
+
+    def _put(self, user_id, packed, dirty=True):
+        old = self.sessions.pop(user_id, None)
+        if old is not None:
+            self.payload_bytes -= sys.getsizeof(old)
+        self.sessions[user_id] = packed
+        self.payload_bytes += sys.getsizeof(packed)
+        self.unsaved.pop(user_id, None)
+        if dirty and self.conn is not None:
+            self.dirty.add(user_id)
+
+        while len(self.sessions) > self.max_entries:
+            evicted_id, evicted = self.sessions.popitem(last=False)
+            self.payload_bytes -= sys.getsizeof(evicted)
+            if evicted_id in self.dirty:
+                self.dirty.discard(evicted_id)
+                self.unsaved[evicted_id] = evicted
+            self.counters["evictions"] += 1
+
+    def _expire(self):
+        cutoff = time.time() - self.idle_ttl
+        while self.sessions:
+            user_id, packed = next(iter(self.sessions.items()))
+            if TIMESTAMP.unpack_from(packed)[0] >= cutoff:
+                break
+            del self.sessions[user_id]
+            self.payload_bytes -= sys.getsizeof(packed)
+            self.dirty.discard(user_id)
+            self.counters["expirations"] += 1
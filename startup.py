@@ -0,0 +1,49 @@
+import time
+from contextlib import contextmanager
+
+# Process start, as close as we can get to it: startup.py is imported first
+PROCESS_START = time.perf_counter()
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StartupProfile:
+    # Records wall time and resident memory growth of each startup phase
+
+    def __init__(self):
+        self.phases = []
+        self.milestones = []
+
+    @contextmanager
+    def phase(self, name):
+        rss_before = rss_mb()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append(
+                (name, time.perf_counter() - started, rss_mb() - rss_before))
+
+    def mark(self, name):
+        # A point in time measured from process start, e.g. "accepting updates"
+        self.milestones.append((name, time.perf_counter() - PROCESS_START))
+
+    def report(self):
+        lines = [f"{'phase':<28} {'seconds':>8} {'+RSS MB':>9}"]
+        for name, seconds, rss_delta in self.phases:
+            lines.append(f"{name:<28} {seconds:8.2f} {rss_delta:9.1f}")
+        lines.append("")
+        for name, seconds in self.milestones:
+            lines.append(f"{name:<28} {seconds:8.2f}s after start")
+        lines.append(f"{'resident memory':<28} {rss_mb():8.1f} MB")
+        return "\n".join(lines)
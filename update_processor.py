@@ -0,0 +1,46 @@
+import asyncio
+import sys
+
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    # Processes updates from different chats concurrently, but the updates
+    # of one chat strictly one after another, in the order they arrived.
+    # At most `workers` handlers run at once. The chat lock is taken before
+    # a worker slot, so a user flooding the bot queues behind their own
+    # messages without holding up everyone else. PTB holds its own
+    # max_concurrent_updates semaphore for the whole of do_process_update,
+    # chat lock wait included, so any finite limit there could be filled by
+    # one flooding chat; it is left unlimited. What waits for a worker is at
+    # most one update per chat.
+
+    def __init__(self, workers):
+        super().__init__(sys.maxsize)
+        self.workers = asyncio.BoundedSemaphore(workers)
+        self.chat_locks = {}  # chat id -> [lock, updates holding or waiting]
+
+    async def do_process_update(self, update, coroutine):
+        chat = getattr(update, "effective_chat", None)
+        if chat is None:
+            async with self.workers:
+                await coroutine
+            return
+
+        entry = self.chat_locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            # asyncio.Lock is FIFO, and updates reach here in arrival order
+            async with entry[0]:
+                async with self.workers:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.chat_locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,93 @@
+import json
+import os
+
+import numpy as np
+
+COMPRESSIONS = ("none", "float16", "int8")
+
+
+class VectorCompressor:
+    # Turns L2-normalised vectors into a smaller search copy, and queries into
+    # weights to score that copy with:
+    #   - optional projection onto the top `pca_dimension` principal
+    #     directions of the (uncentred) vectors, which keeps dot products as
+    #     well as that many dimensions can,
+    #   - then float16, or int8 with a per-dimension offset and scale fitted
+    #     to the `quantile` range of a sample (outliers are clipped).
+    # A row's approximate score is row @ weights + constant; the caller
+    # rescores the best candidates against the full float32 vectors.
+
+    def __init__(self, compression="none", projection=None, offset=None, scale=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown vector compression: {compression}")
+        self.compression = compression
+        self.projection = projection
+        self.offset = offset
+        self.scale = scale
+
+    @classmethod
+    def fit(cls, sample, compression="none", pca_dimension=None, quantile=0.995):
+        sample = np.asarray(sample, dtype=np.float32)
+        projection = offset = scale = None
+        if pca_dimension and pca_dimension < sample.shape[1]:
+            _, _, components = np.linalg.svd(sample, full_matrices=False)
+            projection = np.ascontiguousarray(components[:pca_dimension].T, dtype=np.float32)
+            sample = sample @ projection
+        if compression == "int8":
+            low = np.quantile(sample, 1 - quantile, axis=0)
+            high = np.quantile(sample, quantile, axis=0)
+            offset = low.astype(np.float32)
+            scale = (np.maximum(high - low, 1e-6) / 255).astype(np.float32)
+        return cls(compression, projection, offset, scale)
+
+    @property
+    def dtype(self):
+        return {"none": np.float32, "float16": np.float16, "int8": np.int8}[self.compression]
+
+    @property
+    def is_identity(self):
+        return self.compression == "none" and self.projection is None
+
+    def dimension(self, source_dimension):
+        return source_dimension if self.projection is None else self.projection.shape[1]
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.projection is not None:
+            vectors = vectors @ self.projection
+        if self.compression == "int8":
+            codes = np.clip(np.rint((vectors - self.offset) / self.scale), 0, 255) - 128
+            return codes.astype(np.int8)
+        return vectors.astype(self.dtype)
+
+    def prepare(self, query):
+        # (weights, constant) for one float32 query
+        if self.projection is not None:
+            query = query @ self.projection
+        if self.compression == "int8":
+            # x ~ (code + 128) * scale + offset
+            weights = query * self.scale
+            return weights.astype(np.float32), float(128 * weights.sum() + query @ self.offset)
+        return query.astype(np.float32), 0.0
+
+    def save(self, directory):
+        with open(os.path.join(directory, "compression.json"), "w") as f:
+            json.dump({"compression": self.compression,
+                       "pca_dimension": None if self.projection is None else self.projection.shape[1]}, f)
+        for name in ("projection", "offset", "scale"):
+            if getattr(self, name) is not None:
+                np.save(os.path.join(directory, f"compression_{name}.npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory):
+        # None for a snapshot without a compressed search copy
+        path = os.path.join(directory, "compression.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            compression = json.load(f)["compression"]
+        arrays = {}
+        for name in ("projection", "offset", "scale"):
+            array_path = os.path.join(directory, f"compression_{name}.npy")
+            arrays[name] = np.load(array_path) if os.path.exists(array_path) else None
+        return cls(compression, **arrays)
@@ -0,0 +1,426 @@
+import contextlib
+import json
+import mmap
+import os
+import shutil
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from vector_compression import VectorCompressor
+
+# What both stores return; the same id / score / payload attributes as
+# Qdrant's ScoredPoint and Record
+Hit = namedtuple("Hit", ["id", "score", "payload"])
+
+# Bumped when the on-disk layout changes; find_snapshot skips other formats
+SNAPSHOT_FORMAT = 1
+
+# Keyword payload fields with more distinct values than this, or than half
+# the points (descriptions, addresses, dates), get no filter column in a
+# snapshot
+MAX_KEYWORD_VALUES = 1024
+
+
+class QdrantStore:
+    # search / retrieve straight against a Qdrant collection. With
+    # `oversampling`, searches on a quantized collection rescore that many
+    # candidates per result with the original vectors.
+
+    def __init__(self, client, collection_name, lock=None, oversampling=None):
+        self.client = client
+        self.collection_name = collection_name
+        self.lock = lock or contextlib.nullcontext()
+        self.search_params = None
+        if oversampling:
+            from qdrant_client import models
+
+            self.search_params = models.SearchParams(quantization=models.QuantizationSearchParams(
+                rescore=True, oversampling=oversampling))
+
+    def search(self, vector, k, filter=None):
+        with self.lock:
+            return self.client.search(
+                collection_name=self.collection_name, query_vector=vector,
+                query_filter=filter, search_params=self.search_params, limit=k)
+
+    def retrieve(self, ids, filter=None):
+        # Points with the given ids that pass filter, in the order of ids
+        from qdrant_client import models
+
+        conditions = [models.HasIdCondition(has_id=list(ids))]
+        if filter is not None:
+            conditions.append(filter)
+        with self.lock:
+            records, _ = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=models.Filter(must=conditions), limit=len(ids))
+        by_id = {record.id: record for record in records}
+        return [by_id[point_id] for point_id in ids if point_id in by_id]
+
+
+def write_snapshot(directory, batches, count, dimension, hnsw=False, compression="none",
+                   pca_dimension=None, sample_size=20000, metadata=None):
+    # Writes a read-only snapshot of `count` points to `directory`. batches
+    # yields (ids, vectors, payloads) lists. On disk:
+    #   vectors.npy   (count, dimension) float32, L2-normalised
+    #   search.npy    optional compressed copy searched instead of vectors.npy
+    #                 (float16 / int8, optionally PCA-reduced; see
+    #                 vector_compression.py), plus its compression.json
+    #   ids.npy       point ids, row for row
+    #   payloads.bin  JSON payloads back to back, sliced by offsets.npy
+    #   columns/      one array per filterable payload field
+    #   hnsw.bin      optional hnswlib graph over the rows
+    #   meta.json     `metadata`, format, counts, compression and keyword
+    #                 vocabularies
+    # Everything is written next to `directory` and moved into place at the
+    # end, so processes that already mapped an older snapshot keep their
+    # files and new ones never see half a snapshot.
+    staging = f"{directory}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(os.path.join(staging, "columns"))
+
+    vectors = np.lib.format.open_memmap(
+        os.path.join(staging, "vectors.npy"), mode="w+", dtype=np.float32, shape=(count, dimension))
+    ids = np.zeros(count, dtype=np.int64)
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    # Only scalar payload fields are kept in memory for the filter columns;
+    # a field is dropped (and its values freed) as soon as it holds a list
+    # or dict, or more distinct strings than a keyword column may have
+    values = {}
+    distinct = {}
+    skipped = set()
+    row = 0
+    with open(os.path.join(staging, "payloads.bin"), "wb") as payloads:
+        for batch_ids, batch_vectors, batch_payloads in batches:
+            if not len(batch_ids):
+                continue
+            if row + len(batch_ids) > count:
+                break
+            batch = np.asarray(batch_vectors, dtype=np.float32)
+            norms = np.linalg.norm(batch, axis=1, keepdims=True)
+            vectors[row:row + len(batch_ids)] = batch / np.where(norms == 0, 1, norms)
+            for point_id, payload in zip(batch_ids, batch_payloads):
+                ids[row] = point_id
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                payloads.write(data)
+                offsets[row + 1] = offsets[row] + len(data)
+                for key, value in payload.items():
+                    if key in skipped:
+                        continue
+                    if isinstance(value, str):
+                        seen = distinct.setdefault(key, set())
+                        seen.add(value)
+                        scalar = len(seen) <= MAX_KEYWORD_VALUES
+                    else:
+                        scalar = value is None or isinstance(value, (bool, int, float))
+                    if not scalar:
+                        skipped.add(key)
+                        values.pop(key, None)
+                        distinct.pop(key, None)
+                        continue
+                    values.setdefault(key, {})[row] = value
+                row += 1
+    vectors.flush()
+    del vectors
+    if row != count:
+        shutil.rmtree(staging)
+        raise RuntimeError(f"Source changed while writing the snapshot ({row} of {count} points)")
+    np.save(os.path.join(staging, "ids.npy"), ids)
+    np.save(os.path.join(staging, "offsets.npy"), offsets)
+
+    keywords = {}
+    for key, by_row in values.items():
+        present = [value for value in by_row.values() if value is not None]
+        if present and all(isinstance(value, (bool, int, float)) for value in present):
+            column = np.full(count, np.nan)
+            for position, value in by_row.items():
+                if value is not None:
+                    column[position] = value
+        elif present and all(isinstance(value, str) for value in present):
+            vocabulary = sorted(set(present))
+            if len(vocabulary) > min(MAX_KEYWORD_VALUES, max(16, count // 2)):
+                continue
+            codes = {value: code for code, value in enumerate(vocabulary)}
+            column = np.full(count, -1, dtype=np.int32)
+            for position, value in by_row.items():
+                if value is not None:
+                    column[position] = codes[value]
+            keywords[key] = vocabulary
+        else:
+            continue
+        np.save(os.path.join(staging, "columns", f"{key}.npy"), column)
+
+    source = np.load(os.path.join(staging, "vectors.npy"), mmap_mode="r")
+    compressor = VectorCompressor.fit(
+        source[np.sort(np.random.default_rng(0).permutation(count)[:sample_size])],
+        compression, pca_dimension) if count else VectorCompressor(compression)
+    if not compressor.is_identity:
+        compressed = np.lib.format.open_memmap(
+            os.path.join(staging, "search.npy"), mode="w+", dtype=compressor.dtype,
+            shape=(count, compressor.dimension(dimension)))
+        for start in range(0, count, 10000):
+            compressed[start:start + 10000] = compressor.encode(source[start:start + 10000])
+        compressed.flush()
+        del compressed
+        compressor.save(staging)
+
+    if hnsw:
+        import hnswlib
+
+        index = hnswlib.Index(space="ip", dim=dimension)
+        index.init_index(max_elements=max(count, 1), ef_construction=200, M=16)
+        for start in range(0, count, 10000):
+            chunk = np.asarray(source[start:start + 10000], dtype=np.float32)
+            index.add_items(chunk, np.arange(start, start + len(chunk)))
+        index.save_index(os.path.join(staging, "hnsw.bin"))
+    del source
+
+    with open(os.path.join(staging, "meta.json"), "w") as f:
+        json.dump({**(metadata or {}), "format": SNAPSHOT_FORMAT,
+                   "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                   "count": count, "dimension": dimension,
+                   "compression": compression, "pca_dimension": pca_dimension,
+                   "hnsw": bool(hnsw), "keywords": keywords}, f, ensure_ascii=False)
+
+    if os.path.exists(directory):
+        retired = f"{directory}.old-{os.getpid()}"
+        os.replace(directory, retired)
+        os.replace(staging, directory)
+        shutil.rmtree(retired)
+    else:
+        os.replace(staging, directory)
+    return count
+
+
+def export_snapshot(client, collection_name, directory, batch_size=1000, metadata=None, **options):
+    # Snapshot of a Qdrant collection; options as for write_snapshot
+    count = client.count(collection_name, exact=True).count
+    dimension = client.get_collection(collection_name).config.params.vectors.size
+
+    def batches():
+        offset = None
+        while True:
+            records, offset = client.scroll(
+                collection_name=collection_name, limit=batch_size, offset=offset,
+                with_payload=True, with_vectors=True)
+            yield ([record.id for record in records], [record.vector for record in records],
+                   [record.payload for record in records])
+            if offset is None:
+                return
+
+    return write_snapshot(directory, batches(), count, dimension,
+                          metadata={"collection": collection_name, **(metadata or {})}, **options)
+
+
+def find_snapshot(path, **required):
+    # `path` itself when it is a snapshot, otherwise the newest snapshot
+    # directly inside it whose meta.json matches every `required` value;
+    # None when there is none
+    candidates = [path] if os.path.exists(os.path.join(path, "meta.json")) else [
+        os.path.join(path, name) for name in (os.listdir(path) if os.path.isdir(path) else [])
+        if ".tmp-" not in name and ".old-" not in name]
+    compatible = []
+    for candidate in candidates:
+        try:
+            with open(os.path.join(candidate, "meta.json")) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if meta.get("format") == SNAPSHOT_FORMAT and all(
+                meta.get(key) == value for key, value in required.items()):
+            compatible.append((meta["created_at"], candidate))
+    return max(compatible)[1] if compatible else None
+
+
+def restore_snapshot(client, collection_name, directory, batch_size=256, lock=None):
+    # Uploads a snapshot's vectors and payloads into an existing (empty)
+    # collection, without touching the encoder; `lock` is held per batch
+    from qdrant_client import models
+
+    lock = lock or contextlib.nullcontext()
+    store = SnapshotStore(directory)
+    for start in range(0, len(store), batch_size):
+        rows = range(start, min(start + batch_size, len(store)))
+        points = [
+            models.PointStruct(id=store.ids[row].item(), vector=store.vectors[row].tolist(),
+                               payload=store.payload(row))
+            for row in rows]
+        with lock:
+            client.upload_points(collection_name=collection_name, points=points)
+    return len(store)
+
+
+class SnapshotStore:
+    # Serves a snapshot written by export_snapshot. Vectors, ids, payloads and
+    # filter columns are memory-mapped read-only, so any number of processes
+    # share one copy through the page cache. index="exact" scans with NumPy;
+    # index="hnsw" walks the hnswlib graph (each process loads its own copy)
+    # and falls back to the exact scan when a filter leaves few candidates.
+    # When the snapshot has a compressed search copy the scan runs over it,
+    # and the best k * oversampling rows are rescored against the float32
+    # vectors, which are only paged in for those rows (0 skips rescoring).
+
+    def __init__(self, directory, index="exact", ef=64, exact_below=20000, chunk_rows=2048,
+                 oversampling=4.0):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.directory = directory
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.ids = np.load(os.path.join(directory, "ids.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+        self.id_order = np.argsort(self.ids, kind="stable")
+        self.compressor = VectorCompressor.load(directory)
+        self.search_vectors = self.vectors
+        if self.compressor is not None:
+            self.search_vectors = np.load(os.path.join(directory, "search.npy"), mmap_mode="r")
+        self.oversampling = oversampling
+        self.keywords = self.meta["keywords"]
+        self.columns = {
+            name[:-4]: np.load(os.path.join(directory, "columns", name), mmap_mode="r")
+            for name in os.listdir(os.path.join(directory, "columns"))}
+        with open(os.path.join(directory, "payloads.bin"), "rb") as f:
+            self.payloads = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+        self.exact_below = exact_below
+        self.chunk_rows = chunk_rows
+
+        self.hnsw = None
+        if index == "hnsw":
+            import hnswlib
+
+            if not self.meta["hnsw"]:
+                raise ValueError(f"{directory} was exported without an HNSW index")
+            self.hnsw = hnswlib.Index(space="ip", dim=self.meta["dimension"])
+            self.hnsw.load_index(os.path.join(directory, "hnsw.bin"),
+                                 max_elements=max(len(self.ids), 1))
+            self.ef = ef
+        elif index != "exact":
+            raise ValueError(f"Unknown vector index: {index}")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, vector, k, filter=None):
+        query = np.array(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        mask = None if filter is None else self._mask(filter)
+        rows = None if mask is None else np.flatnonzero(mask)
+        if rows is not None and not len(rows):
+            return []
+
+        if self.hnsw is not None and (rows is None or len(rows) >= self.exact_below):
+            allowed = None if mask is None else (lambda row: bool(mask[row]))
+            self.hnsw.set_ef(max(self.ef, k))
+            try:
+                labels, distances = self.hnsw.knn_query(
+                    query, k=min(k, len(self.ids) if rows is None else len(rows)), filter=allowed)
+                return [self._hit(row, 1.0 - distance)
+                        for row, distance in zip(labels[0].tolist(), distances[0].tolist())]
+            except RuntimeError:
+                # The graph walk found fewer than k allowed points
+                pass
+
+        if self.compressor is None:
+            rows, scores = self._top(*self._scan(self.vectors, query, 0.0, rows), k)
+        else:
+            weights, constant = self.compressor.prepare(query)
+            rows, scores = self._scan(self.search_vectors, weights, constant, rows)
+            if self.oversampling:
+                rows, _ = self._top(rows, scores, max(k, int(k * self.oversampling)))
+                rows = np.sort(rows)
+                rows, scores = self._scan(self.vectors, query, 0.0, rows)
+            rows, scores = self._top(rows, scores, k)
+        return [self._hit(row, score) for row, score in zip(rows.tolist(), scores.tolist())]
+
+    def retrieve(self, ids, filter=None):
+        # Points with the given ids that pass filter, in the order of ids
+        if not len(self.ids):
+            return []
+        wanted = np.asarray(list(ids), dtype=np.int64)
+        found = np.searchsorted(self.ids, wanted, sorter=self.id_order)
+        rows = self.id_order[np.minimum(found, len(self.ids) - 1)]
+        rows = rows[self.ids[rows] == wanted].tolist()
+        if filter is not None and rows:
+            mask = self._mask(filter)
+            rows = [row for row in rows if mask[row]]
+        return [self._hit(row, None) for row in rows]
+
+    def payload(self, row):
+        return json.loads(self.payloads[self.offsets[row]:self.offsets[row + 1]])
+
+    def _hit(self, row, score):
+        return Hit(self.ids[row].item(), score, self.payload(row))
+
+    def _scan(self, matrix, weights, constant, rows):
+        # matrix @ weights + constant for the given rows (sorted), in chunks
+        # so a compressed copy is never upcast whole
+        if rows is None:
+            rows = np.arange(len(self.ids))
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), self.chunk_rows):
+            chunk = rows[start:start + self.chunk_rows]
+            if chunk[-1] - chunk[0] + 1 == len(chunk):
+                block = matrix[chunk[0]:chunk[-1] + 1]
+            else:
+                block = matrix[chunk]
+            scores[start:start + len(chunk)] = np.asarray(block, dtype=np.float32) @ weights
+        return rows, scores + constant
+
+    @staticmethod
+    def _top(rows, scores, k):
+        # The k best rows, best first
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind="stable")
+        return rows[order], scores[order]
+
+    def _mask(self, filter):
+        # Evaluates the subset of Qdrant's filter language the bot builds:
+        # must / should / must_not of match, match-any, range and has-id
+        # conditions, nested filters included
+        mask = np.ones(len(self.ids), dtype=bool)
+        for condition in filter.must or []:
+            mask &= self._condition(condition)
+        if filter.should:
+            mask &= np.logical_or.reduce([self._condition(c) for c in filter.should])
+        for condition in filter.must_not or []:
+            mask &= ~self._condition(condition)
+        return mask
+
+    def _condition(self, condition):
+        if hasattr(condition, "has_id"):
+            return np.isin(self.ids, np.asarray(condition.has_id, dtype=np.int64))
+        if hasattr(condition, "must") and hasattr(condition, "must_not"):
+            return self._mask(condition)
+        key = getattr(condition, "key", None)
+        if key not in self.columns:
+            raise ValueError(f"Snapshot has no filter column for {key!r}")
+        column = self.columns[key]
+        if condition.match is not None:
+            if hasattr(condition.match, "value"):
+                wanted = [condition.match.value]
+            elif hasattr(condition.match, "any"):
+                wanted = list(condition.match.any)
+            else:
+                raise ValueError(f"Unsupported match on {key!r}: {condition.match!r}")
+            if key in self.keywords:
+                vocabulary = self.keywords[key]
+                wanted = [vocabulary.index(value) for value in wanted if value in vocabulary]
+            return np.isin(column, np.asarray(wanted, dtype=column.dtype))
+        if condition.range is not None:
+            if key in self.keywords:
+                raise ValueError(f"Range on keyword field {key!r}")
+            bounds = condition.range
+            mask = ~np.isnan(column)
+            if bounds.gt is not None:
+                mask &= column > bounds.gt
+            if bounds.gte is not None:
+                mask &= column >= bounds.gte
+            if bounds.lt is not None:
+                mask &= column < bounds.lt
+            if bounds.lte is not None:
+                mask &= column <= bounds.lte
+            return mask
+        raise ValueError(f"Unsupported filter condition: {condition!r}")